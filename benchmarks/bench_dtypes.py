@@ -0,0 +1,213 @@
+"""
+Compares the float32 feature, panel and label representation of
+ml.preprocessing and ml.labels with the former float64 pandas code on the
+DAX30 data. get_reg_data and get_cls_data run for every ticker and
+label_matrix runs on the whole panel, the former code on the float64
+panel. Every call reports its run time, its peak traced memory and that
+peak in copies, the peak divided by the size of the float64 matrix it
+builds. The results of both versions are checked to agree.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_dtypes
+"""
+import contextlib
+import io
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import sklearn
+
+import data.utils.df_loader as dl
+import data.utils.web_scrappers as ws
+from ml import feature_cache as fc
+from ml import labels
+from ml import preprocessing as pp
+
+FORECAST = 120
+MB = 2 ** 20
+# feature version of the float64 features
+LEGACY_VERSION = 1
+# float32 keeps about 7 digits, scaled features are in [0, 1]
+ATOL = 1e-5
+RTOL = 1e-5
+
+
+def legacy_add_new_features(df_org, forecast_out):
+    """ Former add_new_features: float64 frame, sanitized with copies """
+    df = df_org.loc[:, ["Adj Close", "Volume"]]
+    df["high_low_pct"] = (df_org["High"] - df_org["Low"]) / df_org[
+        "Close"] * 100.0
+    df["change"] = np.log(df_org["Adj Close"]) - np.log(
+        df_org["Adj Close"].shift(1))
+    df["pct_change"] = (df_org["Close"] - df_org["Open"]) / df_org[
+        "Open"] * 100.0
+    df["daily_return"] = (df_org["Close"] / df_org["Open"]) - 1
+    df["Volume"] = np.log(df_org["Volume"])
+    df["5d_mean_log"] = df_org["Volume"].rolling(5).mean().apply(np.log)
+    df["volume_mov_avg"] = (df_org["Volume"] / df_org["Volume"].rolling(
+        200).mean()) - 1
+    df["close_vs_moving"] = (df_org["Close"] / df_org["Close"].ewm(
+        span=50).mean()) - 1
+    df["z_score"] = (df_org["Close"] - df_org["Close"].rolling(
+        window=200, min_periods=20).mean()) / df_org["Close"].rolling(
+        window=200, min_periods=20).std()
+    df["signing"] = df["pct_change"].apply(np.sign)
+    df["plus_minus"] = df["signing"].rolling(20).sum()
+    df["label"] = df["Adj Close"].shift(-forecast_out).round(3)
+    df["label"] = df["label"].interpolate(limit=3, limit_direction="both")
+    df = df.replace([np.inf, -np.inf], np.nan)
+    df.fillna(df.mean(), inplace=True)
+    return df
+
+
+def legacy_get_reg_data(ticker, forecast_out):
+    """ Former get_reg_data, always computes and saves the features """
+    df = dl.get_bars_as_df(ticker, None, pp.FEATURE_COLUMNS)
+    key = fc.make_key(ticker, df, forecast_out, LEGACY_VERSION)
+    df = legacy_add_new_features(df, forecast_out)
+    print("Description of data set: \n {}".format(df.describe()))
+    X = np.array(df.drop(["label"], axis=1))
+    scaler = sklearn.preprocessing.MinMaxScaler()
+    X = scaler.fit_transform(X)
+    X_data = X[-forecast_out:]
+    X = X[:-forecast_out]
+    data = df[-forecast_out:]
+    df = df[:-forecast_out]
+    y = np.array(df["label"])
+    fc.save(key, ticker, forecast_out, LEGACY_VERSION, X, y, df, X_data,
+            data, scaler)
+    return X, y, df, X_data, data
+
+
+def legacy_get_cls_data(ticker, panel):
+    """ Former get_cls_data on the float64 panel """
+    tickers = ws.get_tickers()
+    df = panel.fillna(0)
+    returns = labels.future_returns(df[[ticker]].values)[:, 0, :]
+    df["{}_target".format(ticker)] = labels.labels_from_returns(returns)
+    print("Dataspread:", Counter(
+        str(i) for i in df["{}_target".format(ticker)].values.tolist()))
+    keep = np.isfinite(returns).all(axis=1) & np.isfinite(df.values).all(axis=1)
+    df = df[keep]
+    df_vals = df[[ticker for ticker in tickers]].pct_change()
+    df_vals = df_vals.replace([np.inf, -np.inf], 0)
+    df_vals.fillna(0, inplace=True)
+    return df_vals.values, df["{}_target".format(ticker)].values, df
+
+
+def legacy_label_matrix(prices):
+    """ Former label_matrix over the (days x tickers x hm_days) returns """
+    return labels.labels_from_returns(labels.future_returns(prices))
+
+
+def measure(func, *args):
+    """
+    Runs func once for the time and once with traced memory
+    :return: result, seconds, peak MB
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        try:
+            result = func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, elapsed, peak / MB
+
+
+def compare(name, size, before, after):
+    """
+    Prints time, peak memory and copies at peak of both versions
+    :param size: MB of the float64 matrix the stage builds
+    :param before: list with (seconds, peak MB) of the former code
+    :param after: list with (seconds, peak MB) of the new code
+    """
+    fmt = "{:<14}{:<8}{:>10}{:>12}{:>10}"
+    for version, runs in (("before", before), ("after", after)):
+        seconds = sum(r[0] for r in runs)
+        peak = max(r[1] for r in runs)
+        print(fmt.format(name, version, "{:.3f}".format(seconds),
+                         "{:.1f}".format(peak),
+                         "{:.1f}".format(peak / size)))
+
+
+def bench_reg(tickers):
+    before, after, size = [], [], 0.0
+    for ticker in tickers:
+        old, *run = measure(legacy_get_reg_data, ticker, FORECAST)
+        before.append(run)
+        new, *run = measure(pp.get_reg_data, ticker, FORECAST, False)
+        after.append(run)
+        size = max(size, (old[0].nbytes + old[3].nbytes) / MB)
+        assert new[0].dtype == np.float32, ticker
+        for a, b in ((new[0], old[0]), (new[3], old[3]), (new[1], old[1])):
+            assert np.allclose(a, b, rtol=RTOL, atol=ATOL,
+                               equal_nan=True), ticker
+        assert new[2].index.equals(old[2].index), ticker
+    print("Features of {} tickers agree".format(len(tickers)))
+    return size, before, after
+
+
+def bench_cls(tickers, panel):
+    before, after = [], []
+    differ = 0
+    for ticker in tickers:
+        old, *run = measure(legacy_get_cls_data, ticker, panel)
+        before.append(run)
+        new, *run = measure(pp.get_cls_data, ticker)
+        after.append(run)
+        assert new[0].dtype == np.float32 and new[1].dtype == np.int8, ticker
+        assert new[2].index.equals(old[2].index), ticker
+        assert np.allclose(new[0], old[0], rtol=RTOL, atol=ATOL), ticker
+        differ += np.count_nonzero(new[1] != old[1])
+    print("Classification data of {} tickers agree, {} labels differ by the "
+          "float32 prices".format(len(tickers), differ))
+    return before, after
+
+
+def main():
+    tickers = list(ws.get_tickers())
+    directory = tempfile.mkdtemp(prefix="bench_dtypes-")
+    fc.FEATURE_CACHE_DIR = Path(directory) / "FEATURE_CACHE"
+    try:
+        # get_cls_data reads the pickled panel, both versions get its data
+        panel = dl.build_panel()
+        panel64 = dl.build_panel(dtype=np.float64)
+        assert dl.get_dax__as_df().equals(panel), \
+            "pickled panel is stale, rebuild it with compute_dax_df"
+        # load every ticker into the cache before measuring
+        for ticker in tickers:
+            dl.get_bars_as_df(ticker, None, pp.FEATURE_COLUMNS)
+
+        reg_size, reg_before, reg_after = bench_reg(tickers)
+        cls_before, cls_after = bench_cls(tickers, panel64)
+
+        old, *label_before = measure(legacy_label_matrix, panel64.values)
+        new, *label_after = measure(labels.label_matrix, panel.values)
+        assert np.array_equal(old, labels.label_matrix(panel64.values))
+        print("Labels of the float64 panel are equal, {} labels differ by the "
+              "float32 prices".format(np.count_nonzero(old != new)))
+    finally:
+        shutil.rmtree(directory)
+
+    print()
+    print("{:<14}{:<8}{:>10}{:>12}{:>10}".format(
+        "STAGE", "", "TIME [s]", "PEAK [MB]", "COPIES"))
+    panel_size = panel64.values.nbytes / MB
+    compare("get_reg_data", reg_size, reg_before, reg_after)
+    compare("get_cls_data", panel_size, cls_before, cls_after)
+    compare("label_matrix", panel_size, [label_before], [label_after])
+    print("panel: {:.1f} MB as {}, {:.1f} MB as float64".format(
+        panel.values.nbytes / MB, panel.values.dtype, panel_size))
+
+
+if __name__ == "__main__":
+    main()
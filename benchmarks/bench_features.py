@@ -0,0 +1,63 @@
+"""
+Checks that the batch feature engine of ml.features matches
+preprocessing.add_new_features for every ticker and compares their run time.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_features
+"""
+import time
+
+import numpy as np
+
+import data.utils.df_loader as dl
+import data.utils.web_scrappers as ws
+from ml import preprocessing as pp
+
+FORECAST = 120
+RTOL = 1e-6
+ATOL = 1e-8
+
+
+def check_parity(frames, forecast):
+    batch = pp.compute_features(frames, forecast)
+    for ticker, df in frames.items():
+        expected = pp.add_new_features(df, forecast)
+        result = batch[ticker]
+        assert list(result.columns) == list(expected.columns), ticker
+        assert result.index.equals(expected.index), ticker
+        for column in expected.columns:
+            assert np.allclose(result[column].values,
+                               expected[column].values, rtol=RTOL, atol=ATOL,
+                               equal_nan=True), (ticker, column)
+    print("Features of {} tickers match add_new_features".format(len(frames)))
+
+
+def timeit(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    frames = {ticker: dl.get_com_as_df(ticker, columns=pp.FEATURE_COLUMNS)
+              for ticker in ws.get_tickers()}
+    check_parity(frames, FORECAST)
+
+    def per_ticker():
+        for df in frames.values():
+            pp.add_new_features(df, FORECAST)
+
+    fmt = "{:<36}{:>10}"
+    print(fmt.format("", "time [s]"))
+    print(fmt.format("add_new_features, all tickers",
+                     "{:.4f}".format(timeit(per_ticker))))
+    print(fmt.format("compute_features, all tickers",
+                     "{:.4f}".format(timeit(pp.compute_features, frames,
+                                            FORECAST))))
+
+
+if __name__ == "__main__":
+    main()
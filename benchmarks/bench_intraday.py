@@ -0,0 +1,113 @@
+"""
+Measures ingest and resample throughput of data.utils.intraday on tens of
+millions of synthetic one second bars and checks the resampled bars
+against DataFrame.resample.
+
+The synthetic bars are written to a temporary directory, the data of the
+repository is not touched.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_intraday
+    python3 -m benchmarks.bench_intraday --tickers 40 --days 60
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.cache as cache
+import data.utils.intraday as intraday
+
+RULES = ["5min", "1h", "1d", "10d"]
+# seconds of a trading session
+SESSION = 8 * 3600
+
+
+def synthetic_bars(rng, days):
+    """
+    One second bars of a session of every business day
+    :return: dataframe with DatetimeIndex and OHLCV columns
+    """
+    sessions = pd.bdate_range("2019-01-01", periods=days) + \
+        pd.Timedelta(hours=9)
+    times = (sessions.values.astype(np.int64)[:, None] +
+             np.arange(SESSION, dtype=np.int64)[None, :] * 10 ** 9).ravel()
+    n = len(times)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.0002, n)))
+    spread = np.abs(rng.normal(0, 0.0001, n)) * close
+    return pd.DataFrame({"Open": close - spread, "High": close + spread,
+                         "Low": close - 2 * spread, "Close": close,
+                         "Volume": rng.randint(1, 500, n).astype(float)},
+                        index=pd.DatetimeIndex(times.view("M8[ns]")),
+                        columns=intraday.BAR_COLUMNS)
+
+
+def check(df, rule):
+    """ Resampled bars equal DataFrame.resample without empty bins """
+    ours = intraday.resample(df, rule)
+    ref = df.resample(rule).agg({"Open": "first", "High": "max",
+                                 "Low": "min", "Close": "last",
+                                 "Volume": "sum"}).dropna(subset=["Open"])
+    return ours.index.equals(ref.index) and np.array_equal(
+        ours[intraday.BAR_COLUMNS].values, ref[intraday.BAR_COLUMNS].values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Intraday benchmark")
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--days", type=int, default=40)
+    parser.add_argument("--csv-days", type=int, default=40,
+                        help="days of the ticker ingested from a .csv")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_intraday-")
+    intraday.INTRADAY_DIR = Path(directory) / "INTRADAY_DIR"
+    rng = np.random.RandomState(0)
+    tickers = ["I{:03d}.XX".format(i) for i in range(args.tickers)]
+    fmt = "{:<22}{:>12}{:>10}{:>16}"
+    try:
+        print(fmt.format("", "rows", "time [s]", "rows/s"))
+        rows = 0
+        elapsed = 0
+        for ticker in tickers:
+            df = synthetic_bars(rng, args.days)
+            start = time.perf_counter()
+            rows += intraday.ingest_frame(df, ticker)
+            elapsed += time.perf_counter() - start
+        print(fmt.format("ingest frames", rows, "{:.1f}".format(elapsed),
+                         "{:.0f}".format(rows / elapsed)))
+
+        csv = Path(directory) / "CSV.XX.csv"
+        df = synthetic_bars(rng, args.csv_days)
+        df.to_csv(str(csv), index_label="Datetime")
+        start = time.perf_counter()
+        n = intraday.ingest_csv(csv)
+        elapsed = time.perf_counter() - start
+        print(fmt.format("ingest .csv", n, "{:.1f}".format(elapsed),
+                         "{:.0f}".format(n / elapsed)))
+
+        for rule in RULES:
+            for label in ["cold", "cached"]:
+                # the cached run loads the saved bars from disk
+                cache.clear()
+                start = time.perf_counter()
+                for ticker in tickers:
+                    intraday.get_bars(ticker, rule)
+                elapsed = time.perf_counter() - start
+                print(fmt.format("resample {} ({})".format(rule, label),
+                                 rows, "{:.2f}".format(elapsed),
+                                 "{:.0f}".format(rows / elapsed)))
+
+        df = intraday.to_frame(intraday.read_bars(tickers[0]))
+        print("equal to DataFrame.resample: {}".format(
+            all(check(df, rule) for rule in RULES)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Checks that the vectorized labels of ml.labels equal buy_sell_hold over the
+columns of process_data_for_labels and compares their run time.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_labels
+"""
+import time
+from collections import Counter
+
+import numpy as np
+
+import data.utils.df_loader as dl
+import data.utils.web_scrappers as ws
+from ml import labels
+from ml import preprocessing as pp
+
+
+def legacy_get_cls_data(ticker):
+    """ Former get_cls_data: buy_sell_hold mapped over seven columns """
+    tickers = ws.get_tickers()
+    df = pp.process_data_for_labels(ticker)
+    df["{}_target".format(ticker)] = list(map(
+        pp.buy_sell_hold,
+        *[df["{}_{}d".format(ticker, i)] for i in range(1, labels.HM_DAYS + 1)]))
+    vals = df["{}_target".format(ticker)].values.tolist()
+    print("Dataspread:", Counter([str(i) for i in vals]))
+    df = df.fillna(0)
+    df = df.replace([np.inf, -np.inf], np.nan)
+    df = df.dropna()
+    df_vals = df[[ticker for ticker in tickers]].pct_change()
+    df_vals = df_vals.replace([np.inf, -np.inf], 0)
+    df_vals = df_vals.fillna(0)
+    return df_vals.values, df["{}_target".format(ticker)].values, df
+
+
+def check_equivalence(tickers):
+    panel = dl.get_dax__as_df()
+    matrix = labels.label_panel(panel.fillna(0))
+    for ticker in tickers:
+        X_old, y_old, df_old = legacy_get_cls_data(ticker)
+        X_new, y_new, df_new = pp.get_cls_data(ticker)
+        assert np.array_equal(X_old, X_new), ticker
+        assert np.array_equal(y_old, y_new), ticker
+        assert df_old.index.equals(df_new.index), ticker
+        assert np.array_equal(matrix.loc[df_new.index, ticker].values,
+                              y_new), ticker
+    print("Labels of {} tickers are equal".format(len(tickers)))
+
+
+def timeit(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    tickers = list(ws.get_tickers())
+    check_equivalence(tickers)
+
+    panel = dl.get_dax__as_df()
+
+    def legacy_all():
+        for ticker in tickers:
+            df = pp.process_data_for_labels(ticker)
+            list(map(pp.buy_sell_hold,
+                     *[df["{}_{}d".format(ticker, i)]
+                       for i in range(1, labels.HM_DAYS + 1)]))
+
+    fmt = "{:<36}{:>10}"
+    print(fmt.format("", "time [s]"))
+    print(fmt.format("buy_sell_hold map, all tickers",
+                     "{:.4f}".format(timeit(legacy_all, repeat=1))))
+    print(fmt.format("label_matrix, all tickers",
+                     "{:.4f}".format(timeit(labels.label_matrix,
+                                            panel.fillna(0).values))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares the panel build of df_loader.build_panel with the former
+merge loop over the shipped DAX30 .csv files.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_panel
+"""
+import time
+import tracemalloc
+
+import pandas as pd
+
+import data.utils.df_loader as dl
+import data.utils.store as store
+import data.utils.web_scrappers as ws
+
+
+def legacy_compute_dax_df(tickers):
+    """ Former compute_dax_df: one read_csv and one merge per ticker """
+    main_df = pd.DataFrame()
+    for ticker in tickers:
+        df = pd.read_csv("{}/{}.csv".format(
+            store.path_to_string(store.COM_DATA_DIR), ticker))
+        df.reset_index(inplace=True)
+        df.set_index("Date", inplace=True)
+        df.rename(columns={"Adj Close": ticker}, inplace=True)
+        df.drop(["Open", "High", "Low", "Close", "Volume"], axis=1,
+                inplace=True)
+        if main_df.empty:
+            main_df = df
+        else:
+            main_df = main_df.merge(df)
+    return main_df
+
+
+def measure(func, *args, repeat=3, **kwargs):
+    """
+    Runs func repeat times
+    :return: result, best wall time in seconds, peak memory in MB
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main():
+    tickers = ws.get_tickers()
+    store.migrate_from_csv()
+
+    fmt = "{:<28}{:>10}{:>12}{:>14}"
+    print(fmt.format("", "time [s]", "peak [MB]", "shape"))
+    df, t, peak = measure(legacy_compute_dax_df, tickers)
+    print(fmt.format("merge loop (csv)", "{:.3f}".format(t),
+                     "{:.1f}".format(peak), str(df.shape)))
+    for dtype in ["float64", "float32"]:
+        df, t, peak = measure(dl.build_panel, tickers, dtype=dtype)
+        print(fmt.format("build_panel ({})".format(dtype), "{:.3f}".format(t),
+                         "{:.1f}".format(peak), str(df.shape)))
+
+
+if __name__ == "__main__":
+    main()
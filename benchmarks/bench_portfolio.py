@@ -0,0 +1,78 @@
+"""
+Checks the vectorized portfolio simulation of ml.portfolio against a loop
+over days and times the scan of the hm_days and requirement grid.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_portfolio
+"""
+import time
+
+import numpy as np
+
+import data.utils.df_loader as dl
+from ml import labels
+from ml import portfolio
+
+HM_DAYS = list(range(1, 31))
+REQUIREMENTS = np.linspace(0.005, 0.1, 100)
+
+
+def loop_simulate(signals, prices, cost=portfolio.COST,
+                  delay=portfolio.DELAY):
+    """ Day by day reference of portfolio.simulate for one signal matrix """
+    days, tickers = signals.shape
+    prices = np.asarray(prices, dtype=np.float64)
+    equity = np.empty(days)
+    position = np.zeros(tickers)
+    value = 1.0
+    for day in range(days):
+        new = signals[day - delay] if day >= delay else np.zeros(tickers)
+        turnover = np.abs(new - position).sum() / tickers
+        position = new
+        if day > 0:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                returns = prices[day] / prices[day - 1] - 1
+            returns[~np.isfinite(returns)] = 0
+        else:
+            returns = np.zeros(tickers)
+        value *= 1 + (position * returns).sum() / tickers - turnover * cost
+        equity[day] = value
+    return equity
+
+
+def check_equivalence(prices):
+    returns = portfolio.daily_returns(prices)
+    for hm, requirement in [(1, 0.005), (7, 0.02), (30, 0.1)]:
+        signals = labels.label_matrix(prices, hm, requirement)
+        expected = loop_simulate(signals, prices)
+        result = portfolio.simulate(signals, returns)
+        assert np.allclose(result["equity"], expected, rtol=1e-9), \
+            (hm, requirement)
+    print("Vectorized simulation equals the loop over days")
+
+
+def main():
+    prices = dl.get_dax__as_df().values
+    check_equivalence(prices)
+
+    signals = labels.label_matrix(prices)
+    start = time.perf_counter()
+    loop_simulate(signals, prices)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    figures, _ = portfolio.scan_grid(prices, HM_DAYS, REQUIREMENTS)
+    grid_time = time.perf_counter() - start
+
+    fmt = "{:<44}{:>10}"
+    print(fmt.format("", "time [s]"))
+    print(fmt.format("loop over days, 1 combination",
+                     "{:.4f}".format(loop_time)))
+    print(fmt.format("scan_grid, {} combinations".format(len(figures)),
+                     "{:.4f}".format(grid_time)))
+    print(fmt.format("scan_grid per combination",
+                     "{:.6f}".format(grid_time / len(figures))))
+
+
+if __name__ == "__main__":
+    main()
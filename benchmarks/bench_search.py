@@ -0,0 +1,70 @@
+"""
+Compares the hyperparameter searches of fit_regression: wall time, number
+of fits and test R2 of RandomizedSearchCV against the successive halving
+search, cold and warm started from the search history of the first run.
+All searches of a ticker are scored on the same held out rows.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_search [TICKER ...]
+"""
+import sys
+import time
+
+import numpy as np
+
+from ml import learn, search
+from ml.preprocessing import get_reg_data
+
+TICKERS = ["ADS.DE", "BMW.DE", "SAP.DE"]
+FORECAST = 120
+# seed of the train/test split shared by all searches
+SPLIT_SEED = 42
+RUNS = [("random", "random"), ("halving", "halving (cold)"),
+        ("halving", "halving (warm)")]
+
+
+def measure(X, y, features, mode, history_key):
+    np.random.seed(42)
+    start = time.perf_counter()
+    random_search, _, confidence = learn.fit_regression(
+        X, y, features, search=mode, history_key=history_key,
+        random_state=SPLIT_SEED)
+    elapsed = time.perf_counter() - start
+    if mode == "halving":
+        n_fits = random_search.n_fits_
+    else:
+        n_fits = len(random_search.cv_results_["params"]) * \
+                 random_search.n_splits_
+    return elapsed, n_fits, confidence
+
+
+def main():
+    tickers = sys.argv[1:] or TICKERS
+    rows = []
+    for ticker in tickers:
+        X, y, df, _, data = get_reg_data(ticker, FORECAST)
+        X = np.asarray(X)
+        features = data.columns.values
+        history_key = "bench-{}-{}".format(ticker, FORECAST)
+        for mode, label in RUNS:
+            path = search.history_path(history_key)
+            if label.endswith("(cold)") and path.exists():
+                path.unlink()
+            rows.append((ticker, label) + measure(X, y, features, mode,
+                                                  history_key))
+
+    fmt = "{:<10}{:<16}{:>10}{:>8}{:>8}"
+    print(fmt.format("TICKER", "SEARCH", "time [s]", "fits", "R2"))
+    for ticker, label, elapsed, n_fits, confidence in rows:
+        print(fmt.format(ticker, label, "{:.1f}".format(elapsed), n_fits,
+                         "{:.3f}".format(confidence)))
+    for _, label in RUNS:
+        runs = [row for row in rows if row[1] == label]
+        print(fmt.format("mean", label,
+                         "{:.1f}".format(np.mean([r[2] for r in runs])),
+                         int(np.mean([r[3] for r in runs])),
+                         "{:.3f}".format(np.mean([r[4] for r in runs]))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares the feature selections of ml.selection: run time of the selection
+and out-of-sample R2 of a fixed XGBoost model on the selected columns. The
+last rows of every ticker are held out. Filling, scaling, the selection and
+the model only see the training rows before them.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_selection [TICKER ...]
+"""
+import sys
+import time
+
+import numpy as np
+from xgboost import XGBRegressor
+
+from ml import selection
+from ml.backtest import TrainScaler
+from ml.preprocessing import get_raw_reg_data
+
+TICKERS = ["ADS.DE", "BMW.DE", "SAP.DE"]
+FORECAST = 120
+TEST_SIZE = 0.3
+
+
+def split(X, y, forecast_out):
+    """
+    Chronological split of the rows, the last TEST_SIZE are held out. The
+    forecast_out rows before them are dropped because their labels are
+    prices of the held out days. Rows without label are dropped.
+    :return: X_train, X_test, y_train, y_test
+    """
+    start = int(len(X) * (1 - TEST_SIZE))
+    rows = np.arange(len(X))[np.isfinite(y)]
+    train = rows[rows < start - forecast_out]
+    test = rows[rows >= start]
+    scaler = TrainScaler().fit(X[train])
+    return (scaler.transform(X[train]), scaler.transform(X[test]),
+            y[train], y[test])
+
+
+def oos_score(X_train, X_test, y_train, y_test, indicies):
+    """ R2 on the held out rows, same split for every selection """
+    model = XGBRegressor(random_state=42, objective="reg:squarederror",
+                         n_jobs=1)
+    model.fit(X_train[:, indicies], y_train)
+    return model.score(X_test[:, indicies], y_test)
+
+
+def measure(X, y, method):
+    start = time.perf_counter()
+    indicies = selection.select_features(X, y, method=method)
+    return indicies, time.perf_counter() - start
+
+
+def main():
+    tickers = sys.argv[1:] or TICKERS
+    fmt = "{:<10}{:<20}{:>10}{:>8}  {}"
+    print(fmt.format("TICKER", "SELECTION", "time [s]", "R2", "COLUMNS"))
+    totals = {}
+    for ticker in tickers:
+        X, y, df = get_raw_reg_data(ticker, FORECAST)
+        X_train, X_test, y_train, y_test = split(X, y, FORECAST)
+        features = df.drop(["label"], axis=1).columns
+        runs = [(m, m) for m in selection.SELECTORS]
+        # second RFE run reads the ranking of the first from the cache
+        runs.append(("rfe", "rfe (cached)"))
+        for method, label in runs:
+            indicies, elapsed = measure(X_train, y_train, method)
+            score = oos_score(X_train, X_test, y_train, y_test, indicies)
+            totals.setdefault(label, []).append((elapsed, score))
+            print(fmt.format(ticker, label, "{:.2f}".format(elapsed),
+                             "{:.3f}".format(score),
+                             ", ".join(features[indicies])))
+
+    print()
+    fmt = "{:<20}{:>14}{:>10}"
+    print(fmt.format("SELECTION", "mean time [s]", "mean R2"))
+    for label, values in totals.items():
+        print(fmt.format(label, "{:.2f}".format(np.mean([v[0] for v in
+                                                          values])),
+                         "{:.3f}".format(np.mean([v[1] for v in values]))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Load test of the forecast server on localhost. Small models of a few
+tickers are fitted into a temporary registry, the server is started on a
+free port and concurrent keep-alive clients request forecasts. The answers
+are checked against predict calls of the stored models, then a new model
+version is saved and the server has to pick it up without restart.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_server
+    python3 -m benchmarks.bench_server --clients 64 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler
+from xgboost import XGBRegressor
+
+import data.utils.web_scrappers as ws
+from ml import feature_cache as fc
+from ml import registry
+from ml.preprocessing import FEATURE_VERSION, get_reg_data
+from src import server
+
+FORECAST = 30
+
+
+def fit_model(ticker, seed=0):
+    """
+    Fits a small model with the metadata do_regression stores
+    :return: version number
+    """
+    _, _, df, _, data = get_reg_data(ticker, FORECAST)
+    raw_train = df.drop(["label"], axis=1).values
+    raw_forecast = data.drop(["label"], axis=1).values
+    scaler = MinMaxScaler().fit(np.vstack([raw_train, raw_forecast]))
+    indicies = np.arange(raw_train.shape[1])
+    model = XGBRegressor(n_estimators=20, max_depth=3, random_state=seed)
+    model.fit(scaler.transform(raw_train), df["label"].values)
+    meta = {"forecast_out": FORECAST, "feature_version": FEATURE_VERSION,
+            "indicies": indicies, "scaler": scaler, "test_score": 0.0,
+            "train_start": df.index[0], "train_end": df.index[-1],
+            "train_rows": len(df)}
+    return registry.save_model(ticker, model, meta)
+
+
+def expected(ticker):
+    """ Forecast of do_regression with the newest stored model """
+    meta = registry.find_latest(ticker, forecast_out=FORECAST,
+                                feature_version=FEATURE_VERSION)
+    model, _ = registry.load_model(ticker, meta["version"])
+    _, _, _, _, data = get_reg_data(ticker, FORECAST)
+    X = meta["scaler"].transform(data.drop(["label"], axis=1).values)
+    return model.predict(X[:, meta["indicies"]])
+
+
+async def get(reader, writer, target):
+    writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n".format(
+        target).encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = next(int(line.split(b":")[1]) for line in head.split(b"\r\n")
+                  if line.lower().startswith(b"content-length"))
+    body = await reader.readexactly(length)
+    return int(head.split()[1]), json.loads(body.decode())
+
+
+async def client(port, tickers, requests, rng, answers):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for _ in range(requests):
+        ticker = tickers[rng.randint(len(tickers))]
+        days = int(rng.randint(1, FORECAST + 1))
+        status, body = await get(reader, writer, "/forecast?ticker={}&days={}"
+                                 .format(ticker, days))
+        answers.append((status, ticker, days, body))
+    writer.close()
+
+
+async def run(tickers, clients, requests):
+    srv = server.ForecastServer(tickers, FORECAST, reload_interval=0.5)
+    port = await srv.start("127.0.0.1", 0)
+    try:
+        rng = np.random.RandomState(0)
+        answers = []
+        start = time.perf_counter()
+        await asyncio.gather(*[client(port, tickers, requests,
+                                      np.random.RandomState(rng.randint(2 ** 31)),
+                                      answers)
+                               for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+        print("{} requests of {} clients in {:.2f}s ({:.0f} requests/s)".format(
+            len(answers), clients, elapsed, len(answers) / elapsed))
+
+        reference = {ticker: expected(ticker) for ticker in tickers}
+        equal = all(status == 200 and np.allclose(
+            body["forecast"], reference[ticker][:days])
+                    for status, ticker, days, body in answers)
+        print("forecasts equal predict of the stored models: {}".format(equal))
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        print("metrics:", (await get(reader, writer, "/metrics"))[1])
+        status, _ = await get(reader, writer, "/forecast?ticker=NONE.XX")
+        print("unknown ticker answered with {}".format(status))
+
+        before = srv.entries[tickers[0]]["version"]
+        version = fit_model(tickers[0], seed=1)
+        for _ in range(100):
+            await asyncio.sleep(0.1)
+            if srv.entries[tickers[0]]["version"] == version:
+                break
+        _, body = await get(reader, writer, "/forecast?ticker={}&days={}"
+                            .format(tickers[0], FORECAST))
+        print("hot reload from version {} to {}: {}".format(
+            before, body["version"], body["version"] == version and
+            np.allclose(body["forecast"], expected(tickers[0]))))
+        writer.close()
+    finally:
+        await srv.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forecast server benchmark")
+    parser.add_argument("--tickers", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=100,
+                        help="requests of every client")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_server-")
+    registry.MODEL_DIR = Path(directory) / "MODEL_DIR"
+    fc.FEATURE_CACHE_DIR = Path(directory) / "FEATURE_CACHE"
+    try:
+        tickers = list(ws.get_tickers())[:args.tickers]
+        for ticker in tickers:
+            fit_model(ticker)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(run(tickers, args.clients, args.requests))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Compares the streamed panel processing of ml.streaming with compute_panel
+and compute_features over the whole history on synthetic minute bars. The
+outputs have to be equal, the peak memory of the stream should only grow
+with the block size.
+
+The synthetic tickers are written to a temporary store, the data of the
+repository is not touched.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_streaming
+    python3 -m benchmarks.bench_streaming --tickers 50 --rows 500000
+"""
+import argparse
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.df_loader as dl
+import data.utils.store as store
+from ml import features as ft
+from ml import streaming
+
+
+def write_synthetic(n_tickers, n_rows, seed=0):
+    """
+    Writes random walk minute bars, every ticker starts at a random row
+    and misses a few bars
+    :return: list with ticker symbols
+    """
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range("2015-01-01", periods=n_rows, freq="min")
+    tickers = ["M{:04d}.XX".format(i) for i in range(n_tickers)]
+    for ticker in tickers:
+        keep = rng.uniform(size=n_rows) > 0.05
+        keep[:rng.randint(0, n_rows // 4)] = False
+        store.write_com(synthetic_bars(dates[keep], rng), ticker)
+    return tickers
+
+
+def synthetic_bars(dates, rng):
+    """ Random walk OHLCV bars on the dates """
+    n = len(dates)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    spread = close * rng.uniform(0, 0.002, n)
+    return pd.DataFrame({"Open": close + rng.normal(0, 1, n) * spread,
+                         "High": close + spread,
+                         "Low": close - spread,
+                         "Close": close,
+                         "Volume": rng.randint(100, 10000, n).astype(float),
+                         "Adj Close": close},
+                        index=pd.DatetimeIndex(dates, name="Date"))
+
+
+def in_memory(tickers):
+    """ Whole panel and the features of the whole histories in memory """
+    df = dl.build_panel(tickers, cached=False)
+    outputs = streaming.compute_panel(df.values)
+    frames = {ticker: store.read_com(ticker, ft.FIELDS, mmap=False)
+              for ticker in tickers}
+    features = ft.compute_features(frames, streaming.FORECAST, fill=False)
+    outputs[streaming.FEATURES] = streaming.align_features(
+        features, df.index.values, tickers)
+    return df.index, outputs
+
+
+def streamed(tickers, block_size):
+    streaming.write_stream("bench", tickers, block_size)
+
+
+def same(a, b):
+    """ Exact equality, NaN equals NaN """
+    a, b = np.asarray(a), np.asarray(b)
+    if a.dtype.kind != "f":
+        return np.array_equal(a, b)
+    missing = np.isnan(a)
+    return np.array_equal(missing, np.isnan(b)) and \
+        np.array_equal(a[~missing], b[~missing])
+
+
+def peak_memory(func, *args):
+    """
+    :return: result, wall time in seconds, peak memory in MB
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming benchmark")
+    parser.add_argument("--tickers", type=int, default=30)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--block-sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_streaming-")
+    store.NPY_DIR = Path(directory) / "NPY_DIR"
+    streaming.STREAM_DIR = Path(directory) / "STREAM_DIR"
+    try:
+        tickers = write_synthetic(args.tickers, args.rows)
+        fmt = "{:<24}{:>10}{:>12}{:>10}"
+        print(fmt.format("", "time [s]", "peak [MB]", "equal"))
+        (dates, expected), t, peak = peak_memory(in_memory, tickers)
+        print(fmt.format("in memory", "{:.2f}".format(t),
+                         "{:.1f}".format(peak), "-"))
+        for block_size in args.block_sizes:
+            _, t, peak = peak_memory(streamed, tickers, block_size)
+            stream_dates, outputs, _ = streaming.load_stream("bench")
+            equal = stream_dates.equals(pd.DatetimeIndex(dates)) and all(
+                same(values, expected[output])
+                for output, values in outputs.items())
+            del outputs
+            print(fmt.format("stream ({} rows)".format(block_size),
+                             "{:.2f}".format(t), "{:.1f}".format(peak),
+                             str(equal)))
+    finally:
+        shutil.rmtree(directory)
+    print("{} tickers x {} minute bars".format(args.tickers, args.rows))
+
+
+if __name__ == "__main__":
+    main()
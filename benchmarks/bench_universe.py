@@ -0,0 +1,154 @@
+"""
+Scales the chunked loader, label and feature paths from 30 to several
+thousand tickers of synthetic data. Time per ticker and peak memory should
+stay flat as the universe grows. Also compares the former list.index name
+lookup with the index of the universe.
+
+The synthetic tickers are written to a temporary store, the data of the
+repository is not touched.
+
+Run from the repository root:
+    python3 -m benchmarks.bench_universe
+    python3 -m benchmarks.bench_universe --sizes 30 300 3000 --days 2500
+"""
+import argparse
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.df_loader as dl
+import data.utils.store as store
+import data.utils.universe as uv
+from ml.labels import label_matrix
+from ml.preprocessing import FEATURE_COLUMNS, iter_features
+
+
+def synthetic_frame(rng, dates):
+    """ Random walk OHLCV bars listed at a random day of dates """
+    first = rng.randint(0, len(dates) // 2)
+    n = len(dates) - first
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    spread = np.abs(rng.normal(0, 0.01, n)) * close
+    df = pd.DataFrame({"Open": close + rng.normal(0, 0.5, n) * spread,
+                       "High": close + spread,
+                       "Low": close - spread,
+                       "Close": close,
+                       "Volume": rng.randint(1000, 10 ** 6, n).astype(float),
+                       "Adj Close": close},
+                      index=pd.DatetimeIndex(dates[first:], name="Date"),
+                      columns=FEATURE_COLUMNS)
+    return df
+
+
+def make_universe(directory, size, days, seed=0):
+    """
+    Writes size synthetic tickers to the store and imports their universe
+    :return: Universe
+    """
+    rng = np.random.RandomState(seed)
+    dates = pd.bdate_range("2010-01-01", periods=days)
+    tickers = ["S{:05d}.XX".format(i) for i in range(size)]
+    for ticker in tickers:
+        store.write_com(synthetic_frame(rng, dates), ticker)
+    path = Path(directory) / "SYN{}.csv".format(size)
+    pd.DataFrame({"ticker": tickers,
+                  "name": ["Synthetic {}".format(i) for i in range(size)],
+                  "currency": "EUR"}).to_csv(str(path), index=False)
+    return uv.update_first_dates(uv.import_universe(path))
+
+
+def run_labels(universe, chunk_size):
+    """ Chunked panel and labels, only the label counts are kept """
+    counts = np.zeros(3, dtype=np.int64)
+    for panel in dl.iter_panels(universe, chunk_size):
+        labels = label_matrix(panel.values)
+        counts += np.bincount(labels.ravel() + 1, minlength=3)
+    return counts
+
+
+def run_features(universe, forecast, chunk_size):
+    """ Chunked features, only the number of rows is kept """
+    rows = 0
+    for frames in iter_features(universe, forecast, chunk_size):
+        rows += sum(len(df) for df in frames.values())
+    return rows
+
+
+def measure(func, *args):
+    """
+    :return: best wall time of two runs in seconds, peak memory in MB
+    """
+    best = float("inf")
+    for _ in range(2):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return best, peak
+
+
+def measure_lookup(universe):
+    """
+    :return: seconds for looking up every name with list.index and with the
+    universe index
+    """
+    tickers = list(universe.tickers())
+    names = list(universe.names())
+    start = time.perf_counter()
+    for ticker in tickers:
+        names[tickers.index(ticker)]
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    for ticker in tickers:
+        universe.name_of(ticker)
+    return legacy, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Universe scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[30, 300, 3000])
+    parser.add_argument("--days", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=uv.CHUNK_SIZE)
+    parser.add_argument("--forecast", type=int, default=120)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_universe-")
+    store.NPY_DIR = Path(directory) / "NPY_DIR"
+    uv.UNIVERSE_DIR = Path(directory) / "UNIVERSES"
+    fmt = "{:>7}{:>12}{:>14}{:>12}{:>16}{:>12}{:>16}{:>14}"
+    print(fmt.format("tickers", "write [s]", "labels [ms]", "peak [MB]",
+                     "features [ms]", "peak [MB]", "list.index [ms]",
+                     "index [ms]"))
+    try:
+        for size in args.sizes:
+            start = time.perf_counter()
+            universe = make_universe(directory, size, args.days)
+            written = time.perf_counter() - start
+            t_labels, p_labels = measure(run_labels, universe,
+                                         args.chunk_size)
+            t_features, p_features = measure(run_features, universe,
+                                             args.forecast, args.chunk_size)
+            legacy, indexed = measure_lookup(universe)
+            print(fmt.format(size, "{:.1f}".format(written),
+                             "{:.2f}".format(1000 * t_labels / size),
+                             "{:.1f}".format(p_labels),
+                             "{:.2f}".format(1000 * t_features / size),
+                             "{:.1f}".format(p_features),
+                             "{:.2f}".format(1000 * legacy),
+                             "{:.2f}".format(1000 * indexed)))
+    finally:
+        shutil.rmtree(directory)
+    print("labels and features in ms per ticker, lookups of all names")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+Benchmark suite of the pipeline stages: loading the .csv files and the
+columnar store, the panel build, the labels, the features, RFE with the
+model search, the prediction and the chart rendering. Every stage is timed
+(best of several runs) and its peak memory is traced in one more run.
+Tracing the RFE and search would take several times their run time, their
+memory is the growth of the current resident memory of the process over
+its value at the start of the stage instead, sampled while it runs.
+
+The suite runs on the shipped DAX30 data and on synthetic universes given
+as TICKERSxYEARS. All data is copied or generated into a temporary
+directory with seeded random numbers, caches, models and charts are
+written there too, so the data of the repository is not touched and two
+runs compute the same outputs.
+
+A run can be saved as baseline and later runs are compared with it. The
+suite exits with status 1 if a stage got slower or needs more memory than
+the tolerances allow.
+
+Run from the repository root:
+    python3 -m benchmarks.suite --save
+    python3 -m benchmarks.suite
+    python3 -m benchmarks.suite --synthetic 3000x30 --stages load panel labels features
+    python3 -m benchmarks.suite --tolerance 0.1 --tolerance rfe_search=0.5
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import sklearn
+import xgboost
+
+import data.utils.cache as cache
+import data.utils.df_loader as dl
+import data.utils.profiling as profiling
+import data.utils.store as store
+import data.utils.universe as uv
+import data.utils.web_scrappers as ws
+from benchmarks.bench_universe import synthetic_frame
+from ml import feature_cache as fc
+from ml import learn, registry, search, selection
+from ml import preprocessing as pp
+from ml.labels import label_panel
+from plotting.utils import plotter, renderer
+
+SEED = 42
+FORECAST = 120
+REPEAT = 3
+BASELINE_DIR = Path("benchmarks/baselines")
+BASELINE = "default"
+# allowed growth of time and memory against the baseline
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.25
+# smaller differences are noise
+MIN_TIME = 0.02
+MIN_MEMORY = 2.0
+# tickers whose charts are rendered
+PLOT_TICKERS = 3
+# last day of the synthetic history
+SYNTHETIC_END = "2019-06-28"
+DAYS_PER_YEAR = 252
+MB = 2 ** 20
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def digest(value):
+    """
+    Short hash of the numbers of an output rounded to 6 digits, equal
+    outputs of two runs have equal digests
+    :param value: array, list of arrays or None
+    :return: hex string or None
+    """
+    if value is None:
+        return None
+    h = hashlib.sha1()
+    for array in value if isinstance(value, list) else [value]:
+        array = np.round(np.asarray(array, dtype=np.float64), 6)
+        h.update(np.ascontiguousarray(np.nan_to_num(array)).tobytes())
+    return h.hexdigest()[:12]
+
+
+def stage_load_csv(ctx):
+    frames = [store.read_csv(ticker) for ticker in ctx["tickers"]]
+    return [df[pp.FEATURE_COLUMNS].values for df in frames]
+
+
+def stage_load(ctx):
+    cache.clear()
+    ctx["frames"] = {ticker: dl.get_com_as_df(ticker, pp.FEATURE_COLUMNS,
+                                              cached=False)
+                     for ticker in ctx["tickers"]}
+    return [df.values for df in ctx["frames"].values()]
+
+
+def stage_panel(ctx):
+    ctx["panel"] = dl.build_panel(ctx["tickers"], cached=False)
+    return ctx["panel"].values
+
+
+def stage_labels(ctx):
+    return label_panel(ctx["panel"].fillna(0)).values
+
+
+def stage_features(ctx):
+    sums = []
+    for frames in pp.iter_features(ctx["tickers"], FORECAST):
+        sums += [np.nansum(df.values, axis=0) for df in frames.values()]
+    return sums
+
+
+def stage_reg_features(ctx):
+    ctx["reg"] = pp.get_reg_data(ctx["tickers"][0], FORECAST, use_cache=False)
+    X, y, _, X_data, _ = ctx["reg"]
+    return [X, y, X_data]
+
+
+def stage_rfe_search(ctx):
+    X, y, _, _, data = ctx["reg"]
+    selection.clear()
+    np.random.seed(SEED)
+    random_search, indicies, score = learn.fit_regression(
+        X, y, data.columns.values, selection="rfe", search="halving")
+    ctx["model"] = random_search.best_estimator_
+    ctx["indicies"] = indicies
+    return np.append(indicies, score)
+
+
+def stage_predict(ctx):
+    X_data = ctx["reg"][3][:, ctx["indicies"]]
+    return ctx["model"].predict(X_data)
+
+
+def stage_plot(ctx):
+    for ticker in ctx["tickers"][:PLOT_TICKERS]:
+        df = dl.get_com_as_df(ticker, renderer.COLUMNS)
+        for chart, (draw, columns) in renderer.CHARTS.items():
+            renderer.save_figure(draw, plotter.chart_path(ticker, chart),
+                                 plotter.DPI, df[columns], ticker, ticker)
+    return None
+
+
+# stage -> function, runs, memory traced; every stage can use what the
+# stages before it left in the context
+STAGES = [("load_csv", stage_load_csv, REPEAT, True),
+          ("load", stage_load, REPEAT, True),
+          ("panel", stage_panel, REPEAT, True),
+          ("labels", stage_labels, REPEAT, True),
+          ("features", stage_features, REPEAT, True),
+          ("reg_features", stage_reg_features, REPEAT, True),
+          ("rfe_search", stage_rfe_search, 1, False),
+          ("predict", stage_predict, REPEAT, True),
+          ("plot", stage_plot, REPEAT, True)]
+# stages which need the output of an earlier stage
+REQUIRES = {"labels": "panel", "rfe_search": "reg_features",
+            "predict": "rfe_search"}
+
+
+def measure(func, ctx, repeat, trace=True, verbose=False):
+    """
+    Runs a stage repeat times and once more with tracemalloc
+    :param trace: trace the memory in an extra run, else take the highest
+    growth of the current resident memory during the timed runs
+    :return: dict with the best time in seconds, the peak memory in MB, the
+    kind of the memory and the digest of the output
+    """
+    out = sys.stdout if verbose else io.StringIO()
+    best = float("inf")
+    sampler = profiling.RssSampler()
+    with contextlib.redirect_stdout(out):
+        with sampler:
+            for _ in range(repeat):
+                np.random.seed(SEED)
+                start = time.perf_counter()
+                value = func(ctx)
+                best = min(best, time.perf_counter() - start)
+        if trace:
+            np.random.seed(SEED)
+            tracemalloc.start()
+            func(ctx)
+            peak = tracemalloc.get_traced_memory()[1] / MB
+            tracemalloc.stop()
+        else:
+            peak = sampler.growth() / MB
+    return {"time": best, "memory": peak,
+            "memory_kind": "traced" if trace else "rss",
+            "digest": digest(value)}
+
+
+def isolate(directory):
+    """
+    Points every directory the stages write to into directory
+    """
+    directory = Path(directory)
+    store.NPY_DIR = directory / "NPY_DIR"
+    uv.UNIVERSE_DIR = directory / "UNIVERSES"
+    fc.FEATURE_CACHE_DIR = directory / "FEATURE_CACHE"
+    selection.SELECTION_CACHE_DIR = directory / "SELECTION_CACHE"
+    search.SEARCH_CACHE_DIR = directory / "SEARCH_CACHE"
+    registry.MODEL_DIR = directory / "MODEL_DIR"
+    plotter.PLOT_DIR = directory / "plots"
+    os.makedirs(path_to_string(plotter.PLOT_DIR))
+
+
+def dax_dataset():
+    """
+    Copies the shipped DAX30 .csv files into the temporary store
+    :return: list with ticker symbols
+    """
+    tickers = list(ws.get_tickers())
+    for ticker in tickers:
+        store.write_com(store.read_csv(ticker), ticker)
+    return tickers
+
+
+def synthetic_dataset(size, years, seed=SEED):
+    """
+    Writes size random walk tickers with years of history into the
+    temporary store, also as .csv for the csv loader
+    :return: list with ticker symbols
+    """
+    rng = np.random.RandomState(seed)
+    dates = pd.bdate_range(end=SYNTHETIC_END, periods=years * DAYS_PER_YEAR)
+    tickers = ["S{:05d}.XX".format(i) for i in range(size)]
+    csv_dir = store.NPY_DIR.parent / "CSV"
+    os.makedirs(path_to_string(csv_dir))
+    store.COM_DATA_DIR = csv_dir
+    for ticker in tickers:
+        df = synthetic_frame(rng, dates)
+        store.write_com(df, ticker)
+        df.to_csv(path_to_string(csv_dir / "{}.csv".format(ticker)))
+    return tickers
+
+
+def parse_synthetic(spec):
+    size, years = spec.lower().split("x")
+    return int(size), int(years)
+
+
+def with_requirements(stages):
+    """
+    :return: list with the stages and the stages they need in suite order
+    """
+    needed = set(stages)
+    for stage in reversed([s[0] for s in STAGES]):
+        if stage in needed and stage in REQUIRES:
+            needed.add(REQUIRES[stage])
+    return [s[0] for s in STAGES if s[0] in needed]
+
+
+def run_dataset(name, stages, args):
+    """
+    Prepares a dataset in a new temporary directory and measures the stages
+    :return: dict "dataset/stage" -> measurement
+    """
+    directory = tempfile.mkdtemp(prefix="bench_suite-")
+    com_data_dir = store.COM_DATA_DIR
+    results = {}
+    try:
+        isolate(directory)
+        start = time.perf_counter()
+        if name == "dax":
+            tickers = dax_dataset()
+        else:
+            tickers = synthetic_dataset(*parse_synthetic(name))
+        print("{}: {} tickers prepared in {:.1f}s".format(
+            name, len(tickers), time.perf_counter() - start))
+        ctx = {"tickers": tickers}
+        for stage, func, repeat, trace in STAGES:
+            if stage not in stages:
+                continue
+            result = measure(func, ctx, repeat, trace and not args.no_memory,
+                             args.verbose)
+            results["{}/{}".format(name, stage)] = result
+            print("  {:<14}{:>10.3f}s{:>10.1f}MB {:<7}{}".format(
+                stage, result["time"], result["memory"],
+                result["memory_kind"], result["digest"] or ""))
+    finally:
+        store.COM_DATA_DIR = com_data_dir
+        cache.clear()
+        shutil.rmtree(directory)
+    return results
+
+
+def environment():
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__,
+            "xgboost": xgboost.__version__,
+            "matplotlib": matplotlib.__version__}
+
+
+def baseline_path(name):
+    return BASELINE_DIR / "{}.json".format(name)
+
+
+def save_baseline(name, results, config):
+    if not BASELINE_DIR.exists():
+        os.makedirs(path_to_string(BASELINE_DIR))
+    path = baseline_path(name)
+    with open(path_to_string(path), "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "environment": environment(),
+                   "config": config,
+                   "results": results}, f, indent=1, sort_keys=True)
+    print("Saved baseline {}".format(path_to_string(path)))
+
+
+def load_baseline(name):
+    path = baseline_path(name)
+    if not path.exists():
+        return None
+    with open(path_to_string(path)) as f:
+        return json.load(f)
+
+
+def parse_tolerances(values):
+    """
+    :param values: list with "0.25" for all stages or "stage=0.5"
+    :return: default tolerance, dict stage -> tolerance
+    """
+    default = TIME_TOLERANCE
+    per_stage = {}
+    for value in values or []:
+        if "=" in value:
+            stage, tolerance = value.split("=", 1)
+            per_stage[stage] = float(tolerance)
+        else:
+            default = float(value)
+    return default, per_stage
+
+
+def compare(results, baseline, tolerance, per_stage,
+            memory_tolerance=MEMORY_TOLERANCE):
+    """
+    Compares the measurements with the baseline. A stage regressed if its
+    time or memory grew by more than the tolerance and more than the noise
+    limits MIN_TIME and MIN_MEMORY.
+    :return: list with the regressed "dataset/stage" keys
+    """
+    fmt = "{:<26}{:>10}{:>10}{:>8}{:>10}{:>10}{:>8}  {}"
+    print(fmt.format("STAGE", "TIME [s]", "BASE", "RATIO", "MEM [MB]", "BASE",
+                     "RATIO", "STATUS"))
+    regressions = []
+    for key, r in results.items():
+        base = baseline["results"].get(key)
+        if base is None:
+            print(fmt.format(key, "{:.3f}".format(r["time"]), "-", "-",
+                             "-", "-", "-", "new"))
+            continue
+        stage = key.split("/", 1)[1]
+        allowed = per_stage.get(stage, tolerance)
+        status = []
+        time_ratio = r["time"] / max(base["time"], 1e-9)
+        if time_ratio > 1 + allowed and r["time"] - base["time"] > MIN_TIME:
+            status.append("slower")
+        mem_ratio = None
+        if r["memory_kind"] == base["memory_kind"]:
+            mem_ratio = r["memory"] / max(base["memory"], 1e-9)
+            if mem_ratio > 1 + memory_tolerance and \
+                    r["memory"] - base["memory"] > MIN_MEMORY:
+                status.append("more memory")
+        if status:
+            regressions.append(key)
+        if r["digest"] != base["digest"]:
+            status.append("output changed")
+        print(fmt.format(key[:25], "{:.3f}".format(r["time"]),
+                         "{:.3f}".format(base["time"]),
+                         "{:.2f}".format(time_ratio),
+                         "{:.1f}".format(r["memory"]),
+                         "{:.1f}".format(base["memory"]),
+                         "-" if mem_ratio is None
+                         else "{:.2f}".format(mem_ratio),
+                         ", ".join(status) or "ok"))
+    return regressions
+
+
+def main():
+    stage_names = [stage[0] for stage in STAGES]
+    parser = argparse.ArgumentParser(description="Pipeline benchmark suite")
+    parser.add_argument("--stages", nargs="+", choices=stage_names,
+                        default=stage_names)
+    parser.add_argument("--no-dax", action="store_true",
+                        help="skip the shipped DAX30 data")
+    parser.add_argument("--synthetic", nargs="+", default=[],
+                        metavar="TICKERSxYEARS",
+                        help="synthetic universes, e.g. 300x10 3000x30")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="name of the baseline in {}".format(
+                            path_to_string(BASELINE_DIR)))
+    parser.add_argument("--save", action="store_true",
+                        help="save this run as baseline")
+    parser.add_argument("--tolerance", action="append",
+                        help="allowed time growth, e.g. 0.25 or "
+                             "rfe_search=0.5 for one stage")
+    parser.add_argument("--memory-tolerance", type=float,
+                        default=MEMORY_TOLERANCE)
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="parallel jobs of the selection and search")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the traced runs, take the growth of the "
+                             "resident memory")
+    parser.add_argument("--verbose", action="store_true",
+                        help="show the output of the stages")
+    args = parser.parse_args()
+    for spec in args.synthetic:
+        parse_synthetic(spec)
+
+    stages = with_requirements(args.stages)
+    learn.N_JOBS = args.jobs
+    datasets = ([] if args.no_dax else ["dax"]) + \
+        [spec.lower() for spec in args.synthetic]
+    results = {}
+    for name in datasets:
+        results.update(run_dataset(name, stages, args))
+
+    config = {"seed": SEED, "forecast": FORECAST, "jobs": args.jobs,
+              "datasets": datasets, "stages": stages}
+    if args.save:
+        save_baseline(args.baseline, results, config)
+        return 0
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print("No baseline {}, save one with --save".format(args.baseline))
+        return 0
+    print("Compared with baseline {} of {}".format(args.baseline,
+                                                   baseline["created"]))
+    changed = {k: (v, baseline["environment"].get(k))
+               for k, v in environment().items()
+               if baseline["environment"].get(k) != v}
+    if changed:
+        print("The baseline was measured in another environment: {}".format(
+            ", ".join("{} {} (baseline {})".format(k, v, b)
+                      for k, (v, b) in sorted(changed.items()))))
+    tolerance, per_stage = parse_tolerances(args.tolerance)
+    regressions = compare(results, baseline, tolerance, per_stage,
+                          args.memory_tolerance)
+    if regressions:
+        print("Regressions: {}".format(", ".join(regressions)))
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+MAX_ENTRIES = 128
+MAX_BYTES = 512 * 2 ** 20
+
+
+def file_signature(path):
+    """
+    Returns (path, mtime, size) of a file, which changes with every write
+    :param path: path of the file
+    :return: tuple identifying the current file content
+    """
+    path = str(path)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def read_only(values):
+    """ Copy of an array which is marked non-writeable """
+    values = np.array(values)
+    values.setflags(write=False)
+    return values
+
+
+def is_frozen(frame):
+    """ Whether every column of a DataFrame is a read-only numpy array """
+    return all(isinstance(frame.dtypes.iloc[i], np.dtype) and
+               not frame.iloc[:, i].values.flags.writeable
+               for i in range(frame.shape[1]))
+
+
+def freeze(value):
+    """
+    Makes a loaded value read-only. DataFrames are rebuilt from read-only
+    copies of their values: one 2-D array if all columns share a dtype,
+    else one array per column. Frames with extension dtypes are only
+    copied, view() copies them again on every hit. Lists become tuples.
+    :param value: DataFrame, ndarray or list
+    :return: read-only value
+    """
+    if isinstance(value, pd.DataFrame):
+        dtypes = set(value.dtypes)
+        if not all(isinstance(dtype, np.dtype) for dtype in dtypes):
+            return value.copy()
+        if len(dtypes) == 1:
+            return pd.DataFrame(read_only(value.to_numpy()),
+                                index=value.index, columns=value.columns,
+                                copy=False)
+        frame = pd.DataFrame({i: read_only(value.iloc[:, i].to_numpy())
+                              for i in range(value.shape[1])},
+                             index=value.index, copy=False)
+        frame.columns = value.columns
+        return frame
+    if isinstance(value, np.ndarray):
+        return read_only(value)
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def view(value):
+    """
+    Returns what callers get from the cache: a new DataFrame object sharing
+    the read-only data, so adding columns or setting an index never touches
+    the cached frame. Frames with extension dtypes, whose blocks cannot be
+    made read-only, are copied.
+    """
+    if isinstance(value, pd.DataFrame):
+        if not is_frozen(value):
+            return value.copy()
+        return value.copy(deep=False)
+    return value
+
+
+def nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
+
+
+class LRUCache:
+    """
+    In-process cache for loaded files keyed by (path, mtime, size). The least
+    recently used entries are evicted once max_entries or max_bytes is
+    exceeded.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get(self, path, loader, variant=None):
+        """
+        Returns the cached value for a file or loads it
+        :param path: path of the file whose signature keys the entry
+        :param loader: callable without arguments loading the value
+        :param variant: additional key, e.g. the projected columns
+        :return: read-only value
+        """
+        key = file_signature(path) + (variant,)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return view(self.entries[key][0])
+            self.misses += 1
+
+        value = freeze(loader())
+        size = nbytes(value)
+        with self.lock:
+            # drop entries of older versions of the same file
+            self._discard(lambda k: k[0] == key[0] and k[1:3] != key[1:3])
+            if key not in self.entries:
+                self.entries[key] = (value, size)
+                self.size += size
+            self._evict()
+        return view(value)
+
+    def update(self, entries):
+        """
+        Adds entries taken from another cache, e.g. of the parent process
+        :param entries: dict with key -> (value, size) like self.entries
+        """
+        with self.lock:
+            for key, (value, size) in entries.items():
+                if key in self.entries:
+                    self.size -= self.entries[key][1]
+                self.entries[key] = (value, size)
+                self.size += size
+            self._evict()
+
+    def invalidate(self, path):
+        """
+        Removes all entries of a file
+        :param path: path of the file
+        """
+        path = str(path)
+        with self.lock:
+            self._discard(lambda k: k[0] == path)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        :return: dict with hits, misses, evictions, entries and bytes
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self.entries),
+                    "bytes": self.size}
+
+    def _discard(self, predicate):
+        for key in [k for k in self.entries if predicate(k)]:
+            self.size -= self.entries.pop(key)[1]
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or
+                                self.size > self.max_bytes):
+            self.size -= self.entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+
+CACHE = LRUCache()
+
+
+def cached(path, loader, variant=None):
+    return CACHE.get(path, loader, variant)
+
+
+def update(entries):
+    CACHE.update(entries)
+
+
+def invalidate(path):
+    CACHE.invalidate(path)
+
+
+def clear():
+    CACHE.clear()
+
+
+def stats():
+    return CACHE.stats()
@@ -1,8 +1,14 @@
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pandas as pd
 
+import data.utils.cache as cache
+import data.utils.intraday as intraday
+import data.utils.profiling as profiling
+import data.utils.store as store
+import data.utils.universe as uv
 import data.utils.web_scrappers as ws
 
 DATA_DIR = Path("data/data")
@@ -11,52 +17,107 @@ PKL_DIR = DATA_DIR / "PKL_DIR"
 DAX_DATA_PKL = PKL_DIR / "DAX30.data.pkl"
 DAX_DATA_CSV = DATA_DIR / "DAX30.csv"
 
+# dtype of the wide "Adj Close" panel, float32 halves its memory
+PANEL_DTYPE = "float32"
+PANEL_WORKERS = 8
+
 
 def path_to_string(path):
     return "/".join(path.parts)
 
 
-def compute_dax_df():
+def build_panel(tickers=None, dtype=None, column="Adj Close",
+                workers=PANEL_WORKERS, cached=True):
     """
-    returns main dataframe with stocks data of all dax companies
-    :return: dataframe with stocks data
+    Builds the wide panel with one column per ticker. All tickers are loaded
+    in parallel and aligned on the union of their Date indexes with a single
+    concat.
+
+    :param tickers: list with ticker symbols, all DAX companies if None
+    :param dtype: dtype of the panel, PANEL_DTYPE if None
+    :param column: column loaded for every ticker
+    :param workers: number of loader threads
+    :param cached: keep the loaded ticker frames in the cache
+    :return: dataframe with Date index and one column per ticker
     """
+    if tickers is None:
+        tickers = ws.get_tickers()
+    if dtype is None:
+        dtype = PANEL_DTYPE
+    tickers = [ticker.rstrip() for ticker in tickers]
 
-    tickers = ws.get_tickers()
-    main_df = pd.DataFrame()
-
-    for count, ticker in enumerate(tickers):
-        ticker = ticker.rstrip()
+    def load(ticker):
         try:
-            df = get_com_as_df(ticker)
+            df = get_com_as_df(ticker, columns=[column], cached=cached)
         except IOError:
-            print("No .csv found for {}".format(ticker))
-            continue
-        df.reset_index(inplace=True)
-        df.set_index("Date", inplace=True)
-        df.rename(columns={"Adj Close": ticker}, inplace=True)
-        df.drop(["Open", "High", "Low", "Close", "Volume"], 1, inplace=True)
-        if main_df.empty:
-            main_df = df
-        else:
-            main_df = main_df.merge(df)
+            return None
+        return df[column].astype(dtype).rename(ticker)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        series = list(executor.map(load, tickers))
+
+    for ticker, s in zip(tickers, series):
+        if s is None:
+            print("No data found for {}".format(ticker))
+    series = [s for s in series if s is not None]
+    if not series:
+        return pd.DataFrame(dtype=dtype)
+
+    main_df = pd.concat(series, axis=1, join="outer", sort=True)
+    main_df.index.name = "Date"
+    return main_df
+
+
+def iter_panels(tickers=None, chunk_size=uv.CHUNK_SIZE, dtype=None,
+                column="Adj Close", workers=PANEL_WORKERS):
+    """
+    Builds the panel of a large universe chunk by chunk, so only the
+    columns of chunk_size tickers are held at once. The ticker frames are
+    not cached, they would only evict each other.
+
+    :param tickers: Universe or list with ticker symbols, all DAX companies
+    if None
+    :param chunk_size: tickers per panel
+    :return: generator of dataframes with Date index and one column per
+    ticker of the chunk
+    """
+    if tickers is None:
+        tickers = uv.load_universe()
+    tickers = list(tickers)
+    for start in range(0, len(tickers), chunk_size):
+        yield build_panel(tickers[start:start + chunk_size], dtype, column,
+                          workers, cached=False)
+
+
+def compute_dax_df(dtype=None):
+    """
+    returns main dataframe with stocks data of all dax companies
+    :param dtype: dtype of the panel, PANEL_DTYPE if None
+    :return: dataframe with stocks data
+    """
+    main_df = build_panel(dtype=dtype)
 
     # print(main_df.tail())
     save_dax_as_csv(main_df)
     save_dax_as_pkl(main_df)
+    return main_df
 
 
-def save_com_as_csv(df, ticker):
+def save_com_as_csv(df, ticker, export=False):
     """
-    Saves company data as .csv
+    Saves company data to the columnar store. The .csv is only written as
+    an export if requested.
 
     :param df: new fetched dataframe from yahoo
     :param ticker: ticker symbol
+    :param export: additionally export the data as .csv
 
     """
-    path = path_to_string(COM_DATA_DIR) + "/{}.csv".format(ticker)
-    df.to_csv(path)
+    path = path_to_string(store.write_com(df, ticker))
     print("Saved {} data to {}".format(ticker, path))
+    if export:
+        path = store.export_csv(ticker)
+        print("Exported {} data to {}".format(ticker, path))
 
 
 def save_dax_as_csv(df):
@@ -75,6 +136,7 @@ def save_dax_as_pkl(df):
     with open(path, "wb") as f:
         pickle.dump(df, f)
         print("Saved DAX30 data to{}".format(path))
+    cache.invalidate(path)
 
 
 def get_dax_as_pkl():
@@ -83,30 +145,104 @@ def get_dax_as_pkl():
         pickle.load(f)
 
 
-def get_dax__as_df():
-    if DAX_DATA_PKL.exists():
-        path = path_to_string(DAX_DATA_PKL)
+def is_panel(df):
+    """
+    Checks that df is a panel of build_panel: a Date index and one float
+    column per ticker. Pickles of the former merge loop have an int "index"
+    column instead of the dates.
+    :param df: unpickled dataframe
+    :return: True if df is a panel
+    """
+    return (df.index.name == "Date" and
+            all(dtype.kind == "f" for dtype in df.dtypes))
+
 
-        return pd.read_pickle(path)
-    else:
+def load_dax_pkl(path):
+    """
+    Loads the pickled panel
+    :param path: path of the pickle
+    :return: dataframe with one column per ticker
+    :raises ValueError: if the pickle is no panel of build_panel or can not
+    be read with this pandas version
+    """
+    try:
+        df = pd.read_pickle(path)
+    except Exception as e:
+        raise ValueError("Can not read {}: {!r}".format(path, e))
+    if not is_panel(df):
+        raise ValueError("{} is not a panel with Date index and float "
+                         "columns".format(path))
+    # float panels pickled with another dtype are converted once when loaded
+    return df.astype(PANEL_DTYPE, copy=False)
+
+
+@profiling.profiled("load_panel")
+def get_dax__as_df():
+    """
+    Returns the DAX panel as read-only view of the cached pickle. Stale
+    pickles are rebuilt with compute_dax_df before they are cached, so the
+    cache is keyed by the rebuilt file.
+    :return: dataframe with one column per ticker
+    """
+    if not DAX_DATA_PKL.exists():
         compute_dax_df()
+    path = path_to_string(DAX_DATA_PKL)
+    try:
+        return cache.cached(path, lambda: load_dax_pkl(path))
+    except ValueError as e:
+        print("Rebuilding DAX30 panel: {}".format(e))
+        compute_dax_df()
+    return cache.cached(path, lambda: load_dax_pkl(path))
 
 
-def get_com_as_df(ticker):
-    df = pd.read_csv("{}/{}.csv".format(path_to_string(COM_DATA_DIR), ticker))
-    df.reset_index(inplace=True)
-    df.set_index("Date", inplace=True)
-    return df
+@profiling.profiled("load")
+def get_com_as_df(ticker, columns=None, cached=True):
+    """
+    Returns company data from the columnar store as read-only view of the
+    cached frame. Tickers which are not stored yet are migrated from their
+    .csv on first access.
+
+    :param ticker: ticker symbol
+    :param columns: list with columns to load, all columns if None
+    :param cached: keep the frame in the cache, read it directly if False
+    :return: dataframe with Date index
+    """
+    if not store.has_com(ticker):
+        store.write_com(store.read_csv(ticker), ticker)
+    if not cached:
+        return store.read_com(ticker, columns)
+    variant = None if columns is None else tuple(columns)
+    return cache.cached(store.com_dir(ticker) / store.COLUMNS_FILE,
+                        lambda: store.read_com(ticker, columns),
+                        variant)
+
+
+def get_bars_as_df(ticker, resolution=None, columns=None):
+    """
+    Returns the daily bars of the columnar store or the intraday bars of a
+    ticker resampled to any resolution
+
+    :param ticker: ticker symbol
+    :param resolution: e.g. "5min", "1h", "1d" or "10d" of the intraday
+    bars, the stored daily bars if None
+    :param columns: list with columns to load, all columns if None
+    :return: dataframe with Date index
+    """
+    if resolution is None:
+        return get_com_as_df(ticker, columns=columns)
+    df = intraday.get_bars(ticker, resolution)
+    return df if columns is None else df[columns]
 
 
-def refresh_dax_data():
+def refresh_dax_data(incremental=False):
     # First get list from Wikipedia with all ticker symbols and name
     ws.get_com_tickers_names()
-    # Fetch and save .csv for each com
-    ws.get_com_data()
+    # Fetch and save data for each com concurrently
+    report = ws.get_com_data(incremental=incremental)
     # compute, save as pickle and return DataFrame
     compute_dax_df()
+    return report
 
 
-def refresh_com_data(ticker):
-    ws.get_com_data(ticker)
+def refresh_com_data(ticker, incremental=False):
+    ws.get_com_data(ticker, incremental=incremental)
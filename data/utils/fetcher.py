@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+WORKERS = 8
+RETRIES = 3
+TIMEOUT = 10.0
+# requests per second over all workers, None disables the limiter
+RATE = 5.0
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class TimeoutSession(requests.Session):
+    """
+    Session which applies a default timeout to every request
+    """
+
+    def __init__(self, timeout=TIMEOUT):
+        super(TimeoutSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super(TimeoutSession, self).request(method, url, **kwargs)
+
+
+def make_session(pool_size=WORKERS, timeout=TIMEOUT):
+    """
+    Returns a session whose connection pool is shared by all workers
+    :param pool_size: max. number of pooled connections per host
+    :param timeout: timeout in seconds for each request
+    :return: TimeoutSession
+    """
+    session = TimeoutSession(timeout)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class RateLimiter:
+    """
+    Thread safe limiter which spaces calls at least 1 / rate seconds apart
+    """
+
+    def __init__(self, rate=RATE):
+        self.interval = 0.0 if not rate else 1.0 / rate
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FetchReport:
+    """
+    Result of a bulk fetch: succeeded tickers with their job results and
+    failed tickers with their last error
+    """
+
+    def __init__(self):
+        self.succeeded = {}
+        self.failed = {}
+        self.attempts = {}
+        self.durations = {}
+        self.elapsed = 0.0
+
+    def __str__(self):
+        lines = ["Fetched {} of {} tickers in {:.2f}s".format(
+            len(self.succeeded), len(self.succeeded) + len(self.failed),
+            self.elapsed)]
+        for ticker, error in sorted(self.failed.items()):
+            lines.append("  failed {} after {} attempts: {}".format(
+                ticker, self.attempts[ticker], error))
+        return "\n".join(lines)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """
+    Exponential backoff with full jitter
+    :param attempt: number of the failed attempt, starting at 0
+    :return: seconds to sleep before the next attempt
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retry(job, ticker, retries=RETRIES, limiter=None,
+                    base=BACKOFF_BASE):
+    """
+    Calls job(ticker) and retries on IOError with exponential backoff
+    :return: tuple with job result and number of attempts
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.wait()
+        try:
+            return job(ticker), attempt + 1
+        except IOError as e:
+            if attempt >= retries:
+                e.attempts = attempt + 1
+                raise
+            time.sleep(backoff_delay(attempt, base))
+            attempt += 1
+
+
+def fetch_all(tickers, job, workers=WORKERS, retries=RETRIES, rate=RATE,
+              base=BACKOFF_BASE):
+    """
+    Runs job(ticker) for all tickers on a bounded thread pool. Failed calls
+    are retried, errors never stop the other tickers.
+
+    :param tickers: list with ticker symbols
+    :param job: callable fetching and saving data of one ticker
+    :param workers: max. number of concurrent jobs
+    :param retries: retries per ticker after the first attempt
+    :param rate: max. requests per second over all workers
+    :param base: base delay of the exponential backoff in seconds
+    :return: FetchReport
+    """
+    report = FetchReport()
+    limiter = RateLimiter(rate)
+    start = time.monotonic()
+
+    def run(ticker):
+        t = time.monotonic()
+        try:
+            return call_with_retry(job, ticker, retries, limiter, base)
+        finally:
+            report.durations[ticker] = time.monotonic() - t
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(run, ticker): ticker for ticker in tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                result, attempts = future.result()
+            except Exception as e:
+                report.failed[ticker] = "{}: {}".format(type(e).__name__, e)
+                report.attempts[ticker] = getattr(e, "attempts", 1)
+                continue
+            report.succeeded[ticker] = result
+            report.attempts[ticker] = attempts
+
+    report.elapsed = time.monotonic() - start
+    return report
@@ -0,0 +1,310 @@
+"""
+Intraday bars partitioned by ticker and day. Every day of a ticker is one
+.npy file with a structured array of its bars, so appending a day or
+reading a date range only touches the files of these days. Bars of any
+resolution are resampled from the raw bars and cached per resolution.
+"""
+import argparse
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.cache as cache
+import data.utils.profiling as profiling
+
+DATA_DIR = Path("data/data")
+INTRADAY_DIR = DATA_DIR / "INTRADAY_DIR"
+BARS_DIR = "_bars"
+
+BAR_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+BAR_DTYPE = np.dtype([("Time", "<i8")] + [(c, "<f8") for c in BAR_COLUMNS])
+NS_PER_DAY = 24 * 3600 * 10 ** 9
+# rows of a local file parsed at once
+CHUNK_ROWS = 10 ** 6
+# bump whenever resample changes its output
+RESAMPLE_VERSION = 1
+TIME_COLUMNS = ["Datetime", "Timestamp", "Time", "Date"]
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def ticker_dir(ticker):
+    return INTRADAY_DIR / ticker
+
+
+def day_file(ticker, day):
+    return ticker_dir(ticker) / "{}.npy".format(day)
+
+
+def list_days(ticker):
+    """
+    :return: sorted list with the stored days of a ticker as YYYY-MM-DD
+    """
+    path = ticker_dir(ticker)
+    if not path.exists():
+        return []
+    return sorted(f.name[:-4] for f in os.scandir(str(path))
+                  if f.name.endswith(".npy"))
+
+
+def to_bars(df):
+    """
+    Converts a frame of bars or ticks into the structured bar array. Ticks
+    with a Price column become bars with open = high = low = close.
+    :param df: dataframe with DatetimeIndex and OHLCV or Price columns
+    :return: structured array sorted by time
+    """
+    bars = np.empty(len(df), dtype=BAR_DTYPE)
+    bars["Time"] = pd.DatetimeIndex(df.index).values.astype("datetime64[ns]") \
+        .astype(np.int64)
+    for column in BAR_COLUMNS[:4]:
+        bars[column] = df[column if column in df.columns else "Price"].values
+    bars["Volume"] = df["Volume"].values if "Volume" in df.columns else 0
+    return bars[np.argsort(bars["Time"], kind="mergesort")]
+
+
+def write_day(ticker, day, bars, ticks=False):
+    """
+    Writes the bars of one day, bars already stored for this day are kept
+    unless a new bar has the same time. Ticks are appended, several ticks
+    can have the same time.
+    :param day: YYYY-MM-DD
+    :param bars: structured array sorted by time
+    :param ticks: bars are ticks of to_bars
+    :return: path of the day file
+    """
+    path = day_file(ticker, day)
+    if path.exists():
+        bars = np.concatenate([np.load(str(path)), bars])
+        order = np.argsort(bars["Time"], kind="mergesort")
+        bars = bars[order]
+    if not ticks and len(bars):
+        # keep the last of equal times, the new bars come later
+        last = np.append(bars["Time"][1:] != bars["Time"][:-1], True)
+        bars = bars[last]
+    tmp_path = str(path)[:-4] + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, bars)
+    os.replace(tmp_path, str(path))
+    return path
+
+
+def ingest_frame(df, ticker):
+    """
+    Stores bars or ticks partitioned by day
+    :param df: dataframe with DatetimeIndex and OHLCV or Price columns
+    :return: number of stored rows
+    """
+    path = ticker_dir(ticker)
+    if not path.exists():
+        os.makedirs(path_to_string(path))
+    bars = to_bars(df.dropna(how="all"))
+    ticks = "Price" in df.columns
+    days = bars["Time"] // NS_PER_DAY
+    starts = np.flatnonzero(np.diff(days, prepend=days[:1] - 1))
+    ends = np.append(starts[1:], len(bars))
+    for start, end in zip(starts, ends):
+        day = str(np.datetime64(int(days[start]), "D"))
+        write_day(ticker, day, bars[start:end], ticks)
+    return len(bars)
+
+
+def read_csv_chunks(path, chunk_rows=CHUNK_ROWS):
+    """
+    Reads a local .csv of bars or ticks in chunks. The time is taken from
+    the first column named like one of TIME_COLUMNS.
+    :return: generator of dataframes with DatetimeIndex
+    """
+    columns = pd.read_csv(str(path), nrows=0).columns
+    time_column = next((c for c in columns if c in TIME_COLUMNS), columns[0])
+    for chunk in pd.read_csv(str(path), chunksize=chunk_rows,
+                             parse_dates=[time_column],
+                             index_col=time_column):
+        yield chunk
+
+
+def ingest_csv(path, ticker=None, chunk_rows=CHUNK_ROWS):
+    """
+    Ingests a local .csv with minute bars or ticks of one ticker
+    :param path: path of the .csv
+    :param ticker: ticker symbol, the file name if None
+    :return: number of stored rows
+    """
+    path = Path(path)
+    if ticker is None:
+        ticker = path.stem
+    rows = 0
+    for chunk in read_csv_chunks(path, chunk_rows):
+        rows += ingest_frame(chunk, ticker)
+    print("Ingested {} rows of {}".format(rows, ticker))
+    return rows
+
+
+def read_bars(ticker, start=None, end=None):
+    """
+    Reads the raw bars of the days between start and end
+    :param start: first day, the first stored day if None
+    :param end: last day, the last stored day if None
+    :return: structured array sorted by time
+    """
+    days = list_days(ticker)
+    if start is not None:
+        days = [d for d in days if d >= str(pd.Timestamp(start).date())]
+    if end is not None:
+        days = [d for d in days if d <= str(pd.Timestamp(end).date())]
+    if not days:
+        return np.empty(0, dtype=BAR_DTYPE)
+    return np.concatenate([np.load(str(day_file(ticker, d))) for d in days])
+
+
+def rule_to_ns(rule):
+    """
+    Width of a resolution like "30s", "5min", "1h", "1d" or "10d"
+    :return: nanoseconds
+    """
+    width = pd.to_timedelta(rule).value
+    if width <= 0:
+        raise ValueError("Invalid resolution {}".format(rule))
+    return width
+
+
+def resample_bars(bars, rule):
+    """
+    Aggregates sorted bars into bars of a coarser resolution: first open,
+    highest high, lowest low, last close and summed volume. The bins start
+    at midnight of the first day like DataFrame.resample, bins without bars
+    are left out.
+    :param bars: structured array sorted by time
+    :param rule: resolution, e.g. "5min", "1h", "1d" or "10d"
+    :return: structured array with the start time of every bin
+    """
+    width = rule_to_ns(rule)
+    if len(bars) == 0:
+        return np.empty(0, dtype=BAR_DTYPE)
+    times = bars["Time"]
+    origin = times[0] // NS_PER_DAY * NS_PER_DAY
+    bins = (times - origin) // width
+    starts = np.flatnonzero(np.diff(bins, prepend=bins[0] - 1))
+    ends = np.append(starts[1:], len(bars)) - 1
+
+    out = np.empty(len(starts), dtype=BAR_DTYPE)
+    out["Time"] = origin + bins[starts] * width
+    out["Open"] = bars["Open"][starts]
+    out["High"] = np.maximum.reduceat(bars["High"], starts)
+    out["Low"] = np.minimum.reduceat(bars["Low"], starts)
+    out["Close"] = bars["Close"][ends]
+    out["Volume"] = np.add.reduceat(bars["Volume"], starts)
+    return out
+
+
+def to_frame(bars):
+    """
+    :return: dataframe with Date index, the OHLCV columns and "Adj Close",
+    which equals Close because intraday bars are not adjusted
+    """
+    df = pd.DataFrame({c: bars[c] for c in BAR_COLUMNS},
+                      index=pd.DatetimeIndex(bars["Time"].view("M8[ns]"),
+                                             name="Date"),
+                      columns=BAR_COLUMNS)
+    df["Adj Close"] = df["Close"]
+    return df
+
+
+def resample(df, rule, price=None):
+    """
+    Resamples a dataframe of bars, e.g. daily bars to 10 day bars
+    :param df: dataframe with DatetimeIndex and OHLCV columns
+    :param rule: resolution
+    :param price: column used as open, high, low and close instead of the
+    OHLC columns, e.g. "Adj Close"
+    :return: dataframe like to_frame
+    """
+    if price is not None:
+        df = pd.DataFrame({"Price": df[price].values,
+                           "Volume": df["Volume"].values},
+                          index=df.index).dropna(subset=["Price"])
+    return to_frame(resample_bars(to_bars(df), rule))
+
+
+def partition_key(ticker, rule):
+    """ Hash of the stored days, their sizes and times of change """
+    h = hashlib.sha1("{}|{}".format(rule, RESAMPLE_VERSION).encode())
+    for f in sorted(os.scandir(str(ticker_dir(ticker))), key=lambda f: f.name):
+        if f.name.endswith(".npy"):
+            stat = f.stat()
+            h.update("{}|{}|{}".format(f.name, stat.st_size,
+                                       stat.st_mtime_ns).encode())
+    return h.hexdigest()
+
+
+def bars_file(ticker, rule):
+    return ticker_dir(ticker) / BARS_DIR / "{}.npy".format(rule)
+
+
+def get_bars(ticker, rule, start=None, end=None):
+    """
+    Returns the bars of a ticker in a resolution. Resampled bars are saved
+    per resolution and only computed again after the stored days changed.
+    :param ticker: ticker symbol
+    :param rule: resolution, e.g. "5min", "1h", "1d" or "10d"
+    :param start: first time, all bars if None
+    :param end: last time, all bars if None
+    :return: dataframe like to_frame
+    """
+    if not ticker_dir(ticker).exists():
+        raise IOError("No intraday data found for {}".format(ticker))
+    path = bars_file(ticker, rule)
+    key_path = Path(str(path)[:-4] + ".key")
+    key = partition_key(ticker, rule)
+    if not (path.exists() and key_path.exists() and
+            key_path.read_text() == key):
+        if not path.parent.exists():
+            os.makedirs(str(path.parent))
+        bars = resample_bars(read_bars(ticker), rule)
+        tmp_path = str(path)[:-4] + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, bars)
+        os.replace(tmp_path, str(path))
+        key_path.write_text(key)
+
+    df = cache.cached(path_to_string(path),
+                      lambda: to_frame(np.load(str(path))))
+    if start is not None or end is not None:
+        df = df.loc[start:end]
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingests and resamples "
+                                                 "intraday bars")
+    sub = parser.add_subparsers(dest="command")
+    ingest = sub.add_parser("ingest", help="ingest local .csv files")
+    ingest.add_argument("paths", nargs="+")
+    ingest.add_argument("--ticker", help="ticker of a single file, the file "
+                                         "name if not given")
+    bars = sub.add_parser("bars", help="print resampled bars")
+    bars.add_argument("ticker")
+    bars.add_argument("rule")
+    args = parser.parse_args()
+    profiling.from_env()
+
+    if args.command == "ingest":
+        start = time.perf_counter()
+        rows = sum(ingest_csv(path, args.ticker) for path in args.paths)
+        elapsed = time.perf_counter() - start
+        print("{} rows in {:.1f}s ({:.0f} rows/s)".format(
+            rows, elapsed, rows / max(elapsed, 1e-9)))
+    elif args.command == "bars":
+        print(get_bars(args.ticker, args.rule).tail(20).to_string())
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
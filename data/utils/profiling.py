@@ -0,0 +1,459 @@
+"""
+Stage timers of the pipeline. Loading, feature building, feature
+selection, model search, prediction and plotting run inside named stages,
+which record wall and cpu time and peak memory per ticker and estimator.
+Profiling is off by default and a stage then costs next to nothing.
+
+Modes:
+    time      wall time, cpu time and the peak resident memory per stage
+    memory    additionally the peak of the Python and numpy allocations
+              per stage traced with tracemalloc
+    cprofile  additionally a cProfile of the whole run, saved as .prof
+
+Every entry point profiles when started with the STOCK_PROFILE environment
+variable, the report is written to PROFILE_DIR or STOCK_PROFILE_DIR as
+.json and .csv:
+    STOCK_PROFILE=memory python3 -m src.main
+    python3 -m src.cli --profile time train ADS.DE
+"""
+import atexit
+import contextlib
+import cProfile
+import csv
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the resident memory is left out there
+    resource = None
+
+DATA_DIR = Path("data/data")
+PROFILE_DIR = DATA_DIR / "PROFILES"
+MODES = ["time", "memory", "cprofile"]
+ENV_VAR = "STOCK_PROFILE"
+ENV_DIR_VAR = "STOCK_PROFILE_DIR"
+# functions of the cProfile listed in the report
+TOP_FUNCTIONS = 30
+RECORD_COLUMNS = ["pid", "stage", "ticker", "estimator", "depth", "start",
+                  "wall", "cpu", "rss_peak_mb", "rss_growth_mb", "mem_peak_mb",
+                  "status"]
+MB = 2 ** 20
+# seconds between two samples of the current resident memory
+RSS_INTERVAL = 0.005
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def max_rss():
+    """
+    :return: highest resident memory of the process so far in bytes
+    """
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def current_rss():
+    """
+    :return: current resident memory of the process in bytes, 0 where
+    /proc/self/statm is missing
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return 0
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class RssSampler:
+    """
+    Samples the current resident memory in a thread while it is entered.
+    Unlike max_rss its peak is not hidden by an earlier high-water mark of
+    the process.
+    """
+
+    def __init__(self, interval=RSS_INTERVAL):
+        self.interval = interval
+        self.base = 0
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.base = self.peak = current_rss()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def growth(self):
+        """
+        :return: peak minus the resident memory when entered in bytes
+        """
+        return self.peak - self.base
+
+
+class Profiler:
+    """
+    Collects the records of the stages of one run
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.mode = None
+        self.run_id = None
+        self.records = []
+        # open stages per thread
+        self.local = threading.local()
+        self.profile = None
+        self.started = None
+        self.wall_start = None
+        self.pid = None
+
+    def enable(self, mode="time", run_id=None):
+        """
+        Starts profiling
+        :param mode: one of MODES
+        :param run_id: name of the report, date and time if None
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown profiling mode {}, use one of {}".format(
+                mode, MODES))
+        self.enabled = True
+        self.mode = mode
+        self.run_id = run_id or "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"),
+                                               os.getpid())
+        self.records = []
+        self.local = threading.local()
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.wall_start = time.perf_counter()
+        if mode == "memory" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if mode == "cprofile":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def __reduce__(self):
+        # functions pickled by value for worker processes use the profiler
+        # of the worker
+        return get_profiler, ()
+
+    @property
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def disable(self):
+        if self.profile is not None:
+            self.profile.disable()
+        if self.mode == "memory" and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = False
+
+    @contextlib.contextmanager
+    def stage(self, name, ticker=None, estimator=None):
+        """
+        Records a stage. Nested stages inherit the ticker of their parent.
+        :param name: name of the stage, e.g. "load" or "search"
+        :param ticker: ticker symbol
+        :param estimator: name of the estimator or method
+        """
+        if not self.enabled:
+            yield
+            return
+        if ticker is None and self.stack:
+            ticker = self.stack[-1]["ticker"]
+        record = {"pid": os.getpid(), "stage": name, "ticker": ticker,
+                  "estimator": estimator, "depth": len(self.stack),
+                  "start": time.perf_counter() - self.wall_start,
+                  "status": "ok", "mem_peak": 0}
+        tracing = self.mode == "memory" and tracemalloc.is_tracing()
+        if tracing:
+            self._enter_trace(record)
+        rss_before = max_rss()
+        self.stack.append(record)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        except BaseException:
+            record["status"] = "failed"
+            raise
+        finally:
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            self.stack.pop()
+            rss = max_rss()
+            record["rss_peak_mb"] = rss / MB
+            record["rss_growth_mb"] = (rss - rss_before) / MB
+            if tracing:
+                self._exit_trace(record)
+            record["mem_peak_mb"] = record.pop("mem_peak") / MB \
+                if tracing else None
+            self.records.append(record)
+
+    def _enter_trace(self, record):
+        # the peak of the parent so far is kept before the peak is reset
+        current, peak = tracemalloc.get_traced_memory()
+        if self.stack:
+            self.stack[-1]["mem_peak"] = max(self.stack[-1]["mem_peak"], peak)
+        record["mem_base"] = current
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    def _exit_trace(self, record):
+        # without reset_peak (Python < 3.9) the peak is the one of the run
+        peak = max(record["mem_peak"], tracemalloc.get_traced_memory()[1])
+        if self.stack:
+            self.stack[-1]["mem_peak"] = max(self.stack[-1]["mem_peak"], peak)
+        record["mem_peak"] = peak - record.pop("mem_base")
+
+    def merge(self, records):
+        """ Adds the records of a worker process """
+        self.records.extend(records)
+
+    def summary(self):
+        """
+        Sums the records per stage and estimator
+        :return: list with dicts, slowest stage first
+        """
+        groups = {}
+        for r in self.records:
+            key = (r["stage"], r["estimator"])
+            g = groups.setdefault(key, {"stage": r["stage"],
+                                        "estimator": r["estimator"],
+                                        "calls": 0, "tickers": set(),
+                                        "wall": 0.0, "cpu": 0.0,
+                                        "max_wall": 0.0, "rss_growth_mb": 0.0,
+                                        "mem_peak_mb": None, "failed": 0})
+            g["calls"] += 1
+            if r["ticker"] is not None:
+                g["tickers"].add(r["ticker"])
+            g["wall"] += r["wall"]
+            g["cpu"] += r["cpu"]
+            g["max_wall"] = max(g["max_wall"], r["wall"])
+            g["rss_growth_mb"] = max(g["rss_growth_mb"], r["rss_growth_mb"])
+            if r["mem_peak_mb"] is not None:
+                g["mem_peak_mb"] = max(g["mem_peak_mb"] or 0, r["mem_peak_mb"])
+            g["failed"] += r["status"] != "ok"
+        rows = sorted(groups.values(), key=lambda g: -g["wall"])
+        for g in rows:
+            g["tickers"] = len(g["tickers"])
+            g["mean_wall"] = g["wall"] / g["calls"]
+        return rows
+
+    def functions(self, top=TOP_FUNCTIONS):
+        """
+        :return: list with the functions of the cProfile with the highest
+        cumulative time
+        """
+        if self.profile is None:
+            return []
+        stats = pstats.Stats(self.profile).stats
+        rows = sorted(stats.items(), key=lambda item: -item[1][3])[:top]
+        return [{"function": "{}:{}({})".format(*key), "calls": value[1],
+                 "total": value[2], "cumulative": value[3]}
+                for key, value in rows]
+
+    def report(self, directory=None):
+        """
+        Writes the report of the run as .json with the records, the summary
+        and the run metadata and as .csv with one row per record
+        :param directory: directory of the report, PROFILE_DIR if None
+        :return: path of the .json report
+        """
+        directory = Path(directory) if directory is not None else PROFILE_DIR
+        if not directory.exists():
+            os.makedirs(str(directory))
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(str(directory /
+                                        "{}.prof".format(self.run_id)))
+        # cache statistics only if the cache was used in this process
+        cache = sys.modules.get("data.utils.cache")
+        report = {"run": self.run_id,
+                  "mode": self.mode,
+                  "argv": sys.argv,
+                  "started": time.strftime("%Y-%m-%d %H:%M:%S",
+                                           time.localtime(self.started)),
+                  "wall": time.perf_counter() - self.wall_start,
+                  "cpu": time.process_time(),
+                  "rss_peak_mb": max_rss() / MB,
+                  "cache": cache.stats() if cache is not None else None,
+                  "summary": self.summary(),
+                  "functions": self.functions(),
+                  "records": self.records}
+        path = directory / "{}.json".format(self.run_id)
+        with open(str(path), "w") as f:
+            json.dump(report, f, indent=1, default=str)
+        with open(str(directory / "{}.csv".format(self.run_id)), "w",
+                  newline="") as f:
+            writer = csv.DictWriter(f, RECORD_COLUMNS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(self.records)
+        return path
+
+
+PROFILER = Profiler()
+
+
+def get_profiler():
+    return PROFILER
+
+
+def enable(mode="time", run_id=None):
+    PROFILER.enable(mode, run_id)
+
+
+def disable():
+    PROFILER.disable()
+
+
+def is_enabled():
+    return PROFILER.enabled
+
+
+def stage(name, ticker=None, estimator=None):
+    return PROFILER.stage(name, ticker, estimator)
+
+
+def profiled(name, estimator=None):
+    """
+    Decorator running every call of a function as stage. A string as first
+    argument is taken as ticker.
+    :param name: name of the stage
+    :param estimator: name of the estimator or method
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            ticker = args[0] if args and isinstance(args[0], str) \
+                else kwargs.get("ticker")
+            with PROFILER.stage(name, ticker, estimator):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def settings():
+    """
+    :return: mode of the running profiler for worker processes, None if
+    profiling is off
+    """
+    return PROFILER.mode if PROFILER.enabled else None
+
+
+def init_worker(mode):
+    """
+    Starts profiling in a worker process. Forked workers inherit the
+    profiler, the records of the parent are dropped there. cProfile only
+    runs in the parent, workers of a cprofile run only time their stages.
+    :param mode: return value of settings in the parent
+    """
+    if mode is None:
+        return
+    if not PROFILER.enabled:
+        PROFILER.enable("time" if mode == "cprofile" else mode)
+    elif PROFILER.profile is not None:
+        PROFILER.profile.disable()
+        PROFILER.profile = None
+    PROFILER.records = []
+    PROFILER.local = threading.local()
+    PROFILER.pid = os.getpid()
+
+
+def call(mode, func, *args, **kwargs):
+    """
+    Runs func in a worker process and hands the records of its stages back
+    to the parent, which adds them with unwrap. Runs in the parent process
+    itself, e.g. with n_jobs=1, are recorded directly.
+    :param mode: return value of settings in the parent
+    :return: return value of func, list with records
+    """
+    if mode is not None and PROFILER.pid != os.getpid():
+        init_worker(mode)
+    start = len(PROFILER.records)
+    value = func(*args, **kwargs)
+    if PROFILER.pid is None or mode is None:
+        return value, []
+    records = PROFILER.records[start:]
+    del PROFILER.records[start:]
+    return value, records
+
+
+def unwrap(result):
+    """
+    :param result: return value of call
+    :return: return value of the function run by call
+    """
+    value, records = result
+    PROFILER.merge(records)
+    return value
+
+
+def print_summary(top=15):
+    fmt = "{:<26}{:<20}{:>7}{:>8}{:>10}{:>10}{:>10}{:>12}"
+    print(fmt.format("STAGE", "ESTIMATOR", "CALLS", "TICKERS", "WALL [s]",
+                     "CPU [s]", "MAX [s]", "MEM [MB]"))
+    for g in PROFILER.summary()[:top]:
+        mem = g["mem_peak_mb"] if g["mem_peak_mb"] is not None \
+            else g["rss_growth_mb"]
+        print(fmt.format(g["stage"][:25], str(g["estimator"] or "-")[:19],
+                         g["calls"], g["tickers"], "{:.2f}".format(g["wall"]),
+                         "{:.2f}".format(g["cpu"]),
+                         "{:.2f}".format(g["max_wall"]),
+                         "{:.1f}".format(mem)))
+
+
+def finish(directory=None):
+    """
+    Writes the report, prints the slowest stages and stops profiling
+    :return: path of the .json report or None if profiling is off
+    """
+    if not PROFILER.enabled:
+        return None
+    path = PROFILER.report(directory or os.environ.get(ENV_DIR_VAR))
+    print_summary()
+    print("Profile of run {} saved to {}".format(PROFILER.run_id, path))
+    PROFILER.disable()
+    return path
+
+
+def from_env():
+    """
+    Enables profiling if STOCK_PROFILE names a mode, the report is written
+    when the process exits. Called by the main function of every entry
+    point.
+    """
+    mode = os.environ.get(ENV_VAR)
+    if not mode or PROFILER.enabled:
+        return
+    enable(mode)
+    atexit.register(finish)
@@ -0,0 +1,215 @@
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.cache as cache
+
+DATA_DIR = Path("data/data")
+COM_DATA_DIR = DATA_DIR / "DAX30"
+NPY_DIR = DATA_DIR / "NPY_DIR"
+
+INDEX_FILE = "Date.npy"
+COLUMNS_FILE = "columns.npy"
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def com_dir(ticker):
+    return NPY_DIR / ticker
+
+
+def column_file(column):
+    return "{}.npy".format(column.replace(" ", "_"))
+
+
+def has_com(ticker):
+    """
+    Checks whether the columnar store holds data for a company
+    :param ticker: ticker symbol
+    :return: True if the store holds data for the ticker
+    """
+    return (com_dir(ticker) / COLUMNS_FILE).exists()
+
+
+def get_columns(ticker):
+    """
+    Returns the stored column names of a company
+    :param ticker: ticker symbol
+    :return: list with column names
+    """
+    return [str(c) for c in np.load(str(com_dir(ticker) / COLUMNS_FILE))]
+
+
+def write_com(df, ticker):
+    """
+    Writes company data to the columnar store. Every column and the Date
+    index are saved as a single .npy file. The files are written to a new
+    version directory and the ticker directory is a link to the current
+    version. Replacing the link is atomic, so readers never see a half
+    written or a missing ticker.
+
+    :param df: dataframe with Date index
+    :param ticker: ticker symbol
+    :return: path of the ticker directory
+    """
+    if not NPY_DIR.exists():
+        os.makedirs(path_to_string(NPY_DIR))
+
+    path = com_dir(ticker)
+    version_path = NPY_DIR / "{}.v-{}".format(ticker, uuid.uuid4().hex)
+    os.makedirs(str(version_path))
+
+    # the index is always stored in nanoseconds, whatever unit pandas parsed
+    index = pd.DatetimeIndex(pd.to_datetime(df.index))
+    np.save(str(version_path / INDEX_FILE),
+            index.values.astype("datetime64[ns]"))
+    columns = [str(c) for c in df.columns]
+    for column in columns:
+        np.save(str(version_path / column_file(column)),
+                np.ascontiguousarray(df[column].values))
+    np.save(str(version_path / COLUMNS_FILE), np.array(columns))
+
+    swap(path, version_path)
+    cache.invalidate(path / COLUMNS_FILE)
+    return path
+
+
+def swap(path, version_path):
+    """
+    Points the ticker directory at a new version and removes the old one
+    :param path: ticker directory
+    :param version_path: complete directory of the new version
+    """
+    old_path = None
+    if path.is_symlink():
+        old_path = Path(os.path.realpath(str(path)))
+    elif path.exists():
+        # plain directory of a store written before the version links
+        old_path = NPY_DIR / "{}.old-{}".format(path.name, os.getpid())
+        os.rename(str(path), str(old_path))
+    link_path = NPY_DIR / "{}.link-{}".format(path.name, os.getpid())
+    if link_path.is_symlink():
+        os.remove(str(link_path))
+    os.symlink(version_path.name, str(link_path))
+    os.replace(str(link_path), str(path))
+    if old_path is not None and old_path.exists():
+        shutil.rmtree(str(old_path))
+
+
+def append_com(df, ticker):
+    """
+    Appends new rows to the stored company data. Rows whose Date is already
+    stored are replaced by the new ones, the result is sorted by Date and
+    written atomically.
+
+    :param df: dataframe with new rows and Date index
+    :param ticker: ticker symbol
+    :return: path of the ticker directory
+    """
+    df = df.copy()
+    df.index = pd.DatetimeIndex(pd.to_datetime(df.index), name="Date")
+    if has_com(ticker):
+        df = pd.concat([read_com(ticker, mmap=False), df], sort=False)
+        df = df[~df.index.duplicated(keep="last")]
+        df.sort_index(inplace=True)
+    return write_com(df, ticker)
+
+
+def read_index(ticker, mmap=True):
+    """
+    Returns the Date index of a company without loading any column
+    :param ticker: ticker symbol
+    :param mmap: memory map the file instead of reading it
+    :return: DatetimeIndex
+    """
+    mode = "r" if mmap else None
+    values = np.load(str(com_dir(ticker) / INDEX_FILE), mmap_mode=mode)
+    return pd.DatetimeIndex(values, name="Date")
+
+
+def read_com(ticker, columns=None, mmap=True):
+    """
+    Reads company data from the columnar store. Only the requested columns
+    are touched, nothing has to be parsed.
+
+    :param ticker: ticker symbol
+    :param columns: list with columns to load, all columns if None
+    :param mmap: memory map the files instead of reading them
+    :return: dataframe with Date index
+    """
+    path = com_dir(ticker)
+    if columns is None:
+        columns = get_columns(ticker)
+    mode = "r" if mmap else None
+    data = {}
+    for column in columns:
+        file = path / column_file(column)
+        if not file.exists():
+            raise KeyError("Column {} not stored for {}".format(column, ticker))
+        data[column] = np.load(str(file), mmap_mode=mode)
+
+    return pd.DataFrame(data, index=read_index(ticker, mmap), columns=columns)
+
+
+def delete_com(ticker):
+    path = com_dir(ticker)
+    if path.is_symlink():
+        version_path = os.path.realpath(str(path))
+        os.remove(str(path))
+        shutil.rmtree(version_path)
+    elif path.exists():
+        shutil.rmtree(str(path))
+    cache.invalidate(path / COLUMNS_FILE)
+
+
+def read_csv(ticker):
+    """
+    Reads the exported .csv of a company
+    :param ticker: ticker symbol
+    :return: dataframe with Date index
+    """
+    path = "{}/{}.csv".format(path_to_string(COM_DATA_DIR), ticker)
+    df = pd.read_csv(path, index_col="Date", parse_dates=True)
+    return df
+
+
+def export_csv(ticker):
+    """
+    Exports the stored company data as .csv
+    :param ticker: ticker symbol
+    :return: path of the .csv
+    """
+    if not COM_DATA_DIR.exists():
+        os.makedirs(path_to_string(COM_DATA_DIR))
+    path = "{}/{}.csv".format(path_to_string(COM_DATA_DIR), ticker)
+    df = read_com(ticker)
+    df.to_csv(path, date_format="%Y-%m-%d")
+    return path
+
+
+def migrate_from_csv(overwrite=False):
+    """
+    One-shot migration of all company .csv files into the columnar store
+    :param overwrite: also migrate tickers which are already stored
+    :return: list with migrated tickers
+    """
+    migrated = []
+    for csv in sorted(COM_DATA_DIR.glob("*.csv")):
+        ticker = csv.stem
+        if has_com(ticker) and not overwrite:
+            continue
+        write_com(read_csv(ticker), ticker)
+        migrated.append(ticker)
+    print("Migrated {} tickers to {}".format(len(migrated),
+                                            path_to_string(NPY_DIR)))
+    return migrated
+
+
+if __name__ == "__main__":
+    migrate_from_csv()
@@ -0,0 +1,213 @@
+import argparse
+import os
+import pickle
+from collections import OrderedDict
+from pathlib import Path
+
+import pandas as pd
+
+import data.utils.cache as cache
+import data.utils.profiling as profiling
+import data.utils.store as store
+
+DATA_DIR = Path("data/data")
+PKL_DIR = DATA_DIR / "PKL_DIR"
+UNIVERSE_DIR = DATA_DIR / "UNIVERSES"
+COM_NAMES_PKL = PKL_DIR / "DAX30.names.pkl"
+COM_TICKERS_PKL = PKL_DIR / "DAX30.tickers.pkl"
+
+DEFAULT_UNIVERSE = "DAX30"
+META_COLUMNS = ["ticker", "name", "suffix", "currency", "first_date"]
+# tickers processed at once by the chunked loader, feature and training paths
+CHUNK_SIZE = 100
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def make_record(ticker, name=None, suffix=None, currency=None,
+                first_date=None):
+    """
+    Metadata of one ticker, the exchange suffix is taken from the ticker
+    """
+    ticker = ticker.strip()
+    if suffix is None:
+        suffix = ticker.rsplit(".", 1)[1] if "." in ticker else ""
+    return {"ticker": ticker, "name": ticker if name is None else name,
+            "suffix": suffix, "currency": currency,
+            "first_date": None if first_date is None or pd.isnull(first_date)
+            else pd.Timestamp(first_date)}
+
+
+class Universe:
+    """
+    Ordered set of tickers with a ticker -> metadata index, so lookups do
+    not depend on the size of the universe
+    """
+
+    def __init__(self, name, records):
+        self.name = name
+        self.index = OrderedDict((r["ticker"], r) for r in records)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, ticker):
+        return ticker in self.index
+
+    def tickers(self):
+        return tuple(self.index)
+
+    def names(self):
+        return tuple(r["name"] for r in self.index.values())
+
+    def meta(self, ticker):
+        return self.index[ticker]
+
+    def name_of(self, ticker):
+        return self.index[ticker]["name"]
+
+    def chunks(self, size=CHUNK_SIZE):
+        """
+        Yields the tickers in lists of at most size tickers
+        """
+        tickers = self.tickers()
+        for start in range(0, len(tickers), size):
+            yield list(tickers[start:start + size])
+
+    def to_frame(self):
+        return pd.DataFrame(list(self.index.values()), columns=META_COLUMNS)
+
+
+def universe_path(name):
+    return UNIVERSE_DIR / "{}.csv".format(name)
+
+
+def read_universe_csv(path, name=None):
+    """
+    Reads a universe from a local .csv with at least a ticker column, the
+    columns name, suffix, currency and first_date are optional
+    :param path: path of the .csv
+    :param name: name of the universe, the file name if None
+    :return: Universe
+    """
+    path = Path(path)
+    df = pd.read_csv(str(path), dtype=str, keep_default_na=False)
+    if "ticker" not in df.columns:
+        raise ValueError("{} has no ticker column".format(path))
+    records = []
+    for row in df.to_dict("records"):
+        records.append(make_record(
+            row["ticker"], row.get("name") or None, row.get("suffix") or None,
+            row.get("currency") or None, row.get("first_date") or None))
+    return Universe(name or path.stem, records)
+
+
+def save_universe(universe):
+    """
+    Saves a universe as .csv under its name
+    :return: path of the .csv
+    """
+    if not UNIVERSE_DIR.exists():
+        os.makedirs(path_to_string(UNIVERSE_DIR))
+    path = universe_path(universe.name)
+    df = universe.to_frame()
+    df["first_date"] = pd.to_datetime(df["first_date"]).dt.strftime(
+        "%Y-%m-%d")
+    tmp_path = str(path) + ".tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, str(path))
+    cache.invalidate(path_to_string(path))
+    return path
+
+
+def dax_from_pkl():
+    """ DAX30 universe from the ticker and name lists of the scraper """
+    with open(path_to_string(COM_TICKERS_PKL), "rb") as f:
+        tickers = pickle.load(f)
+    with open(path_to_string(COM_NAMES_PKL), "rb") as f:
+        names = pickle.load(f)
+    return Universe(DEFAULT_UNIVERSE,
+                    [make_record(t, n, currency="EUR")
+                     for t, n in zip(tickers, names)])
+
+
+def load_universe(name=DEFAULT_UNIVERSE):
+    """
+    Returns a universe as cached read-only object. DAX30 falls back to the
+    pickled lists of the scraper if it was not saved as .csv yet.
+    :param name: name of the universe
+    :return: Universe
+    """
+    path = universe_path(name)
+    if path.exists():
+        return cache.cached(path_to_string(path),
+                            lambda: read_universe_csv(path, name))
+    if name == DEFAULT_UNIVERSE:
+        return cache.cached(path_to_string(COM_TICKERS_PKL), dax_from_pkl,
+                            "universe")
+    raise IOError("No universe {} in {}".format(
+        name, path_to_string(UNIVERSE_DIR)))
+
+
+def import_universe(path, name=None):
+    """
+    Imports the constituents of any index from a local .csv
+    :param path: .csv with a ticker column
+    :param name: name of the universe, the file name if None
+    :return: Universe
+    """
+    universe = read_universe_csv(path, name)
+    save_universe(universe)
+    print("Imported {} tickers as universe {}".format(len(universe),
+                                                      universe.name))
+    return universe
+
+
+def update_first_dates(universe):
+    """
+    Sets the first stored date of every ticker from the Date index of the
+    columnar store, only the index files are memory mapped
+    :return: Universe with updated metadata
+    """
+    records = []
+    for ticker in universe:
+        record = dict(universe.meta(ticker))
+        if store.has_com(ticker):
+            index = store.read_index(ticker)
+            if len(index):
+                record["first_date"] = index[0]
+        records.append(record)
+    updated = Universe(universe.name, records)
+    save_universe(updated)
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manages ticker universes")
+    sub = parser.add_subparsers(dest="command")
+    imp = sub.add_parser("import", help="import a universe from a .csv")
+    imp.add_argument("path")
+    imp.add_argument("--name")
+    show = sub.add_parser("list", help="list the tickers of a universe")
+    show.add_argument("name", nargs="?", default=DEFAULT_UNIVERSE)
+    dates = sub.add_parser("dates", help="update the first dates")
+    dates.add_argument("name", nargs="?", default=DEFAULT_UNIVERSE)
+    args = parser.parse_args()
+    profiling.from_env()
+
+    if args.command == "import":
+        import_universe(args.path, args.name)
+    elif args.command == "dates":
+        update_first_dates(load_universe(args.name))
+    else:
+        name = getattr(args, "name", None) or DEFAULT_UNIVERSE
+        print(load_universe(name).to_frame().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
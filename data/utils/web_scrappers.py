@@ -1,13 +1,20 @@
 import datetime as dt
+import io
 import os
 import pickle
 from pathlib import Path
 
 import bs4 as bs
+import numpy as np
+import pandas as pd
 import pandas_datareader.data as web
 import requests
 
+import data.utils.cache as cache
 import data.utils.df_loader as dl
+import data.utils.fetcher as fetcher
+import data.utils.store as store
+import data.utils.universe as uv
 
 DATA_DIR = Path("data/data")
 COM_DATA_DIR = DATA_DIR / "DAX30"
@@ -15,6 +22,13 @@ PKL_DIR = DATA_DIR / "PKL_DIR"
 COM_NAMES_PKL = PKL_DIR / "DAX30.names.pkl"
 COM_TICKERS_PKL = PKL_DIR / "DAX30.tickers.pkl"
 
+START = dt.datetime(2010, 1, 1)
+# days fetched again before the last stored date to detect adjustment drift
+OVERLAP_DAYS = 7
+# relative change of stored "Adj Close" values which forces a full rewrite
+DRIFT_TOLERANCE = 1e-4
+YAHOO_CSV_URL = "https://query1.finance.yahoo.com/v7/finance/download/{}"
+
 
 def path_to_string(path):
     return "/".join(path.parts)
@@ -35,51 +49,184 @@ def get_com_tickers_names():
 
     save_names(names)
     save_tickers(tickers)
+    uv.save_universe(uv.Universe(
+        uv.DEFAULT_UNIVERSE,
+        [uv.make_record(t, n, currency="EUR") for t, n in zip(tickers, names)]))
+
+
+class LocalDataReader:
+    """
+    Offline stand-in for pandas_datareader which serves stock data from
+    .csv files in a local directory
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def __call__(self, ticker, data_source, start, end):
+        path = self.directory / "{}.csv".format(ticker)
+        if not path.exists():
+            raise IOError("No data found for {}".format(ticker))
+        df = pd.read_csv(str(path), index_col="Date", parse_dates=True)
+        return df[(df.index >= pd.Timestamp(start)) &
+                  (df.index <= pd.Timestamp(end))]
+
+
+class HttpCsvReader:
+    """
+    Reader which downloads daily bars as .csv over a shared session. The url
+    has to contain one {} for the ticker, start and end are passed as unix
+    timestamps like Yahoo expects them.
+    """
+
+    def __init__(self, session, url=YAHOO_CSV_URL):
+        self.session = session
+        self.url = url
+
+    def __call__(self, ticker, data_source, start, end):
+        params = {"period1": int(pd.Timestamp(start).timestamp()),
+                  "period2": int(pd.Timestamp(end).timestamp()),
+                  "interval": "1d",
+                  "events": "history"}
+        resp = self.session.get(self.url.format(ticker), params=params)
+        resp.raise_for_status()
+        return pd.read_csv(io.StringIO(resp.text), index_col="Date",
+                           parse_dates=True)
+
+
+class SessionDataReader:
+    """
+    Wraps web.DataReader so every call reuses one pooled session
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def __call__(self, ticker, data_source, start, end):
+        return web.DataReader(ticker, data_source, start, end, retry_count=0,
+                              session=self.session)
+
 
+def has_adj_close_drift(df_old, df_new):
+    """
+    Checks if already stored "Adj Close" values changed in the new data,
+    which happens after splits or dividend payments
+    :param df_old: stored dataframe
+    :param df_new: new fetched dataframe
+    :return: True if the overlapping values differ
+    """
+    dates = df_old.index.intersection(df_new.index)
+    if len(dates) == 0:
+        return False
+    old = df_old.loc[dates, "Adj Close"].values
+    new = df_new.loc[dates, "Adj Close"].values
+    drift = np.abs(new - old) / np.abs(old)
+    return bool(np.nanmax(drift) > DRIFT_TOLERANCE)
+
+
+def update_com_data(ticker, end=None, reader=None):
+    """
+    Fetches only bars newer than the last stored date and appends them. The
+    whole history is fetched again if the stored data is missing or its
+    "Adj Close" drifted.
+
+    :param ticker: ticker symbol
+    :param end: last date to fetch, now if None
+    :param reader: callable with the signature of web.DataReader
+    :return: "full", "rewrite", "append" or "unchanged"
+    """
+    if reader is None:
+        reader = web.DataReader
+    if end is None:
+        end = dt.datetime.now()
+
+    try:
+        df_old = dl.get_com_as_df(ticker, columns=["Adj Close"])
+    except IOError:
+        df_old = None
+    if df_old is None or df_old.empty:
+        dl.save_com_as_csv(reader(ticker, "yahoo", START, end), ticker)
+        return "full"
+
+    last_date = df_old.index[-1]
+    start = last_date - dt.timedelta(days=OVERLAP_DAYS)
+    df_new = reader(ticker, "yahoo", start, end)
+    df_new.index = pd.DatetimeIndex(pd.to_datetime(df_new.index), name="Date")
+
+    if has_adj_close_drift(df_old, df_new):
+        print("Adjustment drift in {}, fetching whole history".format(ticker))
+        dl.save_com_as_csv(reader(ticker, "yahoo", START, end), ticker)
+        return "rewrite"
+    if not (df_new.index > last_date).any():
+        return "unchanged"
 
-def get_com_data(ticker=None):
+    store.append_com(df_new, ticker)
+    print("Appended {} new rows to {}".format(
+        int((df_new.index > last_date).sum()), ticker))
+    return "append"
+
+
+def get_com_data(ticker=None, incremental=False, reader=None,
+                 workers=fetcher.WORKERS, universe=None):
     """
-    Loads stock data from yahoo and saves it as .csv for each company
+    Loads stock data from yahoo and saves it for each company. Tickers are
+    fetched concurrently over one pooled session, failed requests are retried
+    with backoff.
+
+    :param ticker: ticker symbol, all companies of the universe if None
+    :param incremental: only fetch bars newer than the stored ones
+    :param reader: callable with the signature of web.DataReader
+    :param workers: max. number of concurrent downloads
+    :param universe: name of the universe fetched if ticker is None, DAX30
+    if None
+    :return: FetchReport with succeeded and failed tickers
     """
     path = path_to_string(COM_DATA_DIR)
     if not os.path.exists(path):
         os.makedirs(path)
     if ticker is None:
-        tickers = get_tickers()
+        tickers = uv.load_universe(universe or uv.DEFAULT_UNIVERSE).tickers()
     else:
         tickers = [ticker]
+    if reader is None:
+        reader = SessionDataReader(fetcher.make_session(workers))
 
-    start = dt.datetime(2010, 1, 1)
     end = dt.datetime.now()
-    for ticker in tickers:
-        # just in case your connection breaks, we"d like to save our progress!
-        try:
-            df = web.DataReader(ticker, "yahoo", start, end)
-        except IOError:
-            print("No data from yahoo found for: {}".format(ticker))
-            continue
-        dl.save_com_as_csv(df, ticker)
+
+    def job(ticker):
+        if incremental:
+            return update_com_data(ticker, end, reader)
+        dl.save_com_as_csv(reader(ticker, "yahoo", START, end), ticker)
+        return "full"
+
+    report = fetcher.fetch_all(tickers, job, workers=workers)
+    # each ticker is saved as soon as it arrives, so a broken connection
+    # only loses the failed ones
+    print(report)
+    return report
 
 
 def get_tickers():
     """
-    Returns list with all 30 DAX company tickers
-    :return: list with ticker symbols
+    Returns all 30 DAX company tickers
+    :return: tuple with ticker symbols
     """
-    with open(path_to_string(COM_TICKERS_PKL), "rb") as f:
-        tickers = pickle.load(f)
-
-    return tickers
+    return cache.cached(path_to_string(COM_TICKERS_PKL),
+                        lambda: load_pkl(COM_TICKERS_PKL))
 
 
 def get_names():
     """
-    Returns list with all 30 DAX company names
-    :return: list with all DAX company names
+    Returns all 30 DAX company names
+    :return: tuple with all DAX company names
     """
-    with open(path_to_string(COM_NAMES_PKL), "rb")as f:
-        names = pickle.load(f)
-    return names
+    return cache.cached(path_to_string(COM_NAMES_PKL),
+                        lambda: load_pkl(COM_NAMES_PKL))
+
+
+def load_pkl(path):
+    with open(path_to_string(path), "rb") as f:
+        return pickle.load(f)
 
 
 def save_tickers(tickers):
@@ -89,6 +236,7 @@ def save_tickers(tickers):
     with open(path_to_string(COM_TICKERS_PKL), "wb") as f:
         pickle.dump(tickers, f)
         print("Saved DAX 30 ticker symbols")
+    cache.invalidate(path_to_string(COM_TICKERS_PKL))
 
 
 def save_names(names):
@@ -98,11 +246,14 @@ def save_names(names):
     with open(path_to_string(COM_NAMES_PKL), "wb") as f:
         pickle.dump(names, f)
         print("Saved DAX 30 company names")
+    cache.invalidate(path_to_string(COM_NAMES_PKL))
 
 
-def ticker_to_name(ticker):
-    names = list(get_names())
-    tickers = list(get_tickers())
-    index = tickers.index(ticker)
-    name = names.pop(index)
-    return name
+def ticker_to_name(ticker, universe=uv.DEFAULT_UNIVERSE):
+    """
+    Returns the company name of a ticker from the index of its universe
+    :param ticker: ticker symbol
+    :param universe: name of the universe
+    :return: company name
+    """
+    return uv.load_universe(universe).name_of(ticker)
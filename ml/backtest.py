@@ -0,0 +1,312 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, r2_score
+from sklearn.preprocessing import MinMaxScaler
+from xgboost import XGBRegressor
+
+import data.utils.profiling as profiling
+from ml.labels import HM_DAYS, REQUIREMENT, labels_from_returns
+from ml.preprocessing import get_cls_data, get_raw_reg_data
+
+MIN_TRAIN = 500
+# rows between two refits
+STEP = 60
+# trees of the first fit and trees added by every warm started refit
+N_ESTIMATORS = 100
+WARM_ESTIMATORS = 20
+# most trees a warm started forest keeps, the oldest are dropped
+MAX_ESTIMATORS = 300
+
+
+def walk_forward_splits(n_rows, min_train=MIN_TRAIN, step=STEP, window=None,
+                        gap=0):
+    """
+    Splits rows into walk forward folds. Every fold trains on rows before
+    its test rows, the last gap training rows are left out because their
+    labels look into the test rows.
+    :param n_rows: number of rows
+    :param min_train: training rows of the first fold
+    :param step: test rows per fold, i.e. rows between two refits
+    :param window: rolling window of training rows, expanding if None
+    :param gap: rows between training and test rows
+    :return: list with (train_start, train_end, test_start, test_end)
+    """
+    folds = []
+    test_start = min_train + gap
+    while test_start < n_rows:
+        test_end = min(test_start + step, n_rows)
+        train_end = test_start - gap
+        train_start = 0 if window is None else max(0, train_end - window)
+        folds.append((train_start, train_end, test_start, test_end))
+        test_start = test_end
+    return folds
+
+
+class TrainScaler:
+    """
+    Fills missing features with the means of the training rows and scales
+    them to the range of the same rows, like get_reg_data does with the
+    whole history. Rows after the training rows are only transformed.
+    """
+
+    def fit(self, X):
+        with np.errstate(invalid="ignore"):
+            means = np.nanmean(X, axis=0)
+        self.means = np.where(np.isnan(means), 0, means)
+        self.scaler = MinMaxScaler(copy=False).fit(self.fill(X))
+        return self
+
+    def fill(self, X):
+        X = np.array(X)
+        rows, columns = np.nonzero(~np.isfinite(X))
+        X[rows, columns] = self.means[columns]
+        return X
+
+    def transform(self, X):
+        return self.scaler.transform(self.fill(X))
+
+
+def make_model(kind):
+    if kind == "reg":
+        return XGBRegressor(n_estimators=N_ESTIMATORS, random_state=42,
+                            objective="reg:squarederror", n_jobs=1)
+    return RandomForestClassifier(n_estimators=N_ESTIMATORS, random_state=42,
+                                  n_jobs=1)
+
+
+def refit(kind, model, X, y):
+    """
+    Continues a fitted model on new training rows instead of fitting it
+    from scratch. XGBoost adds boosting rounds to the previous booster, the
+    forest adds trees and drops the oldest ones.
+    :return: fitted model
+    """
+    if kind == "reg":
+        new = clone(model).set_params(n_estimators=WARM_ESTIMATORS)
+        new.fit(X, y, xgb_model=model.get_booster())
+        return new
+    if not np.array_equal(np.unique(y), model.classes_):
+        # a class appeared or vanished, the old trees do not fit anymore
+        return clone(model).fit(X, y)
+    model.set_params(warm_start=True,
+                     n_estimators=len(model.estimators_) + WARM_ESTIMATORS)
+    model.fit(X, y)
+    if len(model.estimators_) > MAX_ESTIMATORS:
+        model.estimators_ = model.estimators_[-MAX_ESTIMATORS:]
+        model.set_params(n_estimators=MAX_ESTIMATORS)
+    return model
+
+
+def to_signals(kind, predictions, price, requirement):
+    """
+    Turns predictions into buy (1), sell (-1) and hold (0) signals, the
+    regression forecast with the rule of buy_sell_hold
+    """
+    if kind == "cls":
+        return predictions.astype(np.int8)
+    returns = (predictions - price) / price
+    return labels_from_returns(returns[:, np.newaxis], requirement)
+
+
+def load_data(ticker, kind, forecast):
+    """
+    Features, labels, next day returns, prices and dates of a ticker
+    :return: X, y, next day returns, prices, dates, gap
+    """
+    if kind == "reg":
+        # filled and scaled per fold, see TrainScaler
+        X, y, df = get_raw_reg_data(ticker, forecast)
+        price = df["Adj Close"].values
+        gap = int(forecast)
+    else:
+        X, y, df = get_cls_data(ticker)
+        price = df[ticker].values
+        gap = HM_DAYS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        next_return = np.append(price[1:] / price[:-1] - 1, np.nan)
+    next_return[~np.isfinite(next_return)] = 0
+    return np.asarray(X), np.asarray(y), next_return, price, df.index, gap
+
+
+def run_fold(kind, model, X, y, fold, scaler=None):
+    """
+    Fits or refits the model of a fold and predicts its test rows. The
+    regression features are filled and scaled by a TrainScaler fit on the
+    training rows of the fold which first fit the model, refits keep it
+    because the trees split on its scale.
+    :return: model, scaler, predictions, seconds
+    """
+    train_start, train_end, test_start, test_end = fold
+    X_train = X[train_start:train_end]
+    X_test = X[test_start:test_end]
+    y_train = y[train_start:train_end]
+    start = time.perf_counter()
+    with profiling.stage("fold", estimator=kind):
+        if kind == "reg":
+            if model is None:
+                scaler = TrainScaler().fit(X_train)
+            X_train = scaler.transform(X_train)
+            X_test = scaler.transform(X_test)
+            # rows without a price have no label
+            labelled = np.isfinite(y_train)
+            X_train = X_train[labelled]
+            y_train = y_train[labelled]
+        if model is None:
+            model = make_model(kind).fit(X_train, y_train)
+        else:
+            model = refit(kind, model, X_train, y_train)
+        predictions = model.predict(X_test)
+    return model, scaler, predictions, time.perf_counter() - start
+
+
+def fold_metrics(kind, fold, predictions, y, signals, next_return, dates,
+                 elapsed):
+    train_start, train_end, test_start, test_end = fold
+    y_test = y[test_start:test_end]
+    if kind == "reg":
+        labelled = np.isfinite(y_test)
+        score = r2_score(y_test[labelled], predictions[labelled])
+    else:
+        score = accuracy_score(y_test, predictions)
+    pnl = signals * next_return[test_start:test_end]
+    active = signals != 0
+    return {"train_from": dates[train_start].date(),
+            "train_to": dates[train_end - 1].date(),
+            "test_from": dates[test_start].date(),
+            "test_to": dates[test_end - 1].date(),
+            "score": score,
+            "trades": int(active.sum()),
+            "hit_rate": float((pnl[active] > 0).mean()) if active.any()
+            else np.nan,
+            "pnl": float(pnl.sum()),
+            "time": elapsed}
+
+
+@profiling.profiled("backtest")
+def backtest(ticker, kind="reg", forecast=120, min_train=MIN_TRAIN, step=STEP,
+             window=None, warm_start=True, requirement=REQUIREMENT,
+             n_jobs=-1):
+    """
+    Walk forward backtest of a ticker. The model is refit every step rows
+    on the rows before, each test row is predicted by a model which has not
+    seen its label. Folds of a warm started run follow each other because
+    every refit continues the model of the fold before, otherwise they are
+    fit from scratch in parallel.
+
+    :param ticker: ticker symbol
+    :param kind: "reg" for the get_reg_data forecast, "cls" for the
+    get_cls_data labels
+    :param forecast: days to forecast of "reg"
+    :param min_train: training rows of the first fold
+    :param step: rows between two refits
+    :param window: rolling window of training rows, expanding if None
+    :param warm_start: continue the model of the fold before
+    :param requirement: return which a forecast has to cross for a signal
+    :param n_jobs: parallel folds without warm start
+    :return: dataframe with one row per fold, dataframe with the daily
+    signal, return and equity
+    """
+    X, y, next_return, price, dates, gap = load_data(ticker, kind, forecast)
+    folds = walk_forward_splits(len(X), min_train, step, window, gap)
+    if not folds:
+        raise ValueError("{} has only {} rows, {} needed for one fold".format(
+            ticker, len(X), min_train + gap + 1))
+
+    if warm_start:
+        runs = []
+        model = scaler = None
+        for fold in folds:
+            model, scaler, predictions, elapsed = run_fold(kind, model, X, y,
+                                                           fold, scaler)
+            runs.append((predictions, elapsed))
+    else:
+        mode = profiling.settings()
+        runs = Parallel(n_jobs=n_jobs)(
+            delayed(profiling.call)(mode, run_fold, kind, None, X, y, fold)
+            for fold in folds)
+        runs = [profiling.unwrap(run)[2:] for run in runs]
+
+    rows = []
+    daily = []
+    for fold, (predictions, elapsed) in zip(folds, runs):
+        _, _, test_start, test_end = fold
+        signals = to_signals(kind, predictions, price[test_start:test_end],
+                             requirement)
+        rows.append(fold_metrics(kind, fold, predictions, y, signals,
+                                 next_return, dates, elapsed))
+        daily.append(pd.DataFrame(
+            {"signal": signals,
+             "return": next_return[test_start:test_end]},
+            index=dates[test_start:test_end]))
+
+    folds_df = pd.DataFrame(rows, columns=list(rows[0]))
+    daily = pd.concat(daily)
+    daily["pnl"] = daily["signal"] * daily["return"]
+    daily["equity"] = (1 + daily["pnl"]).cumprod()
+    return folds_df, daily
+
+
+def backtest_all(tickers, n_jobs=-1, **kwargs):
+    """
+    Walk forward backtests of several tickers in parallel, the folds of a
+    single ticker in parallel without warm start
+    :param tickers: list with ticker symbols
+    :param kwargs: arguments of backtest
+    :return: dict ticker -> (folds, daily)
+    """
+    if len(tickers) > 1:
+        # parallel over tickers, the folds of each ticker run in sequence
+        kwargs["n_jobs"] = 1
+    mode = profiling.settings()
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(profiling.call)(mode, backtest, ticker, **kwargs)
+        for ticker in tickers)
+    return dict(zip(tickers, [profiling.unwrap(r) for r in results]))
+
+
+def print_backtest(ticker, folds, daily):
+    print("Walk forward backtest of {}".format(ticker))
+    print(folds.to_string(index=False, float_format="{:.3f}".format))
+    active = daily["signal"] != 0
+    print("Folds: {}, trades: {}, hit rate: {:.3f}, total PnL: {:.3f}, "
+          "final equity: {:.3f}".format(
+              len(folds), int(active.sum()),
+              (daily.loc[active, "pnl"] > 0).mean() if active.any()
+              else np.nan,
+              daily["pnl"].sum(), daily["equity"].iloc[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk forward backtest")
+    parser.add_argument("tickers", nargs="+")
+    parser.add_argument("--kind", choices=["reg", "cls"], default="reg")
+    parser.add_argument("--forecast", type=int, default=120)
+    parser.add_argument("--min-train", type=int, default=MIN_TRAIN)
+    parser.add_argument("--step", type=int, default=STEP)
+    parser.add_argument("--window", type=int,
+                        help="rolling window rows, expanding if not given")
+    parser.add_argument("--cold", action="store_true",
+                        help="fit every fold from scratch")
+    parser.add_argument("--jobs", type=int, default=-1)
+    args = parser.parse_args()
+
+    profiling.from_env()
+    start = time.perf_counter()
+    results = backtest_all(args.tickers, n_jobs=args.jobs, kind=args.kind,
+                           forecast=args.forecast, min_train=args.min_train,
+                           step=args.step, window=args.window,
+                           warm_start=not args.cold)
+    for ticker in args.tickers:
+        print_backtest(ticker, *results[ticker])
+        print()
+    print("Backtest took {:.1f}s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import os
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.df_loader as dl
+import data.utils.profiling as profiling
+
+DATA_DIR = Path("data/data")
+CORR_DIR = DATA_DIR / "CORR_DIR"
+
+WINDOWS = [60, 250]
+KINDS = ["prices", "returns"]
+CUBE_FILE = "cube.f32"
+META_FILE = "meta.pkl"
+# memory of the temporary moment arrays of one block of days
+MAX_BYTES = 2 ** 27
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def panel_values(df, kind="prices"):
+    """
+    Values whose correlations are computed
+    :param df: panel (days x tickers)
+    :param kind: "prices" like df.corr() or daily "returns"
+    :return: float64 array (days x tickers), NaN where missing
+    """
+    values = df.values.astype(np.float64)
+    if kind == "returns":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            returns = np.full(values.shape, np.nan)
+            returns[1:] = values[1:] / values[:-1] - 1
+        values = returns
+    values[~np.isfinite(values)] = np.nan
+    return values
+
+
+def center(values):
+    """
+    Correlations do not change with a shift of a column, centering keeps
+    the moment sums small and exact
+    """
+    with np.errstate(invalid="ignore"):
+        means = np.nanmean(values, axis=0)
+    return values - np.where(np.isnan(means), 0, means)
+
+
+def to_corr(n, sx, sxx, sxy, min_periods):
+    """
+    Pairwise correlations from moment sums over the rows where both
+    columns are present, sx[..., i, j] is the sum of column i on rows where
+    column j is present
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var = n * sxx - sx * sx
+        cov = n * sxy - sx * np.swapaxes(sx, -1, -2)
+        corr = cov / np.sqrt(var * np.swapaxes(var, -1, -2))
+    corr[(n < max(min_periods, 2)) | ~np.isfinite(corr)] = np.nan
+    return np.clip(corr, -1, 1)
+
+
+def full_corr(values, min_periods=1):
+    """
+    Correlation matrix over all days from four matrix products, equals
+    DataFrame.corr() with pairwise complete rows
+    :param values: array (days x tickers)
+    :return: float64 array (tickers x tickers)
+    """
+    values = center(values)
+    mask = np.isfinite(values).astype(np.float64)
+    x = np.where(mask > 0, values, 0)
+    return to_corr(mask.T @ mask, x.T @ mask, (x * x).T @ mask, x.T @ x,
+                   min_periods)
+
+
+def rolling_corr(values, window, min_periods=None, start=0):
+    """
+    Rolling correlation matrices of all pairs. The moment sums of a window
+    are differences of cumulative sums, computed in blocks of days so the
+    memory does not grow with the history.
+    :param values: array (days x tickers)
+    :param window: days per window
+    :param min_periods: fewest common days of a pair, window if None
+    :param start: first day to compute, earlier days are only read
+    :return: float32 array (days - start, tickers, tickers)
+    """
+    if min_periods is None:
+        min_periods = window
+    values = center(values)
+    days, tickers = values.shape
+    mask = np.isfinite(values)
+    x = np.where(mask, values, 0)
+    m = mask.astype(np.float64)
+    result = np.empty((days - start, tickers, tickers), dtype=np.float32)
+
+    block = max(1, MAX_BYTES // (4 * 8 * tickers * tickers) - window)
+    for begin in range(start, days, block):
+        end = min(begin + block, days)
+        first = max(begin - window + 1, 0)
+        xb, mb = x[first:end], m[first:end]
+        sums = []
+        for term in (mb[:, :, None] * mb[:, None, :],
+                     xb[:, :, None] * mb[:, None, :],
+                     (xb * xb)[:, :, None] * mb[:, None, :],
+                     xb[:, :, None] * xb[:, None, :]):
+            # window zero rows in front: the sum of the window ending at
+            # row i is cum[window + i] - cum[i]
+            cum = np.zeros((window + len(term), tickers, tickers))
+            np.cumsum(term, axis=0, out=cum[window:])
+            lo, hi = begin - first, end - first
+            sums.append(cum[window + lo:window + hi] - cum[lo:hi])
+        result[begin - start:end - start] = to_corr(*sums, min_periods)
+    return result
+
+
+def cube_name(window, kind="prices"):
+    return "{}_{}".format(kind, window)
+
+
+def cube_dir(window, kind="prices"):
+    return CORR_DIR / cube_name(window, kind)
+
+
+def load_meta(window, kind="prices"):
+    path = cube_dir(window, kind) / META_FILE
+    if not path.exists():
+        return None
+    with open(str(path), "rb") as f:
+        return pickle.load(f)
+
+
+def save_meta(window, kind, meta):
+    path = cube_dir(window, kind) / META_FILE
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(meta, f)
+    os.replace(tmp_path, str(path))
+
+
+def tail_hash(values, dates, window):
+    """ Hash of the rows the next incremental update reads """
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(values[-window:]).tobytes())
+    h.update(np.ascontiguousarray(
+        dates[-window:].values.astype("int64")).tobytes())
+    return h.hexdigest()
+
+
+def load_cube(window, kind="prices"):
+    """
+    Memory maps a correlation cube
+    :return: read-only float32 array (days x tickers x tickers), metadata
+    """
+    meta = load_meta(window, kind)
+    if meta is None:
+        raise IOError("No correlation cube {}, run update_cube first".format(
+            cube_name(window, kind)))
+    n = len(meta["tickers"])
+    cube = np.memmap(str(cube_dir(window, kind) / CUBE_FILE),
+                     dtype=np.float32, mode="r",
+                     shape=(meta["rows"], n, n))
+    return cube, meta
+
+
+def update_cube(window, kind="prices", df=None, min_periods=None):
+    """
+    Brings the persisted correlation cube up to date with the panel. Only
+    the correlations of new days are computed and appended as long as the
+    tickers and the stored days are unchanged, otherwise the cube is
+    rebuilt.
+    :param window: days per window
+    :param kind: "prices" or "returns"
+    :param df: panel, get_dax__as_df() if None
+    :param min_periods: fewest common days of a pair, window if None
+    :return: "full", "append" or "unchanged"
+    """
+    if df is None:
+        df = dl.get_dax__as_df()
+    df = df.drop(["index"], axis=1, errors="ignore")
+    tickers = [str(c) for c in df.columns]
+    values = panel_values(df, kind)
+    dates = pd.DatetimeIndex(df.index)
+    if min_periods is None:
+        min_periods = window
+
+    path = cube_dir(window, kind)
+    meta = load_meta(window, kind)
+    start = 0
+    if meta is not None and meta["tickers"] == tickers and \
+            meta["min_periods"] == min_periods and \
+            meta["rows"] <= len(dates) and \
+            dates[:meta["rows"]].equals(meta["dates"]) and \
+            tail_hash(values[:meta["rows"]], dates[:meta["rows"]],
+                      window) == meta["tail_hash"]:
+        start = meta["rows"]
+    if start == len(dates):
+        return "unchanged"
+
+    if not path.exists():
+        os.makedirs(path_to_string(path))
+    if start == 0 and meta is not None:
+        # the old metadata does not describe the rebuilt cube
+        os.remove(str(path / META_FILE))
+    corr = rolling_corr(values, window, min_periods, start)
+    with open(str(path / CUBE_FILE), "r+b" if start else "wb") as f:
+        # drop rows of an interrupted update beyond the metadata
+        f.truncate(start * len(tickers) ** 2 * 4)
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(corr).tobytes())
+    save_meta(window, kind, {"tickers": tickers, "dates": dates,
+                             "rows": len(dates), "window": window,
+                             "min_periods": min_periods, "kind": kind,
+                             "tail_hash": tail_hash(values, dates, window)})
+    return "append" if start else "full"
+
+
+def corr_at(window, date=None, kind="prices"):
+    """
+    Correlation matrix of one day from the cube
+    :param date: day, the last day if None
+    :return: dataframe (tickers x tickers)
+    """
+    cube, meta = load_cube(window, kind)
+    row = len(meta["dates"]) - 1 if date is None else \
+        meta["dates"].get_loc(pd.Timestamp(date))
+    return pd.DataFrame(np.array(cube[row]), index=meta["tickers"],
+                        columns=meta["tickers"])
+
+
+def pair_series(window, a, b, kind="prices"):
+    """
+    Rolling correlation of two tickers over time from the cube
+    :return: series indexed by date
+    """
+    cube, meta = load_cube(window, kind)
+    i, j = meta["tickers"].index(a), meta["tickers"].index(b)
+    return pd.Series(np.array(cube[:, i, j]), index=meta["dates"],
+                     name="{}/{}".format(a, b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Updates the rolling "
+                                                 "correlation cubes")
+    parser.add_argument("--windows", type=int, nargs="+", default=WINDOWS)
+    parser.add_argument("--kind", choices=KINDS, default="prices")
+    args = parser.parse_args()
+    profiling.from_env()
+
+    df = dl.get_dax__as_df()
+    for window in args.windows:
+        start = time.perf_counter()
+        mode = update_cube(window, args.kind, df)
+        print("{:<14}{:<10}{:>8.2f}s".format(cube_name(window, args.kind),
+                                             mode,
+                                             time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
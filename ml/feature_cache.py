@@ -0,0 +1,207 @@
+import argparse
+import hashlib
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+
+import data.utils.profiling as profiling
+
+DATA_DIR = Path("data/data")
+FEATURE_CACHE_DIR = DATA_DIR / "FEATURE_CACHE"
+MAX_BYTES = 256 * 2 ** 20
+
+META_FILE = "meta.pkl"
+ARRAYS = ["X", "y", "X_data", "df_values", "df_index", "data_values",
+          "data_index", "columns"]
+SCALER_ATTRS = ["min_", "scale_", "data_min_", "data_max_", "data_range_"]
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def data_hash(df):
+    """
+    Returns the content hash of the source data
+    :param df: dataframe with the loaded ticker data
+    :return: hex digest
+    """
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(df.index.values.astype("int64")).tobytes())
+    h.update(",".join(str(c) for c in df.columns).encode())
+    h.update(np.ascontiguousarray(df.values).tobytes())
+    return h.hexdigest()
+
+
+def make_key(ticker, df, forecast_out, version):
+    """
+    Returns the cache key of a feature matrix
+    :param ticker: ticker symbol
+    :param df: source data of the ticker
+    :param forecast_out: days the label is shifted into the future
+    :param version: version of the feature definitions
+    :return: key
+    """
+    raw = "{}|{}|{}|{}".format(ticker, data_hash(df), forecast_out, version)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def entry_dir(key):
+    return FEATURE_CACHE_DIR / key
+
+
+def entry_size(path):
+    return sum(f.stat().st_size for f in path.iterdir())
+
+
+def save(key, ticker, forecast_out, version, X, y, df, X_data, data, scaler):
+    """
+    Saves a feature matrix with the fitted scaler parameters as .npy files.
+    The entry becomes visible atomically.
+    """
+    if not FEATURE_CACHE_DIR.exists():
+        os.makedirs(path_to_string(FEATURE_CACHE_DIR))
+    path = entry_dir(key)
+    tmp_path = FEATURE_CACHE_DIR / "{}.tmp-{}".format(key, os.getpid())
+    if tmp_path.exists():
+        shutil.rmtree(str(tmp_path))
+    os.makedirs(str(tmp_path))
+
+    arrays = {"X": X, "y": y, "X_data": X_data,
+              "df_values": df.values, "df_index": df.index.values,
+              "data_values": data.values, "data_index": data.index.values,
+              "columns": np.array([str(c) for c in df.columns])}
+    for name, values in arrays.items():
+        np.save(str(tmp_path / "{}.npy".format(name)),
+                np.ascontiguousarray(values))
+    for attr in SCALER_ATTRS:
+        np.save(str(tmp_path / "scaler_{}.npy".format(attr)),
+                getattr(scaler, attr))
+    meta = {"ticker": ticker, "forecast_out": forecast_out,
+            "version": version, "created": time.time(),
+            "feature_range": scaler.feature_range}
+    with open(str(tmp_path / META_FILE), "wb") as f:
+        pickle.dump(meta, f)
+
+    if path.exists():
+        shutil.rmtree(str(path))
+    os.rename(str(tmp_path), str(path))
+    evict()
+
+
+def load(key, mmap=True):
+    """
+    Loads a cached feature matrix
+    :param key: key from make_key
+    :param mmap: memory map the arrays instead of reading them
+    :return: dict with X, y, df, X_data, data, scaler and meta or None
+    """
+    path = entry_dir(key)
+    if not (path / META_FILE).exists():
+        return None
+    mode = "r" if mmap else None
+    arrays = {name: np.load(str(path / "{}.npy".format(name)), mmap_mode=mode)
+              for name in ARRAYS}
+    with open(str(path / META_FILE), "rb") as f:
+        meta = pickle.load(f)
+
+    scaler = MinMaxScaler(feature_range=meta["feature_range"])
+    for attr in SCALER_ATTRS:
+        setattr(scaler, attr,
+                np.load(str(path / "scaler_{}.npy".format(attr))))
+    scaler.n_features_in_ = len(scaler.scale_)
+    # last access time drives the eviction order
+    os.utime(str(path / META_FILE))
+
+    columns = list(arrays["columns"])
+    df = pd.DataFrame(arrays["df_values"], columns=columns,
+                      index=pd.DatetimeIndex(arrays["df_index"], name="Date"))
+    data = pd.DataFrame(arrays["data_values"], columns=columns,
+                        index=pd.DatetimeIndex(arrays["data_index"],
+                                               name="Date"))
+    return {"X": arrays["X"], "y": arrays["y"], "df": df,
+            "X_data": arrays["X_data"], "data": data, "scaler": scaler,
+            "meta": meta}
+
+
+def entries():
+    """
+    Returns all cache entries, least recently used first
+    :return: list with (key, meta, size in bytes, last access)
+    """
+    if not FEATURE_CACHE_DIR.exists():
+        return []
+    result = []
+    for path in FEATURE_CACHE_DIR.iterdir():
+        meta_path = path / META_FILE
+        if not meta_path.exists():
+            continue
+        with open(str(meta_path), "rb") as f:
+            meta = pickle.load(f)
+        result.append((path.name, meta, entry_size(path),
+                       meta_path.stat().st_mtime))
+    return sorted(result, key=lambda e: e[3])
+
+
+def evict(max_bytes=MAX_BYTES):
+    """
+    Removes least recently used entries until the cache fits into max_bytes
+    :return: list with removed keys
+    """
+    cached = entries()
+    total = sum(e[2] for e in cached)
+    removed = []
+    for key, _, size, _ in cached:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(str(entry_dir(key)))
+        total -= size
+        removed.append(key)
+    return removed
+
+
+def clear(ticker=None):
+    """
+    Removes all entries or all entries of one ticker
+    :return: number of removed entries
+    """
+    removed = 0
+    for key, meta, _, _ in entries():
+        if ticker is None or meta["ticker"] == ticker:
+            shutil.rmtree(str(entry_dir(key)))
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the "
+                                                 "feature cache")
+    parser.add_argument("command", choices=["list", "clear"])
+    parser.add_argument("--ticker", help="only entries of this ticker")
+    args = parser.parse_args()
+    profiling.from_env()
+
+    if args.command == "clear":
+        print("Removed {} entries".format(clear(args.ticker)))
+        return
+
+    fmt = "{:<14}{:<10}{:>8}{:>12}  {}"
+    print(fmt.format("KEY", "TICKER", "FORECAST", "SIZE [kB]", "LAST USED"))
+    total = 0
+    for key, meta, size, accessed in entries():
+        if args.ticker is not None and meta["ticker"] != args.ticker:
+            continue
+        total += size
+        print(fmt.format(key[:12], meta["ticker"], meta["forecast_out"],
+                         size // 1024, time.ctime(accessed)))
+    print("Total: {} kB of {} kB".format(total // 1024, MAX_BYTES // 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+"""
+Batch feature engine for the indicators of preprocessing.add_new_features.
+Works on a (ticker x day x field) array in which every ticker is left
+aligned: day 0 is its first row and rows after its last day are NaN, so the
+rolling windows cover the same rows as for a single ticker DataFrame.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+FIELDS = ["Open", "High", "Low", "Close", "Volume", "Adj Close"]
+# storage dtype of the feature arrays, the indicators are computed in float64
+FEATURE_DTYPE = np.float32
+# days after which the cumulative sums of the rolling windows restart, no
+# window may be longer
+SEGMENT = 256
+# missing labels filled by interpolation from at most this many days away
+LABEL_LIMIT = 3
+
+# name -> (function, is output column)
+REGISTRY = OrderedDict()
+
+
+def register(name, output=True):
+    """
+    Registers a feature or, with output=False, a shared intermediate
+    :param name: column name of the feature
+    :param output: whether the feature is an output column
+    """
+
+    def decorator(func):
+        REGISTRY[name] = (func, output)
+        return func
+
+    return decorator
+
+
+def feature_columns():
+    return [name for name, (_, output) in REGISTRY.items() if output]
+
+
+class FeatureContext:
+    """
+    Lazily evaluates and memoizes registered features over a
+    (ticker x day x field) array. Day 0 has to be a multiple of SEGMENT
+    days after the first day of every ticker.
+    """
+
+    def __init__(self, values, fields, lengths, forecast_out, state=None,
+                 checkpoint=None):
+        """
+        :param state: filter states of the recursive features at day 0,
+        e.g. those of the block before in a stream, zero if None
+        :param checkpoint: day whose filter states are kept in next_state,
+        the last day if None
+        """
+        self.values = values
+        self.fields = {field: i for i, field in enumerate(fields)}
+        self.lengths = np.asarray(lengths)
+        self.forecast_out = forecast_out
+        self.state = state or {}
+        self.checkpoint = checkpoint
+        self.next_state = {}
+        self.memo = {}
+
+    def field(self, name):
+        return self.values[:, :, self.fields[name]]
+
+    def ewm_mean(self, name, x, span):
+        """ ewm_mean which continues from and keeps the state of name """
+        mean, self.next_state[name] = ewm_mean(
+            x, span, self.state.get(name), self.checkpoint)
+        return mean
+
+    def __getitem__(self, name):
+        if name not in self.memo:
+            self.memo[name] = REGISTRY[name][0](self)
+        return self.memo[name]
+
+
+# helpers over (ticker x day) arrays
+
+def shift(x, periods):
+    """ Shifts along the day axis like pd.Series.shift """
+    out = np.full_like(x, np.nan)
+    if periods > 0:
+        out[:, periods:] = x[:, :-periods]
+    elif periods < 0:
+        out[:, :periods] = x[:, -periods:]
+    else:
+        out[:] = x
+    return out
+
+
+def segments(x, fill):
+    """
+    Splits the day axis into segments of SEGMENT days
+    :return: array (ticker x segment x SEGMENT), padded with fill
+    """
+    n = -(-x.shape[1] // SEGMENT)
+    padded = np.full((x.shape[0], n * SEGMENT), fill, dtype=np.float64)
+    padded[:, :x.shape[1]] = x
+    return padded.reshape(x.shape[0], n, SEGMENT)
+
+
+def segment_cumsum(x):
+    """
+    Cumulative sums which restart every SEGMENT days. A sum over a window
+    then only depends on the days of its segments, not on all days before.
+    :return: array (ticker x segment x SEGMENT + 1), the sums of the first
+    k days of every segment
+    """
+    parts = segments(x, 0)
+    out = np.zeros(parts.shape[:2] + (SEGMENT + 1,))
+    np.cumsum(parts, axis=2, out=out[:, :, 1:])
+    return out
+
+
+def window_sums(csum, lo, hi):
+    """
+    Sums of the days lo to hi - 1 from segment_cumsum, a window spans at
+    most two segments
+    :return: sums of the segment of lo, sums of the segment of hi - 1, which
+    are 0 if both are the same segment
+    """
+    seg_lo, pos_lo = np.divmod(lo, SEGMENT)
+    seg_hi, pos_hi = np.divmod(hi - 1, SEGMENT)
+    same = seg_lo == seg_hi
+    head = csum[:, seg_lo, pos_lo]
+    tail = csum[:, seg_hi, pos_hi + 1]
+    first = np.where(same, tail - head, csum[:, seg_lo, SEGMENT] - head)
+    second = np.where(same, 0, tail)
+    return first, second
+
+
+def window_bounds(x, window):
+    if window > SEGMENT:
+        raise ValueError("window {} is longer than SEGMENT".format(window))
+    hi = np.arange(1, x.shape[1] + 1)
+    return np.maximum(0, hi - window), hi
+
+
+def valid_counts(x, lo, hi):
+    """ Number of valid values in the days lo to hi - 1 """
+    ccount = np.zeros((x.shape[0], x.shape[1] + 1), dtype=np.int64)
+    np.cumsum(~np.isnan(x), axis=1, out=ccount[:, 1:])
+    return ccount[:, hi] - ccount[:, lo]
+
+
+def rolling_sums(x, window):
+    """
+    Rolling sum of x from segment wise cumulative sums and number of valid
+    values in each window
+    """
+    lo, hi = window_bounds(x, window)
+    first, second = window_sums(segment_cumsum(np.where(np.isnan(x), 0, x)),
+                                lo, hi)
+    return first + second, valid_counts(x, lo, hi)
+
+
+def rolling_mean(x, window, min_periods=None):
+    """ Like pd.Series.rolling(window, min_periods).mean() """
+    if min_periods is None:
+        min_periods = window
+    total, count = rolling_sums(x, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count >= max(min_periods, 1), total / count, np.nan)
+
+
+def rolling_sum(x, window, min_periods=None):
+    """ Like pd.Series.rolling(window, min_periods).sum() """
+    if min_periods is None:
+        min_periods = window
+    total, count = rolling_sums(x, window)
+    return np.where(count >= max(min_periods, 1), total, np.nan)
+
+
+def rolling_std(x, window, min_periods=None):
+    """ Like pd.Series.rolling(window, min_periods).std() with ddof=1 """
+    if min_periods is None:
+        min_periods = window
+    # every segment is centered at its first valid value, which keeps the
+    # sums of squares small
+    parts = segments(x, np.nan)
+    valid = ~np.isnan(parts)
+    centers = np.take_along_axis(parts, valid.argmax(axis=2)[:, :, None],
+                                 axis=2)[:, :, 0]
+    centers = np.where(valid.any(axis=2), centers, 0)
+    centered = x - np.repeat(centers, SEGMENT, axis=1)[:, :x.shape[1]]
+    centered = np.where(np.isnan(centered), 0, centered)
+
+    lo, hi = window_bounds(x, window)
+    count = valid_counts(x, lo, hi)
+    total_lo, total_hi = window_sums(segment_cumsum(centered), lo, hi)
+    squares_lo, squares_hi = window_sums(segment_cumsum(centered ** 2), lo,
+                                         hi)
+    # the days of the second segment moved to the center of the first
+    count_hi = count - valid_counts(
+        x, lo, np.minimum(hi, (lo // SEGMENT + 1) * SEGMENT))
+    shift_hi = centers[:, (hi - 1) // SEGMENT] - centers[:, lo // SEGMENT]
+    total = total_lo + (total_hi + count_hi * shift_hi)
+    squares = squares_lo + (squares_hi + 2 * shift_hi * total_hi +
+                            count_hi * shift_hi ** 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = (squares - total ** 2 / count) / (count - 1)
+    var = np.maximum(var, 0)
+    return np.where((count >= max(min_periods, 2)), np.sqrt(var), np.nan)
+
+
+def ewm_mean(x, span, state=None, checkpoint=None):
+    """
+    Recursive pd.Series.ewm(span).mean() with adjust=True. Missing values
+    only decay the weights.
+    :param state: filter state (2 x ticker x 1) at day 0, zero if None
+    :param checkpoint: day whose filter state is returned, the last if None
+    :return: mean, filter state at checkpoint
+    """
+    decay = 1 - 2.0 / (span + 1)
+    valid = ~np.isnan(x)
+    inputs = np.stack([np.where(valid, x, 0), valid.astype(np.float64)])
+    if state is None:
+        state = np.zeros(inputs.shape[:2] + (1,))
+    if checkpoint is None:
+        checkpoint = x.shape[1]
+    # filtering the days before and after the checkpoint separately gives
+    # the same numbers as one pass
+    head, tail = inputs[:, :, :checkpoint], inputs[:, :, checkpoint:]
+    parts = []
+    if head.shape[2]:
+        filtered, state = lfilter([1.0], [1.0, -decay], head, axis=2,
+                                  zi=state)
+        parts.append(filtered)
+    if tail.shape[2]:
+        parts.append(lfilter([1.0], [1.0, -decay], tail, axis=2, zi=state)[0])
+    num, den = np.concatenate(parts, axis=2) if parts else inputs
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den > 0, num / den, np.nan), state
+
+
+def interpolate(x, lengths, limit):
+    """
+    Linear interpolation of NaN values like
+    pd.Series.interpolate(limit=limit, limit_direction="both") within the
+    first lengths[i] days of every ticker
+    """
+    out = x.copy()
+    days = np.arange(x.shape[1])
+    for i, length in enumerate(lengths):
+        row = out[i, :length]
+        missing = np.isnan(row)
+        if not missing.any() or missing.all():
+            continue
+        valid_pos = days[:length][~missing]
+        prev_pos = np.maximum.accumulate(np.where(missing, -1, days[:length]))
+        next_pos = np.minimum.accumulate(
+            np.where(missing, length, days[:length])[::-1])[::-1]
+        fill = missing & (((prev_pos >= 0) & (days[:length] - prev_pos <= limit))
+                          | ((next_pos < length) &
+                             (next_pos - days[:length] <= limit)))
+        row[fill] = np.interp(days[:length][fill], valid_pos, row[~missing])
+    return out
+
+
+# registered features, in the column order of add_new_features
+
+@register("Adj Close")
+def adj_close(ctx):
+    return ctx.field("Adj Close")
+
+
+@register("Volume")
+def log_volume(ctx):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.log(ctx.field("Volume"))
+
+
+@register("high_low_pct")
+def high_low_pct(ctx):
+    return (ctx.field("High") - ctx.field("Low")) / ctx.field("Close") * 100.0
+
+
+@register("log_adj_close", output=False)
+def log_adj_close(ctx):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.log(ctx.field("Adj Close"))
+
+
+@register("change")
+def change(ctx):
+    return ctx["log_adj_close"] - shift(ctx["log_adj_close"], 1)
+
+
+@register("pct_change")
+def pct_change(ctx):
+    return (ctx.field("Close") - ctx.field("Open")) / ctx.field("Open") * 100.0
+
+
+@register("daily_return")
+def daily_return(ctx):
+    return (ctx.field("Close") / ctx.field("Open")) - 1
+
+
+@register("5d_mean_log")
+def mean_log_5d(ctx):
+    # log of 5 day moving average of volume
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.log(rolling_mean(ctx.field("Volume"), 5))
+
+
+@register("volume_mov_avg")
+def volume_mov_avg(ctx):
+    # daily volume vs. 200 day moving average
+    return ctx.field("Volume") / rolling_mean(ctx.field("Volume"), 200) - 1
+
+
+@register("close_ewm_50", output=False)
+def close_ewm_50(ctx):
+    return ctx.ewm_mean("close_ewm_50", ctx.field("Close"), 50)
+
+
+@register("close_vs_moving")
+def close_vs_moving(ctx):
+    # daily closing price vs. 50 day exponential moving avg
+    return ctx.field("Close") / ctx["close_ewm_50"] - 1
+
+
+@register("z_score")
+def z_score(ctx):
+    close = ctx.field("Close")
+    mean = rolling_mean(close, 200, min_periods=20)
+    return (close - mean) / rolling_std(close, 200, min_periods=20)
+
+
+@register("signing")
+def signing(ctx):
+    return np.sign(ctx["pct_change"])
+
+
+@register("plus_minus")
+def plus_minus(ctx):
+    return rolling_sum(ctx["signing"], 20)
+
+
+@register("label")
+def label(ctx):
+    label = np.round(shift(ctx.field("Adj Close"), -ctx.forecast_out), 3)
+    return interpolate(label, ctx.lengths, limit=LABEL_LIMIT)
+
+
+def stack_frames(frames, fields=FIELDS, dtype=np.float64):
+    """
+    Stacks DataFrames of several tickers into one left aligned array
+    :param frames: list with DataFrames containing the fields
+    :param fields: columns stacked as field axis
+    :return: array (ticker x day x field), list with the row counts
+    """
+    lengths = [len(df) for df in frames]
+    values = np.full((len(frames), max(lengths or [0]), len(fields)), np.nan,
+                     dtype=dtype)
+    for i, df in enumerate(frames):
+        values[i, :len(df)] = df[fields].values
+    return values, lengths
+
+
+def fill_missing(out, lengths=None):
+    """
+    Sanitizes a feature array in place: infinite values become NaN and
+    missing values are filled with the mean of each ticker and feature.
+    Rows after the last day of a ticker are left as they are.
+    :param out: array (ticker x day x feature)
+    :param lengths: number of rows of every ticker, all rows if None
+    :return: out
+    """
+    if lengths is None:
+        lengths = [out.shape[1]] * len(out)
+    for i, length in enumerate(lengths):
+        rows = out[i, :length]
+        rows[np.isinf(rows)] = np.nan
+        missing = np.isnan(rows)
+        if not missing.any():
+            continue
+        with np.errstate(invalid="ignore"):
+            means = np.nanmean(rows, axis=0, dtype=np.float64)
+        rows[missing] = np.broadcast_to(means, rows.shape)[missing]
+    return out
+
+
+def compute_feature_array(values, lengths, forecast_out, fields=FIELDS,
+                          columns=None, fill=True, dtype=FEATURE_DTYPE):
+    """
+    Computes the registered features in one pass. Infinite values are
+    replaced and missing values filled with the mean of each ticker and
+    feature, like add_new_features does.
+    :param values: array (ticker x day x field)
+    :param lengths: number of rows of every ticker
+    :param forecast_out: days the label is shifted into the future
+    :param columns: features to compute, all registered outputs if None
+    :param fill: fill missing values, raw indicators with NaN if False
+    :param dtype: dtype of the returned array
+    :return: array (ticker x day x feature)
+    """
+    if columns is None:
+        columns = feature_columns()
+    ctx = FeatureContext(values, fields, lengths, forecast_out)
+    out = np.empty(values.shape[:2] + (len(columns),), dtype=dtype)
+    for k, column in enumerate(columns):
+        out[:, :, k] = ctx[column]
+    if not fill:
+        out[np.isinf(out)] = np.nan
+        return out
+    return fill_missing(out, ctx.lengths)
+
+
+def compute_features(frames, forecast_out, columns=None, fill=True,
+                     dtype=FEATURE_DTYPE):
+    """
+    Batch version of add_new_features. The frames are views of one array.
+    :param frames: dict ticker -> DataFrame with OHLCV columns
+    :param forecast_out: days the label is shifted into the future
+    :param columns: features to compute, all registered outputs if None
+    :param fill: fill missing values, raw indicators with NaN if False
+    :param dtype: dtype of the features
+    :return: dict ticker -> DataFrame with features
+    """
+    tickers = list(frames)
+    values, lengths = stack_frames([frames[t] for t in tickers])
+    if columns is None:
+        columns = feature_columns()
+    out = compute_feature_array(values, lengths, forecast_out,
+                                columns=columns, fill=fill, dtype=dtype)
+    return OrderedDict(
+        (ticker, pd.DataFrame(out[i, :lengths[i]],
+                              index=frames[ticker].index, columns=columns))
+        for i, ticker in enumerate(tickers))
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import as_strided
+
+HM_DAYS = 7
+REQUIREMENT = 0.02
+LABEL_DTYPE = np.int8
+
+
+def forward_windows(values, hm_days):
+    """
+    Returns a read-only strided view with the current and the next hm_days
+    values for every day. Days after the end are NaN.
+    :param values: array of shape (days, tickers)
+    :param hm_days: number of days to look ahead
+    :return: array of shape (days, tickers, hm_days + 1)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    days, tickers = values.shape
+    padded = np.full((days + hm_days, tickers), np.nan)
+    padded[:days] = values
+    s_day, s_ticker = padded.strides
+    return as_strided(padded, shape=(days, tickers, hm_days + 1),
+                      strides=(s_day, s_ticker, s_day), writeable=False)
+
+
+def future_returns(prices, hm_days=HM_DAYS):
+    """
+    Computes the returns 1..hm_days days ahead like process_data_for_labels:
+    missing prices count as 0, returns which can not be computed are 0.
+    :param prices: array of shape (days, tickers)
+    :param hm_days: number of days to look ahead
+    :return: array of shape (days, tickers, hm_days)
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    prices = np.where(np.isnan(prices), 0, prices)
+    windows = forward_windows(prices, hm_days)
+    current = windows[:, :, :1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = (windows[:, :, 1:] - current) / current
+    returns[np.isnan(returns)] = 0
+    return returns
+
+
+def labels_from_returns(returns, requirement=REQUIREMENT):
+    """
+    Vectorized buy_sell_hold: the first horizon whose return crosses
+    +requirement (1) or -requirement (-1) wins, otherwise 0
+    :param returns: array of shape (..., hm_days)
+    :param requirement: return threshold
+    :return: int8 array of shape (...)
+    """
+    crossed = np.zeros(returns.shape, dtype=LABEL_DTYPE)
+    crossed[returns > requirement] = 1
+    crossed[returns < -requirement] = -1
+    first = np.argmax(crossed != 0, axis=-1)
+    return np.take_along_axis(crossed, first[..., None], axis=-1)[..., 0]
+
+
+def label_matrix(prices, hm_days=HM_DAYS, requirement=REQUIREMENT):
+    """
+    Labels all tickers at once. Same as labels_from_returns over
+    future_returns, but the returns are computed one horizon at a time into
+    the same buffer, so memory does not grow with hm_days.
+    :param prices: array of shape (days, tickers)
+    :return: int8 label matrix of shape (days, tickers)
+    """
+    prices = np.array(prices, dtype=np.float64)
+    prices[np.isnan(prices)] = 0
+    days = len(prices)
+    labels = np.zeros(prices.shape, dtype=LABEL_DTYPE)
+    buffer = np.empty(prices.shape)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for k in range(1, min(hm_days, days - 1) + 1):
+            returns = buffer[:days - k]
+            np.subtract(prices[k:], prices[:-k], out=returns)
+            np.divide(returns, prices[:-k], out=returns)
+            # only days without a crossing at an earlier horizon
+            open_ = labels[:days - k] == 0
+            labels[:days - k][open_ & (returns > requirement)] = 1
+            labels[:days - k][open_ & (returns < -requirement)] = -1
+    return labels
+
+
+def label_panel(df, hm_days=HM_DAYS, requirement=REQUIREMENT):
+    """
+    Labels every column of the "Adj Close" panel
+    :param df: panel with one column per ticker
+    :return: dataframe with int8 labels for each ticker
+    """
+    labels = label_matrix(df.values, hm_days, requirement)
+    return pd.DataFrame(labels, index=df.index, columns=df.columns)
+
+
+def iter_label_grid(prices, hm_days, requirements):
+    """
+    Labels all tickers for every combination of look ahead and threshold,
+    one look ahead at a time. Same as label_matrix per combination, but the
+    returns are computed once. The running maximum of the absolute returns
+    does not decrease, so the first horizon crossing a threshold is the
+    number of horizons whose running maximum is not above it. These counts
+    are found for all thresholds at once with one binary search.
+    :param prices: array of shape (days, tickers)
+    :param hm_days: list with numbers of days to look ahead
+    :param requirements: list with return thresholds
+    :return: generator of (position in hm_days, int8 array of shape
+    (len(requirements), days, tickers))
+    """
+    requirements = np.asarray(requirements, dtype=np.float64)
+    order = np.argsort(requirements, kind="mergesort")
+    returns = future_returns(prices, max(hm_days))
+    days, tickers, _ = returns.shape
+    cells = days * tickers
+    signs = np.sign(returns).astype(np.int8).reshape(cells, -1)
+    running_max = np.maximum.accumulate(np.abs(returns), axis=-1)
+    # thresholds from starts[:, k] on are not crossed up to horizon k
+    starts = np.searchsorted(requirements[order],
+                             running_max.reshape(cells, -1), side="left")
+
+    counts = np.zeros((cells, len(requirements) + 1), dtype=np.int16)
+    rows = np.arange(cells)
+    done = 0
+    for i in np.argsort(hm_days, kind="mergesort"):
+        hm = hm_days[i]
+        for k in range(done, hm):
+            counts[rows, starts[:, k]] += 1
+        done = max(done, hm)
+        first = np.cumsum(counts[:, :-1], axis=-1, dtype=np.int16)
+        sign = np.take_along_axis(signs[:, :hm], np.minimum(first, hm - 1),
+                                  axis=-1)
+        sign[first >= hm] = 0
+        labels = np.empty((len(requirements), days, tickers),
+                          dtype=LABEL_DTYPE)
+        labels[order] = sign.T.reshape(len(requirements), days, tickers)
+        yield i, labels
+
+
+def label_grid(prices, hm_days, requirements):
+    """
+    Labels all tickers for every combination of look ahead and threshold
+    :return: int8 array of shape (len(hm_days), len(requirements), days,
+    tickers)
+    """
+    labels = np.empty((len(hm_days), len(requirements)) +
+                      np.shape(prices), dtype=LABEL_DTYPE)
+    for i, values in iter_label_grid(prices, hm_days, requirements):
+        labels[i] = values
+    return labels
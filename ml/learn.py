@@ -1,4 +1,5 @@
 import datetime
+import time
 from collections import Counter
 
 import numpy as np
@@ -8,18 +9,33 @@ from sklearn import svm, neighbors
 from sklearn.ensemble import AdaBoostRegressor
 from sklearn.ensemble import VotingClassifier, RandomForestClassifier
 from sklearn.ensemble import VotingRegressor
-from sklearn.feature_selection import RFE
 from sklearn.linear_model import Ridge
 from sklearn.model_selection import train_test_split, RandomizedSearchCV
 from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import PolynomialFeatures
+from sklearn.preprocessing import MinMaxScaler, PolynomialFeatures
 from sklearn.tree import DecisionTreeRegressor
 from xgboost import XGBRegressor
 
-from ml.preprocessing import get_reg_data, get_cls_data
+import data.utils.profiling as profiling
+from ml import registry
+from ml.preprocessing import get_reg_data, get_cls_data, get_data_snapshot
+from ml.preprocessing import feature_values
+from ml.preprocessing import FEATURE_VERSION
+from ml.search import HalvingSearch
+from ml.selection import SELECTION, select_features
 from plotting.utils import plotter as plt
 
+# parallel jobs of the model search, lowered by the batch scheduler
+N_JOBS = -1
+# hyperparameter search of new models, "halving" or "random"
+SEARCHES = ["halving", "random"]
+SEARCH = "halving"
+# sklearn 1.2 renamed the base_estimator parameter of AdaBoost to estimator
+ADB_TREE = "adb_reg__estimator" if "estimator" in AdaBoostRegressor(
+).get_params() else "adb_reg__base_estimator"
 
+
+@profiling.profiled("classification")
 def do_classification(ticker):
     X, y, df = get_cls_data(ticker)
 
@@ -28,6 +44,8 @@ def do_classification(ticker):
     clf = VotingClassifier([("lsvc", svm.LinearSVC()),
                             ("knn", neighbors.KNeighborsClassifier()),
                             ("rfor", RandomForestClassifier())])
+    with profiling.stage("fit", estimator="VotingClassifier"):
+        clf.fit(X_train, y_train)
 
     confidence = clf.score(X_test, y_test)
     print("Predictions for : {}".format(ticker))
@@ -52,30 +70,38 @@ def report(results, n_top=3):
             print("")
 
 
-def do_regression(ticker, name, forecast):
-    print("STOCK DATA PREDICTION COM: {}".format(name))
-    X, y, df, X_data, data = get_reg_data(ticker, forecast)
+def fit_regression(X, y, features, selection=None, search=None,
+                   history_key=None, random_state=None):
+    """
+    Selects features and searches the voting ensemble
+    :param X: scaled features
+    :param y: labels
+    :param features: feature names
+    :param selection: feature selection, one of selection.SELECTORS
+    :param search: hyperparameter search, one of SEARCHES
+    :param history_key: name of the search history of the halving search
+    :param random_state: seed of the train/test split
+    :return: fitted search, indices of the selected features, test score
+    """
     regr_1 = make_pipeline(PolynomialFeatures(3), Ridge())
     regr_2 = neighbors.KNeighborsRegressor(n_neighbors=2, weights="distance")
     regr_3 = DecisionTreeRegressor(max_depth=4)
     regr_4 = AdaBoostRegressor(DecisionTreeRegressor(max_depth=4),
                                n_estimators=3000)
-    regr_5 = XGBRegressor(random_state=42, objective="reg:squarederror")
+    regr_5 = XGBRegressor(random_state=42, objective="reg:squarederror",
+                          n_jobs=1)
 
-    selector = RFE(estimator=regr_4, n_features_to_select=5)
-    X_new = selector.fit_transform(X, y)
-    features = data.columns.values
     print("Features in Dataset: \n{}".format(features))
-    features_for_prediction = selector.get_support()
-    indicies = [i for i in range(0, len(features_for_prediction)) if
-                features_for_prediction[i]]
+    start = time.perf_counter()
+    with profiling.stage("selection", estimator=selection or SELECTION):
+        indicies = select_features(X, y, method=selection, n_jobs=N_JOBS)
+    X_new = X[:, indicies]
     columns_for_prediction = [features[i] for i in indicies]
-    print("Features used for preditcion based on RFE: \n{}".format(
+    print("Features used for preditcion based on {} ({:.1f}s): \n{}".format(
+        selection or SELECTION, time.perf_counter() - start,
         columns_for_prediction))
-    # select features for prediction
-    X_data = X_data[:, indicies]
-    X_train, X_test, y_train, y_test = train_test_split(X_new, y,
-                                                        test_size=0.3)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X_new, y, test_size=0.3, random_state=random_state)
 
     clf = VotingRegressor([("poly3", regr_1),
                            ("knn", regr_2),
@@ -87,10 +113,9 @@ def do_regression(ticker, name, forecast):
                   "dt_reg__max_depth": sp_randint(4, 7),
                   "dt_reg__min_samples_split": sp_randint(2, 10),
                   "dt_reg__max_features": sp_randint(2, 5),
-                  "adb_reg__base_estimator__max_depth": sp_randint(4, 7),
-                  "adb_reg__base_estimator__min_samples_split": sp_randint(2,
-                                                                           10),
-                  "adb_reg__base_estimator__max_features": sp_randint(2, 5),
+                  ADB_TREE + "__max_depth": sp_randint(4, 7),
+                  ADB_TREE + "__min_samples_split": sp_randint(2, 10),
+                  ADB_TREE + "__max_features": sp_randint(2, 5),
                   "adb_reg__n_estimators": sp_randint(1, 5000),
                   "xgb_reg__colsample_bytree": uniform(0.7, 0.3),
                   "xgb_reg__gamma": uniform(0, 0.5),
@@ -101,16 +126,120 @@ def do_regression(ticker, name, forecast):
                   }
     # print(clf.get_params().keys())
 
-    random_search = RandomizedSearchCV(clf, param_distributions=param_dist,
-                                       n_iter=5, cv=10, n_jobs=-1, verbose=1)
+    if search is None:
+        search = SEARCH
+    if search == "halving":
+        # the AdaBoost trees grow with the rows of each halving round
+        random_search = HalvingSearch(
+            clf, param_dist, n_jobs=N_JOBS, history_key=history_key,
+            early_stopping="xgb_reg", budget_params=["adb_reg__n_estimators"])
+    elif search == "random":
+        random_search = RandomizedSearchCV(clf,
+                                           param_distributions=param_dist,
+                                           n_iter=5, cv=10, n_jobs=N_JOBS,
+                                           verbose=1)
+    else:
+        raise ValueError("Unknown search {}, use one of {}".format(
+            search, SEARCHES))
     print("Training of model is starting..")
-    random_search.fit(X_train, y_train)
+    start = time.perf_counter()
+    with profiling.stage("search", estimator=search):
+        random_search.fit(X_train, y_train)
     report(random_search.cv_results_)
+    if search == "halving":
+        n_configs = random_search.n_candidates_
+        n_fits = random_search.n_fits_
+        print("Warm started with {} configurations of earlier "
+              "searches".format(random_search.n_warm_))
+    else:
+        n_configs = len(random_search.cv_results_["params"])
+        n_fits = n_configs * random_search.n_splits_
+    print("Search evaluated {} configurations in {} fits, {:.1f}s".format(
+        n_configs, n_fits, time.perf_counter() - start))
 
     # clf.fit(X_train, y_train)
     confidence = random_search.score(X_test, y_test)
     print("Accuracy:", confidence)
-    forecast = random_search.predict(X_data)
+    return random_search, indicies, confidence
+
+
+@profiling.profiled("regression")
+def do_regression(ticker, name, forecast, retrain=False, plot=True,
+                  selection=None, search=None):
+    """
+    Forecasts a ticker with the newest stored model. A new model is only
+    trained on request or if the registry policy says the stored one is
+    stale or the data drifted.
+    :param ticker: ticker symbol
+    :param name: company name
+    :param forecast: days to forecast
+    :param retrain: train a new model in any case
+    :param plot: plot the forecast
+    :param selection: feature selection of a new model, one of
+    selection.SELECTORS
+    :param search: hyperparameter search of a new model, one of SEARCHES
+    :return: dataframe with EOD and Forecast, metadata of the used model
+    """
+    print("STOCK DATA PREDICTION COM: {}".format(name))
+    X, y, df, X_data, data = get_reg_data(ticker, forecast)
+    forecast_out = int(forecast)
+    features = data.columns.values
+    raw_train = feature_values(df)
+    raw_forecast = feature_values(data)
+
+    meta = registry.find_latest(ticker, forecast_out=forecast_out,
+                                feature_version=FEATURE_VERSION)
+    if retrain:
+        reason = "retraining requested"
+    elif meta is None:
+        reason = "no stored model"
+    else:
+        new_rows = raw_train[df.index > meta["train_end"]]
+        reason = registry.retrain_reason(meta, new_rows[:, meta["indicies"]])
+
+    if reason is None:
+        model, load_time = registry.load_model(ticker, meta["version"])
+        print("Using model version {} of {} (loaded in {:.1f} ms)".format(
+            meta["version"], ticker, load_time * 1000))
+    else:
+        print("Training new model: {}".format(reason))
+        random_search, indicies, confidence = fit_regression(
+            X, y, features, selection, search,
+            history_key="{}-{}".format(ticker, forecast_out))
+        model = random_search.best_estimator_
+        selected = raw_train[:, indicies]
+        meta = {"forecast_out": forecast_out,
+                "feature_version": FEATURE_VERSION,
+                "snapshot": get_data_snapshot(ticker),
+                "selection": selection or SELECTION,
+                "search": search or SEARCH,
+                "indicies": indicies,
+                "columns": [features[i] for i in indicies],
+                "scaler": MinMaxScaler().partial_fit(raw_train).partial_fit(
+                    raw_forecast),
+                "best_params": random_search.best_params_,
+                "cv_score": random_search.best_score_,
+                "test_score": confidence,
+                "train_start": df.index[0],
+                "train_end": df.index[-1],
+                "train_rows": len(df),
+                "train_mean": np.nanmean(selected, axis=0),
+                "train_std": np.nanstd(selected, axis=0)}
+        meta["version"] = registry.save_model(ticker, model, meta)
+
+    # select features for prediction
+    X_data = meta["scaler"].transform(raw_forecast)[:, meta["indicies"]]
+    start = time.perf_counter()
+    with profiling.stage("predict", estimator=type(model).__name__):
+        forecast = model.predict(X_data)
+    print("Prediction of {} days took {:.1f} ms".format(
+        len(forecast), (time.perf_counter() - start) * 1000))
+    if profiling.is_enabled():
+        # predict time of every estimator of the ensemble
+        for estimator, fitted in getattr(model, "named_estimators_",
+                                         {}).items():
+            with profiling.stage("predict", estimator=estimator):
+                fitted.predict(X_data)
     data = data[["Adj Close"]]
     data = data.rename(columns={"Adj Close": "EOD"})
     data["Forecast"] = forecast[:]
@@ -121,7 +250,9 @@ def do_regression(ticker, name, forecast):
     df["Forecast"] = np.nan
     # df = save_forecast(df, forecast)
 
-    plt.plot_forecast(data, ticker, name)
+    if plot:
+        plt.plot_forecast(data, ticker, name)
+    return data, meta
 
 
 def save_forecast(df, forecast):
@@ -0,0 +1,300 @@
+import math
+import os
+import pickle
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import data.utils.df_loader as dl
+import data.utils.store as store
+from ml.features import FIELDS, compute_features
+
+ONLINE_COLUMNS = ["Adj Close", "Volume", "high_low_pct", "change",
+                  "pct_change", "daily_return", "5d_mean_log",
+                  "volume_mov_avg", "close_vs_moving", "z_score", "signing",
+                  "plus_minus"]
+RTOL = 1e-6
+ATOL = 1e-8
+
+
+def state_path(ticker):
+    return store.NPY_DIR / "{}.online.pkl".format(ticker)
+
+
+def features_dir(ticker):
+    return store.NPY_DIR / "{}.online".format(ticker)
+
+
+def feature_file(ticker, column):
+    return features_dir(ticker) / "{}.raw".format(column.replace(" ", "_"))
+
+
+def feature_files(ticker):
+    """ Raw file and dtype of the Date index and of every online column """
+    files = [(features_dir(ticker) / "Date.raw", np.int64)]
+    return files + [(feature_file(ticker, column), np.float64)
+                    for column in ONLINE_COLUMNS]
+
+
+def log(x):
+    if x > 0:
+        return math.log(x)
+    if x == 0:
+        return -math.inf
+    return math.nan
+
+
+def divide(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return float(np.float64(a) / np.float64(b))
+
+
+class RollingWindow:
+    """
+    Rolling sum, mean and std over the last window values, updated in O(1).
+    The sums are kept relative to the first value to stay accurate and are
+    recomputed from the window every window updates against drift.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.offset = None
+        self.total = 0.0
+        self.squares = 0.0
+        self.count = 0
+        self.updates = 0
+
+    def push(self, x):
+        if len(self.values) == self.window:
+            self._remove(self.values[0])
+        self.values.append(x)
+        if not math.isnan(x):
+            if self.offset is None:
+                self.offset = x
+            d = x - self.offset
+            self.total += d
+            self.squares += d * d
+            self.count += 1
+        self.updates += 1
+        if self.updates % self.window == 0:
+            self._resync()
+
+    def sum(self, min_periods):
+        if self.count < max(min_periods, 1):
+            return math.nan
+        return self.total + self.count * self.offset
+
+    def mean(self, min_periods):
+        if self.count < max(min_periods, 1):
+            return math.nan
+        return self.offset + self.total / self.count
+
+    def std(self, min_periods):
+        if self.count < max(min_periods, 2):
+            return math.nan
+        var = (self.squares - self.total ** 2 / self.count) / (self.count - 1)
+        return math.sqrt(max(var, 0.0))
+
+    def _remove(self, x):
+        if not math.isnan(x):
+            d = x - self.offset
+            self.total -= d
+            self.squares -= d * d
+            self.count -= 1
+
+    def _resync(self):
+        valid = [x - self.offset for x in self.values if not math.isnan(x)]
+        self.total = math.fsum(valid)
+        self.squares = math.fsum(d * d for d in valid)
+        self.count = len(valid)
+
+
+class OnlineFeatures:
+    """
+    State of the add_new_features indicators of one ticker. update() takes
+    one new bar and returns its feature row in O(1).
+    """
+
+    def __init__(self, ewm_span=50):
+        self.volume_5 = RollingWindow(5)
+        self.volume_200 = RollingWindow(200)
+        self.close_200 = RollingWindow(200)
+        self.signing_20 = RollingWindow(20)
+        self.decay = 1 - 2.0 / (ewm_span + 1)
+        self.ewm_num = 0.0
+        self.ewm_den = 0.0
+        self.prev_log_adj = math.nan
+        self.last_date = None
+        self.rows = 0
+
+    def update(self, date, o, h, l, c, v, adj):
+        self.volume_5.push(v)
+        self.volume_200.push(v)
+        self.close_200.push(c)
+        if math.isnan(c):
+            self.ewm_num *= self.decay
+            self.ewm_den *= self.decay
+        else:
+            self.ewm_num = c + self.decay * self.ewm_num
+            self.ewm_den = 1.0 + self.decay * self.ewm_den
+
+        log_adj = log(adj)
+        pct_change = divide(c - o, o) * 100.0
+        signing = float(np.sign(pct_change))
+        self.signing_20.push(signing)
+        ewm = self.ewm_num / self.ewm_den if self.ewm_den > 0 else math.nan
+
+        row = [adj,
+               log(v),
+               divide(h - l, c) * 100.0,
+               log_adj - self.prev_log_adj,
+               pct_change,
+               divide(c, o) - 1,
+               log(self.volume_5.mean(5)),
+               divide(v, self.volume_200.mean(200)) - 1,
+               divide(c, ewm) - 1,
+               divide(c - self.close_200.mean(20), self.close_200.std(20)),
+               signing,
+               self.signing_20.sum(20)]
+        self.prev_log_adj = log_adj
+        self.last_date = date
+        self.rows += 1
+        return [math.nan if math.isinf(x) else x for x in row]
+
+
+def load_state(ticker):
+    path = state_path(ticker)
+    if not path.exists():
+        return None
+    with open(str(path), "rb") as f:
+        return pickle.load(f)
+
+
+def save_state(ticker, state):
+    path = state_path(ticker)
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp_path, str(path))
+
+
+def stored_rows(ticker):
+    """
+    Returns the number of feature rows which all raw files hold
+    :param ticker: ticker symbol
+    :return: number of rows
+    """
+    rows = []
+    for path, dtype in feature_files(ticker):
+        if not path.exists():
+            return 0
+        rows.append(path.stat().st_size // np.dtype(dtype).itemsize)
+    return min(rows)
+
+
+def load_features(ticker):
+    """
+    Returns the persisted online feature rows of the whole history. Only
+    the rows covered by the saved state are read, rows appended by an
+    update which did not finish are ignored.
+
+    :param ticker: ticker symbol
+    :return: dataframe with ONLINE_COLUMNS or None
+    """
+    state = load_state(ticker)
+    if state is None or stored_rows(ticker) < state.rows:
+        return None
+    files = feature_files(ticker)
+    index_path, index_dtype = files[0]
+    index = np.fromfile(str(index_path), dtype=index_dtype, count=state.rows)
+    data = {column: np.fromfile(str(path), dtype=dtype, count=state.rows)
+            for column, (path, dtype) in zip(ONLINE_COLUMNS, files[1:])}
+    return pd.DataFrame(data, columns=ONLINE_COLUMNS,
+                        index=pd.DatetimeIndex(
+                            index.view("datetime64[ns]"), name="Date"))
+
+
+def save_features(ticker, features, start):
+    """
+    Appends feature rows to one raw file per column. The files are cut to
+    the first start rows before, which drops the rows of an update which
+    did not finish and allows to rewrite the history with start 0. The
+    rows already stored are neither read nor written again.
+
+    :param ticker: ticker symbol
+    :param features: dataframe with the new rows and ONLINE_COLUMNS
+    :param start: number of stored rows the new rows follow
+    """
+    path = features_dir(ticker)
+    if not path.exists():
+        os.makedirs(str(path))
+    index = pd.DatetimeIndex(features.index).values.astype("datetime64[ns]")
+    values = [index.view(np.int64)] + [features[column].values
+                                       for column in ONLINE_COLUMNS]
+    for (file, dtype), column in zip(feature_files(ticker), values):
+        with open(str(file), "ab") as f:
+            f.truncate(start * np.dtype(dtype).itemsize)
+            np.ascontiguousarray(column, dtype=dtype).tofile(f)
+
+
+def update_online_features(ticker, verify=False):
+    """
+    Feeds all bars newer than the persisted state into the online
+    indicators. The first call starts from the beginning of the history.
+    Only the new rows are appended to the persisted feature rows of the
+    whole history, get_reg_data builds the features from them instead of
+    recomputing the indicators.
+
+    :param ticker: ticker symbol
+    :param verify: compare the new rows with a full batch recompute
+    :return: dataframe with the feature rows of the new bars
+    """
+    state = load_state(ticker)
+    df = dl.get_com_as_df(ticker, columns=FIELDS)
+    if state is not None:
+        df_new = df[df.index > state.last_date]
+        # the history was rewritten, e.g. after an adjustment drift
+        if (state.last_date not in df.index or
+                len(df) - len(df_new) != state.rows or
+                stored_rows(ticker) < state.rows or
+                not np.isclose(log(df.loc[state.last_date, "Adj Close"]),
+                               state.prev_log_adj, rtol=RTOL, atol=ATOL,
+                               equal_nan=True)):
+            state = None
+    if state is None:
+        state = OnlineFeatures()
+        df_new = df
+
+    rows = [state.update(date, *values) for date, values in
+            zip(df_new.index, df_new[FIELDS].values.tolist())]
+    features = pd.DataFrame(rows, index=df_new.index, columns=ONLINE_COLUMNS)
+    # the saved state commits the appended rows
+    save_features(ticker, features, state.rows - len(features))
+    save_state(ticker, state)
+
+    if verify:
+        mismatches = verify_online_features(df, features)
+        if mismatches:
+            print("Online features of {} differ from batch: {}".format(
+                ticker, mismatches))
+        else:
+            print("Online features of {} match batch recompute".format(
+                ticker))
+    return features
+
+
+def verify_online_features(df, features):
+    """
+    Compares online feature rows with a full batch recompute
+    :param df: whole history of the ticker
+    :param features: rows returned by update_online_features
+    :return: list with the columns which differ
+    """
+    batch = compute_features({"_": df}, 0, columns=ONLINE_COLUMNS,
+                             fill=False, dtype=np.float64)["_"].loc[
+        features.index]
+    return [column for column in ONLINE_COLUMNS
+            if not np.allclose(features[column].values, batch[column].values,
+                               rtol=RTOL, atol=ATOL, equal_nan=True)]
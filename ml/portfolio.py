@@ -0,0 +1,142 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import data.utils.df_loader as dl
+import data.utils.profiling as profiling
+from ml.labels import HM_DAYS, REQUIREMENT, iter_label_grid
+
+# transaction costs per unit of turnover, e.g. 0.1 % of the traded value
+COST = 0.001
+# days between a signal and the first return of its position
+DELAY = 1
+TRADING_DAYS = 252
+# parameter combinations simulated at once
+CHUNK = 64
+
+
+def daily_returns(prices):
+    """
+    Returns from one day to the next, missing or zero prices give 0
+    :param prices: array of shape (days, tickers)
+    :return: array of shape (days, tickers), the first day is 0
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    returns = np.zeros(prices.shape)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns[1:] = prices[1:] / prices[:-1] - 1
+    returns[~np.isfinite(returns)] = 0
+    return returns
+
+
+def simulate(signals, returns, cost=COST, delay=DELAY):
+    """
+    Simulates an equally weighted long/short portfolio for a batch of
+    signal matrices without looping over days. The position of a ticker is
+    its signal delay days before, turnover is the change of the position.
+    :param signals: int8 array of shape (..., days, tickers) with -1, 0, 1,
+    the leading axes are parameter combinations
+    :param returns: array of shape (days, tickers) from daily_returns
+    :param cost: costs per unit of turnover
+    :param delay: days between signal and position
+    :return: dict with position (..., days, tickers) and turnover, costs,
+    returns and equity of the portfolio (..., days)
+    """
+    signals = np.asarray(signals, dtype=np.int8)
+    position = np.zeros(signals.shape, dtype=np.int8)
+    position[..., delay:, :] = signals[..., :signals.shape[-2] - delay, :]
+    n_tickers = signals.shape[-1]
+
+    change = np.diff(position, axis=-2, prepend=0)
+    turnover = np.abs(change, dtype=np.float64).sum(axis=-1) / n_tickers
+    gross = np.einsum("...dt,dt->...d", position, returns) / n_tickers
+    costs = turnover * cost
+    net = gross - costs
+    return {"position": position, "turnover": turnover, "costs": costs,
+            "returns": net, "equity": np.cumprod(1 + net, axis=-1)}
+
+
+def summarize(result):
+    """
+    Key figures of simulated portfolios
+    :param result: dict from simulate
+    :return: dict with arrays of shape (...) for each figure
+    """
+    returns = result["returns"]
+    equity = result["equity"]
+    std = returns.std(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe = np.where(std > 0, returns.mean(axis=-1) / std, 0) * \
+                 np.sqrt(TRADING_DAYS)
+    drawdown = 1 - equity / np.maximum.accumulate(equity, axis=-1)
+    return {"total_return": equity[..., -1] - 1,
+            "sharpe": sharpe,
+            "max_drawdown": drawdown.max(axis=-1),
+            "turnover": result["turnover"].mean(axis=-1),
+            "costs": result["costs"].sum(axis=-1)}
+
+
+def scan_grid(prices, hm_days, requirements, cost=COST, delay=DELAY,
+              chunk=CHUNK):
+    """
+    Simulates the buy/sell/hold labels of every look ahead and threshold
+    combination as signals. The labels look into the future, so the figures
+    are an upper bound of what a model predicting them could reach.
+    :param prices: adjusted close panel (days x tickers)
+    :param hm_days: list with numbers of days to look ahead
+    :param requirements: list with return thresholds
+    :return: dataframe indexed by hm_days and requirement with the figures
+    of summarize, equity curves of shape (hm_days, requirements, days)
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    returns = daily_returns(prices)
+    equity = np.empty((len(hm_days), len(requirements), len(prices)))
+    columns = ["total_return", "sharpe", "max_drawdown", "turnover", "costs"]
+    figures = {c: np.empty((len(hm_days), len(requirements)))
+               for c in columns}
+    for i, labels in iter_label_grid(prices, hm_days, requirements):
+        for start in range(0, len(requirements), chunk):
+            stop = start + chunk
+            signals = labels[start:stop]
+            result = simulate(signals, returns, cost, delay)
+            equity[i, start:stop] = result["equity"]
+            for c, values in summarize(result).items():
+                figures[c][i, start:stop] = values
+
+    index = pd.MultiIndex.from_product([hm_days, requirements],
+                                       names=["hm_days", "requirement"])
+    return pd.DataFrame({c: figures[c].ravel() for c in columns},
+                        index=index, columns=columns), equity
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scans the hm_days and "
+                                                 "requirement grid of the "
+                                                 "labels")
+    parser.add_argument("--hm-days", type=int, nargs="+",
+                        default=list(range(1, 31)))
+    parser.add_argument("--requirements", type=int, default=100,
+                        help="thresholds between 0.5 %% and 10 %%")
+    parser.add_argument("--cost", type=float, default=COST)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    profiling.from_env()
+
+    df = dl.get_dax__as_df()
+    requirements = np.linspace(0.005, 0.1, args.requirements)
+    start = time.perf_counter()
+    figures, _ = scan_grid(df.values, args.hm_days, requirements, args.cost)
+    elapsed = time.perf_counter() - start
+    print("Simulated {} combinations over {} days and {} tickers in "
+          "{:.1f}s".format(len(figures), len(df), len(df.columns), elapsed))
+    print(figures.sort_values("sharpe", ascending=False).head(args.top)
+          .to_string(float_format="{:.4f}".format))
+    current, _ = scan_grid(df.values, [HM_DAYS], [REQUIREMENT], args.cost)
+    print("Current labels:")
+    print(current.to_string(float_format="{:.4f}".format))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,20 +6,30 @@ from pandas import DataFrame
 from sklearn.impute import SimpleImputer
 
 import data.utils.df_loader as dl
+import data.utils.profiling as profiling
+import data.utils.universe as uv
 import data.utils.web_scrappers as ws
+import ml.feature_cache as fc
+import ml.online as online
+from ml.labels import HM_DAYS, REQUIREMENT, future_returns, labels_from_returns
+from ml.labels import label_panel
+from ml.features import FEATURE_DTYPE, compute_features, fill_missing
 
+FEATURE_COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Adj Close"]
+# bump whenever add_new_features or get_reg_data change their output
+FEATURE_VERSION = 4
 
-def process_data_for_labels(ticker):
+
+def process_data_for_labels(ticker, hm_days=HM_DAYS):
     """
     Computes new columns needed for label generation for specific ticker.
     Getting future values by shifting a column up. Gives future values i days in
     advance.
     :param ticker: Company symbol
+    :param hm_days: number of days to look ahead
     :return: Dataframe with new columns
     """
-    hm_days = 7
-    df = dl.get_dax__as_df()
-    df.fillna(0, inplace=True)
+    df = dl.get_dax__as_df().fillna(0)
 
     for i in range(1, hm_days + 1):
         df["{}_{}d".format(ticker, i)] = (df[ticker].shift(-i) - df[
@@ -30,9 +40,8 @@ def process_data_for_labels(ticker):
     return df
 
 
-def buy_sell_hold(*args):
+def buy_sell_hold(*args, requirement=REQUIREMENT):
     cols = [c for c in args]
-    requirement = 0.02
     for col in cols:
         if col > requirement:
             return 1
@@ -41,42 +50,80 @@ def buy_sell_hold(*args):
     return 0
 
 
-def get_cls_data(ticker):
+@profiling.profiled("cls_features")
+def get_cls_data(ticker, hm_days=HM_DAYS, requirement=REQUIREMENT):
     """
-    Firstly computes labels based on new generated columns
+    Firstly computes labels based on the returns of the next hm_days days.
+    Same result as buy_sell_hold over the columns of process_data_for_labels,
+    but vectorized and without adding columns to the panel. The panel is
+    copied once and sanitized in place, features and labels are computed on
+    its array.
     :param ticker: Company symbol
+    :param hm_days: number of days to look ahead
+    :param requirement: return which has to be crossed for buy or sell
     :return: Features, labels, DataFrame
     """
     tickers = ws.get_tickers()
 
-    df = process_data_for_labels(ticker)
-
-    df["{}_target".format(ticker)] = list(map(buy_sell_hold,
-                                              df["{}_1d".format(ticker)],
-                                              df["{}_2d".format(ticker)],
-                                              df["{}_3d".format(ticker)],
-                                              df["{}_4d".format(ticker)],
-                                              df["{}_5d".format(ticker)],
-                                              df["{}_6d".format(ticker)],
-                                              df["{}_7d".format(ticker)]))
+    panel = dl.get_dax__as_df()
+    prices = np.array(panel.values, dtype=dl.PANEL_DTYPE)
+    prices[np.isnan(prices)] = 0
+    column = panel.columns.get_loc(ticker)
+    returns = future_returns(prices[:, column:column + 1], hm_days)[:, 0, :]
+    y = labels_from_returns(returns, requirement)
 
-    vals = df["{}_target".format(ticker)].values.tolist()
-    str_vals = [str(i) for i in vals]
+    str_vals = [str(i) for i in y.tolist()]
     print("Dataspread:", Counter(str_vals))
 
-    df.fillna(0, inplace=True)
-    df = df.replace([np.inf, -np.inf], np.nan)
-    df.dropna(inplace=True)
-
-    df_vals = df[[ticker for ticker in tickers]].pct_change()
-    df_vals = df_vals.replace([np.inf, -np.inf], 0)
-    df_vals.fillna(0, inplace=True)
+    # rows with infinite returns are dropped
+    keep = np.isfinite(returns).all(axis=1) & np.isfinite(prices).all(axis=1)
+    prices = prices[keep]
+    y = y[keep]
+    df = DataFrame(prices, index=panel.index[keep], columns=panel.columns)
+    df["{}_target".format(ticker)] = y
 
-    X = df_vals.values
-    y = df["{}_target".format(ticker)].values
+    X = pct_change(prices[:, [panel.columns.get_loc(t) for t in tickers]])
     return X, y, df
 
 
+def has_cls_data(ticker):
+    """
+    Checks if get_cls_data can label a ticker, its features are the returns
+    of the DAX panel, so only tickers of the panel can be labeled
+    :param ticker: Company symbol
+    :return: True if the ticker is a column of the panel
+    """
+    return ticker in dl.get_dax__as_df().columns
+
+
+def pct_change(values):
+    """
+    DataFrame.pct_change of an array without missing values, changes which
+    can not be computed are 0
+    :param values: array (days x columns)
+    :return: array of the same shape and dtype
+    """
+    out = np.zeros_like(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(values[1:], values[:-1], out=out[1:])
+    out[1:] -= 1
+    out[~np.isfinite(out)] = 0
+    return out
+
+
+@profiling.profiled("labels")
+def get_cls_labels(hm_days=HM_DAYS, requirement=REQUIREMENT):
+    """
+    Computes the buy/sell/hold labels of all tickers at once
+    :param hm_days: number of days to look ahead
+    :param requirement: return which has to be crossed for buy or sell
+    :return: dataframe (days x tickers) with int8 labels
+    """
+    # label_matrix counts missing prices as 0 itself
+    return label_panel(dl.get_dax__as_df(), hm_days, requirement)
+
+
+@profiling.profiled("add_new_features")
 def add_new_features(df_org, forecast_out):
     df = df_org.loc[:, ["Adj Close", "Volume"]]
     df["high_low_pct"] = (df_org["High"] - df_org["Low"]) / df_org[
@@ -88,7 +135,6 @@ def add_new_features(df_org, forecast_out):
     df["pct_change"] = (df_org["Close"] - df_org["Open"]) / df_org[
         "Open"] * 100.0
     df["daily_return"] = (df_org["Close"] / df_org["Open"]) - 1
-    df.fillna(method="pad")
     df["Volume"] = np.log(df_org["Volume"])
     # log of 5 day moving average of volume
     df["5d_mean_log"] = df_org["Volume"].rolling(5).mean().apply(
@@ -108,11 +154,72 @@ def add_new_features(df_org, forecast_out):
     df["label"] = df["Adj Close"].shift(-forecast_out).round(3)
     df["label"] = df["label"].interpolate(limit=3, limit_direction="both")
 
-    df = df.replace([np.inf, -np.inf], np.nan)
+    # one contiguous FEATURE_DTYPE copy, sanitized in place
+    values = np.empty(df.shape, dtype=FEATURE_DTYPE)
+    for k, column in enumerate(df.columns):
+        values[:, k] = df[column].values
     # df = missing_values_transformer(df)
-    df.fillna(df.mean(), inplace=True)
+    fill_missing(values[np.newaxis])
 
-    return df
+    return DataFrame(values, index=df.index, columns=df.columns)
+
+
+@profiling.profiled("add_new_features")
+def add_online_features(df_org, online_rows, forecast_out):
+    """
+    Same frame as add_new_features, but the indicators are the persisted
+    rows of ml.online. Only the label is computed and the missing values
+    are filled, no indicator is recomputed after a refresh.
+    :param df_org: dataframe with OHLCV columns
+    :param online_rows: rows of online.load_features with the index of
+    df_org
+    :param forecast_out: days the label is shifted into the future
+    :return: dataframe with features and label
+    """
+    label = compute_features({"_": df_org}, forecast_out, columns=["label"],
+                             fill=False, dtype=np.float64)["_"]
+    columns = list(online_rows.columns) + ["label"]
+    values = np.empty((len(df_org), len(columns)), dtype=FEATURE_DTYPE)
+    values[:, :-1] = online_rows.values
+    values[:, -1] = label["label"].values
+    fill_missing(values[np.newaxis])
+    return DataFrame(values, index=df_org.index, columns=columns)
+
+
+@profiling.profiled("features")
+def get_features(tickers, forecast, cached=True, resolution=None):
+    """
+    Computes the features of add_new_features for several tickers at once
+    :param tickers: list with ticker symbols
+    :param forecast: bars the label is shifted into the future
+    :param cached: keep the loaded ticker frames in the cache
+    :param resolution: resolution of intraday bars, daily bars if None
+    :return: dict ticker -> DataFrame with features
+    """
+    if resolution is None:
+        frames = {ticker: dl.get_com_as_df(ticker, columns=FEATURE_COLUMNS,
+                                           cached=cached)
+                  for ticker in tickers}
+    else:
+        frames = {ticker: dl.get_bars_as_df(ticker, resolution,
+                                            FEATURE_COLUMNS)
+                  for ticker in tickers}
+    return compute_features(frames, int(forecast))
+
+
+def iter_features(tickers, forecast, chunk_size=uv.CHUNK_SIZE):
+    """
+    Computes the features of a large universe chunk by chunk, memory only
+    grows with chunk_size, not with the size of the universe
+    :param tickers: Universe or list with ticker symbols
+    :param forecast: days the label is shifted into the future
+    :param chunk_size: tickers computed at once
+    :return: generator of dicts ticker -> DataFrame with features
+    """
+    tickers = list(tickers)
+    for start in range(0, len(tickers), chunk_size):
+        yield get_features(tickers[start:start + chunk_size], forecast,
+                           cached=False)
 
 
 def missing_values_transformer(df):
@@ -122,24 +229,78 @@ def missing_values_transformer(df):
     return df
 
 
-def get_reg_data(ticker, forecast):
-    df = dl.get_com_as_df(ticker)
-    forecast_out = int(forecast)  # predict int days into future
-    df = add_new_features(df, forecast_out)
+def feature_values(df):
+    """
+    Returns the feature columns of a frame of add_new_features without the
+    label, which is its last column, as view of its values
+    :param df: dataframe of add_new_features
+    :return: array (days x features)
+    """
+    return df.values[:, :-1]
+
+
+def get_data_snapshot(ticker):
+    """
+    Returns the content hash of the ticker data used for the features
+    :param ticker: Company symbol
+    :return: hex digest
+    """
+    return fc.data_hash(dl.get_com_as_df(ticker, columns=FEATURE_COLUMNS))
+
+
+@profiling.profiled("features")
+def get_reg_data(ticker, forecast, use_cache=True, resolution=None):
+    df = dl.get_bars_as_df(ticker, resolution, FEATURE_COLUMNS)
+    forecast_out = int(forecast)  # predict int bars into future
+    key = fc.make_key(ticker, df, forecast_out, FEATURE_VERSION)
+    if use_cache:
+        entry = fc.load(key)
+        if entry is not None:
+            print("Loaded features of {} from cache".format(ticker))
+            return (entry["X"], entry["y"], entry["df"], entry["X_data"],
+                    entry["data"])
+
+    online_rows = online.load_features(ticker) if resolution is None else None
+    if online_rows is not None and online_rows.index.equals(df.index):
+        print("Using online features of {}".format(ticker))
+        df = add_online_features(df, online_rows, forecast_out)
+    else:
+        df = add_new_features(df, forecast_out)
     print("Description of data set: \n {}".format(df.describe()))
-    X = np.array(df.drop(["label"], 1))
-    scaler = sklearn.preprocessing.MinMaxScaler()
+    # the only copy of the features, scaled in place
+    X = np.array(feature_values(df))
+    scaler = sklearn.preprocessing.MinMaxScaler(copy=False)
     X = scaler.fit_transform(X)
     X_data = X[-forecast_out:]
     X = X[:-forecast_out]
 
     data = df[-forecast_out:]
     df = df[:-forecast_out]
-    y = np.array(df["label"])
+    y = np.ascontiguousarray(df["label"].values)
 
     # # Value distrib
     # vals = df["label"].values.tolist()
     # str_vals = [str(i) for i in vals]
     # print("Data spread:", Counter(str_vals))
 
+    fc.save(key, ticker, forecast_out, FEATURE_VERSION, X, y, df, X_data,
+            data, scaler)
     return X, y, df, X_data, data
+
+
+def get_raw_reg_data(ticker, forecast, resolution=None):
+    """
+    Features and labels of get_reg_data without filling and scaling. The
+    means and ranges of get_reg_data come from the whole history, callers
+    which must not see later rows fit them on their training rows instead.
+    :param ticker: Company symbol
+    :param forecast: bars the label is shifted into the future
+    :param resolution: resolution of intraday bars, daily bars if None
+    :return: features with NaN where missing, labels, DataFrame of the rows
+    with a label
+    """
+    df = dl.get_bars_as_df(ticker, resolution, FEATURE_COLUMNS)
+    forecast_out = int(forecast)
+    df = compute_features({ticker: df}, forecast_out, fill=False)[ticker]
+    df = df[:-forecast_out]
+    return feature_values(df), df["label"].values, df
@@ -0,0 +1,141 @@
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+import data.utils.cache as cache
+
+DATA_DIR = Path("data/data")
+MODEL_DIR = DATA_DIR / "MODEL_DIR"
+
+MODEL_FILE = "model.pkl"
+META_FILE = "meta.pkl"
+# retrain if the newest model is older than this
+MAX_AGE_DAYS = 30
+# retrain if the mean of a selected feature on new rows moved more than this
+# many training standard deviations
+DRIFT_THRESHOLD = 2.0
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def ticker_dir(ticker):
+    return MODEL_DIR / ticker
+
+
+def versions(ticker):
+    """
+    Returns all stored model versions of a ticker, oldest first
+    :param ticker: ticker symbol
+    :return: list with version numbers
+    """
+    path = ticker_dir(ticker)
+    if not path.exists():
+        return []
+    return sorted(int(p.name[1:]) for p in path.iterdir()
+                  if p.name.startswith("v") and (p / META_FILE).exists())
+
+
+def version_dir(ticker, version):
+    return ticker_dir(ticker) / "v{}".format(version)
+
+
+def save_model(ticker, model, meta):
+    """
+    Saves a fitted model with its metadata as new version
+    :param ticker: ticker symbol
+    :param model: fitted estimator
+    :param meta: dict with selection, scaler, params, training window, scores
+    :return: version number
+    """
+    existing = versions(ticker)
+    version = existing[-1] + 1 if existing else 1
+    path = version_dir(ticker, version)
+    tmp_path = ticker_dir(ticker) / "v{}.tmp-{}".format(version, os.getpid())
+    os.makedirs(str(tmp_path))
+
+    meta = dict(meta, ticker=ticker, version=version, created=time.time())
+    joblib.dump(model, str(tmp_path / MODEL_FILE))
+    with open(str(tmp_path / META_FILE), "wb") as f:
+        pickle.dump(meta, f)
+    os.rename(str(tmp_path), str(path))
+    print("Saved model of {} as version {}".format(ticker, version))
+    return version
+
+
+def load_meta(ticker, version):
+    with open(path_to_string(version_dir(ticker, version) / META_FILE),
+              "rb") as f:
+        return pickle.load(f)
+
+
+def find_latest(ticker, **match):
+    """
+    Returns the metadata of the newest version whose metadata matches
+    :param ticker: ticker symbol
+    :param match: required metadata values, e.g. forecast_out=120
+    :return: metadata dict or None
+    """
+    for version in reversed(versions(ticker)):
+        meta = load_meta(ticker, version)
+        if all(meta.get(k) == v for k, v in match.items()):
+            return meta
+    return None
+
+
+def load_model(ticker, version):
+    """
+    Loads a stored model. Versions never change once saved, so a process
+    running several jobs loads every version only once.
+    :return: fitted estimator, load time in seconds
+    """
+    start = time.perf_counter()
+    path = path_to_string(version_dir(ticker, version) / MODEL_FILE)
+    model = cache.cached(path, lambda: joblib.load(path), "model")
+    return model, time.perf_counter() - start
+
+
+def delete_model(ticker, version=None):
+    path = ticker_dir(ticker) if version is None else \
+        version_dir(ticker, version)
+    if path.exists():
+        shutil.rmtree(str(path))
+
+
+def feature_drift(meta, X_new):
+    """
+    Largest shift of a feature mean on new rows, in training std units
+    :param meta: model metadata with train_mean and train_std
+    :param X_new: raw feature rows after the training window
+    :return: drift, 0 without new rows
+    """
+    if len(X_new) == 0:
+        return 0.0
+    std = np.where(meta["train_std"] > 0, meta["train_std"], 1.0)
+    shift = np.abs(np.nanmean(X_new, axis=0) - meta["train_mean"]) / std
+    return float(np.nanmax(shift))
+
+
+def retrain_reason(meta, X_new, max_age_days=MAX_AGE_DAYS,
+                   drift_threshold=DRIFT_THRESHOLD):
+    """
+    Applies the staleness and drift policy to a stored model
+    :param meta: metadata of the stored model or None
+    :param X_new: raw feature rows after its training window
+    :return: reason for retraining or None if the model can be used
+    """
+    if meta is None:
+        return "no stored model"
+    age = (time.time() - meta["created"]) / 86400
+    if max_age_days is not None and age > max_age_days:
+        return "model is {:.0f} days old".format(age)
+    drift = feature_drift(meta, X_new)
+    if drift_threshold is not None and drift > drift_threshold:
+        return "feature drift {:.2f}".format(drift)
+    return None
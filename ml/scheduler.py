@@ -0,0 +1,246 @@
+import hashlib
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import data.utils.cache as cache
+import data.utils.df_loader as dl
+import data.utils.profiling as profiling
+import data.utils.store as store
+import data.utils.universe as uv
+import data.utils.web_scrappers as ws
+from ml import learn
+from ml.preprocessing import FEATURE_COLUMNS, FEATURE_VERSION, has_cls_data
+
+DATA_DIR = Path("data/data")
+RUN_DIR = DATA_DIR / "RUN_DIR"
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def split_cores(n_tickers, n_cores=None):
+    """
+    Splits the cores between ticker workers and the n_jobs of each model
+    search, so both together never use more than n_cores
+    :param n_tickers: number of tickers to train
+    :param n_cores: available cores, all if None
+    :return: number of worker processes, n_jobs per worker
+    """
+    if n_cores is None:
+        n_cores = os.cpu_count() or 1
+    workers = max(1, min(n_tickers, n_cores))
+    return workers, max(1, n_cores // workers)
+
+
+def data_version(ticker):
+    """
+    Returns the signature of the stored data of a ticker, which changes with
+    every write
+    :param ticker: ticker symbol
+    :return: tuple (mtime, size) or None if the ticker is not stored
+    """
+    path = store.com_dir(ticker) / store.COLUMNS_FILE
+    if not path.exists():
+        return None
+    return cache.file_signature(path)[1:]
+
+
+def make_run_id(tickers, forecast, retrain, classify, universe):
+    """
+    Names a run after what it trains: the tickers and the version of their
+    data, the forecast, the options and FEATURE_VERSION. Starting a run
+    which died again with the same arguments resumes it, new data or
+    features start a new run.
+    :return: run id
+    """
+    h = hashlib.sha1()
+    h.update(repr((forecast, retrain, classify, universe,
+                   FEATURE_VERSION)).encode())
+    for ticker in sorted(tickers):
+        h.update(repr((ticker, data_version(ticker))).encode())
+    return "{}-{}".format(forecast, h.hexdigest()[:16])
+
+
+def checkpoint_path(run_id, ticker):
+    return RUN_DIR / run_id / "{}.pkl".format(ticker)
+
+
+def load_checkpoint(run_id, ticker):
+    path = checkpoint_path(run_id, ticker)
+    if not path.exists():
+        return None
+    with open(str(path), "rb") as f:
+        return pickle.load(f)
+
+
+def save_checkpoint(run_id, ticker, result):
+    path = checkpoint_path(run_id, ticker)
+    if not path.parent.exists():
+        os.makedirs(str(path.parent))
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(result, f)
+    os.replace(tmp_path, str(path))
+
+
+def warm_cache(tickers, classify, universe=uv.DEFAULT_UNIVERSE):
+    """
+    Loads the ticker frames and the panel once in the parent process. The
+    workers get the filled cache, forked workers without any copy.
+    """
+    for ticker in tickers:
+        try:
+            dl.get_com_as_df(ticker, columns=FEATURE_COLUMNS)
+        except IOError:
+            # the worker reports the missing data
+            continue
+    if classify:
+        dl.get_dax__as_df()
+    uv.load_universe(universe)
+
+
+def init_worker(entries, n_jobs):
+    # forked workers already hold the entries of the parent
+    if not cache.stats()["entries"]:
+        cache.update(entries)
+    learn.N_JOBS = n_jobs
+
+
+@profiling.profiled("train")
+def train_ticker(ticker, forecast, retrain, classify,
+                 universe=uv.DEFAULT_UNIVERSE):
+    """
+    Trains and forecasts one ticker inside a worker. A failed
+    classification is reported in "cls_error" and does not fail the
+    regression result.
+    :return: dict with the results of the ticker
+    """
+    start = time.perf_counter()
+    result = {"ticker": ticker, "status": "ok"}
+    try:
+        forecast_df, meta = learn.do_regression(
+            ticker, ws.ticker_to_name(ticker, universe), forecast,
+            retrain=retrain, plot=False)
+        result["forecast"] = forecast_df
+        result["version"] = meta["version"]
+        result["test_score"] = meta["test_score"]
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    if classify and result["status"] == "ok":
+        try:
+            if has_cls_data(ticker):
+                result["accuracy"] = learn.do_classification(ticker)
+            else:
+                result["cls_error"] = "not in the DAX panel"
+        except Exception as e:
+            result["cls_error"] = "{}: {}".format(type(e).__name__, e)
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def train_all(tickers=None, forecast=120, retrain=False, classify=None,
+              n_cores=None, run_id=None, universe=uv.DEFAULT_UNIVERSE,
+              chunk_size=uv.CHUNK_SIZE):
+    """
+    Trains and forecasts all tickers on a process pool. Results are
+    checkpointed per ticker, a run with the same run_id skips the tickers
+    which are already done. Large universes are trained chunk by chunk and
+    the cache is cleared after each chunk, so the loaded frames do not grow
+    with the universe.
+
+    :param tickers: list with ticker symbols, all tickers of the universe
+    if None
+    :param forecast: days to forecast
+    :param retrain: train new models in any case
+    :param classify: also run do_classification for every ticker of the
+    DAX panel, only for the default universe if None
+    :param n_cores: cores to use, all if None
+    :param run_id: name of the run, made by make_run_id if None
+    :param universe: name of the universe the tickers belong to
+    :param chunk_size: tickers trained per pool
+    :return: dict ticker -> result
+    """
+    if tickers is None:
+        tickers = list(uv.load_universe(universe).tickers())
+    if classify is None:
+        classify = universe == uv.DEFAULT_UNIVERSE
+    if run_id is None:
+        run_id = make_run_id(tickers, forecast, retrain, classify, universe)
+
+    results = {}
+    todo = []
+    for ticker in tickers:
+        result = load_checkpoint(run_id, ticker)
+        if result is None:
+            todo.append(ticker)
+        else:
+            results[ticker] = result
+    if results:
+        print("Resuming run {}: {} of {} tickers done".format(
+            run_id, len(results), len(tickers)))
+
+    start = time.perf_counter()
+    for chunk_start in range(0, len(todo), chunk_size):
+        chunk = todo[chunk_start:chunk_start + chunk_size]
+        workers, n_jobs = split_cores(len(chunk), n_cores)
+        print("Training {} of {} tickers on {} workers with n_jobs={}".format(
+            len(chunk), len(todo), workers, n_jobs))
+        train_chunk(chunk, results, forecast, retrain, classify, run_id,
+                    universe, workers, n_jobs)
+        if chunk_start + chunk_size < len(todo):
+            cache.clear()
+
+    print_summary(tickers, results, time.perf_counter() - start)
+    return results
+
+
+def train_chunk(tickers, results, forecast, retrain, classify, run_id,
+                universe, workers, n_jobs):
+    """
+    Trains one chunk of tickers on a fresh process pool and adds the
+    results to the results dict
+    """
+    warm_cache(tickers, classify, universe)
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_worker,
+                             initargs=(dict(cache.CACHE.entries),
+                                       n_jobs)) as executor:
+        mode = profiling.settings()
+        futures = [executor.submit(profiling.call, mode, train_ticker, ticker,
+                                   forecast, retrain, classify, universe)
+                   for ticker in tickers]
+        for future in as_completed(futures):
+            result = profiling.unwrap(future.result())
+            results[result["ticker"]] = result
+            if result["status"] == "ok":
+                save_checkpoint(run_id, result["ticker"], result)
+            print("{:<10}{:<8}{:>8.1f}s".format(
+                result["ticker"], result["status"], result["elapsed"]))
+
+
+def print_summary(tickers, results, elapsed):
+    fmt = "{:<10}{:<8}{:>10}{:>10}{:>10}  {}"
+    print(fmt.format("TICKER", "STATUS", "R2", "ACCURACY", "TIME [s]",
+                     "ERROR"))
+    for ticker in tickers:
+        r = results.get(ticker, {})
+        print(fmt.format(ticker, r.get("status", "-"),
+                         "{:.3f}".format(r["test_score"])
+                         if "test_score" in r else "-",
+                         "{:.3f}".format(r["accuracy"])
+                         if "accuracy" in r else "-",
+                         "{:.1f}".format(r.get("elapsed", 0)),
+                         r.get("error", r.get("cls_error", ""))))
+    busy = sum(r.get("elapsed", 0) for r in results.values())
+    print("Wall time {:.1f}s, summed ticker time {:.1f}s".format(elapsed,
+                                                                 busy))
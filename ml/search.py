@@ -0,0 +1,244 @@
+import hashlib
+import math
+import os
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import KFold, ParameterSampler, cross_val_score
+
+DATA_DIR = Path("data/data")
+SEARCH_CACHE_DIR = DATA_DIR / "SEARCH_CACHE"
+
+N_CANDIDATES = 27
+FACTOR = 3
+CV = 3
+# fewest training rows a candidate is evaluated on
+MIN_SAMPLES = 60
+# best configurations of earlier searches put into the next one
+WARM_START = 3
+MAX_HISTORY = 20
+EARLY_STOPPING_ROUNDS = 10
+VALIDATION_SIZE = 0.2
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def history_path(key):
+    name = hashlib.sha1(key.encode()).hexdigest()
+    return SEARCH_CACHE_DIR / "{}.pkl".format(name)
+
+
+def load_history(key):
+    """
+    Returns the configurations of earlier searches, best first
+    :param key: name of the search, e.g. ticker, forecast and columns
+    :return: list with dicts params, score, std, n_samples
+    """
+    path = history_path(key)
+    if not path.exists():
+        return []
+    with open(str(path), "rb") as f:
+        return pickle.load(f)
+
+
+def save_history(key, records):
+    """
+    Merges the best configurations of a search into its history
+    """
+    if not SEARCH_CACHE_DIR.exists():
+        os.makedirs(path_to_string(SEARCH_CACHE_DIR))
+    history = []
+    seen = set()
+    for record in sorted(records + load_history(key),
+                         key=lambda r: (-r["n_samples"], -r["score"])):
+        params = repr(sorted(record["params"].items()))
+        if params not in seen:
+            seen.add(params)
+            history.append(record)
+    path = history_path(key)
+    tmp_path = str(path) + ".tmp-{}".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        pickle.dump(history[:MAX_HISTORY], f)
+    os.replace(tmp_path, str(path))
+
+
+def clear():
+    """
+    Removes all search histories
+    :return: number of removed histories
+    """
+    if not SEARCH_CACHE_DIR.exists():
+        return 0
+    removed = 0
+    for path in SEARCH_CACHE_DIR.iterdir():
+        path.unlink()
+        removed += 1
+    return removed
+
+
+def scale_budget(params, names, fraction):
+    """
+    Scales the budget parameters of a configuration, e.g. the number of
+    estimators, to the fraction of rows of the current round
+    """
+    scaled = dict(params)
+    for name in names:
+        if name in scaled:
+            scaled[name] = max(1, int(round(scaled[name] * fraction)))
+    return scaled
+
+
+def evaluate(estimator, params, X, y, cv):
+    model = clone(estimator).set_params(**params)
+    scores = cross_val_score(model, X, y, cv=KFold(cv))
+    return np.mean(scores), np.std(scores)
+
+
+def early_stopping(estimator, name, X, y, rounds=EARLY_STOPPING_ROUNDS):
+    """
+    Fits the XGBoost step of an ensemble alone with the last rows as
+    validation fold and stops adding trees once the validation error does
+    not improve for rounds rounds.
+    :param estimator: ensemble with the best parameters set
+    :param name: name of the XGBoost step
+    :return: number of trees to use
+    """
+    model = clone(estimator.get_params()[name])
+    split = int(len(X) * (1 - VALIDATION_SIZE))
+    kwargs = {}
+    # xgboost >= 1.6 takes the rounds as parameter, 2.0 removed the fit
+    # argument
+    if "early_stopping_rounds" in model.get_params():
+        model.set_params(early_stopping_rounds=rounds)
+    else:
+        kwargs["early_stopping_rounds"] = rounds
+    model.fit(X[:split], y[:split], eval_set=[(X[split:], y[split:])],
+              verbose=False, **kwargs)
+    return min(model.best_iteration + 1, model.get_params()["n_estimators"])
+
+
+class HalvingSearch:
+    """
+    Successive halving over the number of training rows. All candidates are
+    cross validated on few rows and with few estimators, only the best
+    1/factor of them advance to the next round with factor times more rows
+    and estimators. The last round compares the final factor candidates on
+    all rows and the best of them is refit. Has the attributes of
+    RandomizedSearchCV which do_regression uses.
+    """
+
+    def __init__(self, estimator, param_distributions,
+                 n_candidates=N_CANDIDATES, factor=FACTOR, cv=CV,
+                 min_samples=MIN_SAMPLES, n_jobs=1, random_state=None,
+                 history_key=None, early_stopping=None, budget_params=()):
+        """
+        :param estimator: estimator to search
+        :param param_distributions: like for RandomizedSearchCV
+        :param n_candidates: number of configurations in the first round
+        :param factor: fraction of candidates kept and growth of the rows
+        :param cv: folds of each evaluation
+        :param min_samples: fewest rows of the first round
+        :param n_jobs: candidates evaluated in parallel
+        :param random_state: seed of the parameter sampling
+        :param history_key: name of the search history to warm start from
+        and to save into, no history if None
+        :param early_stopping: name of an XGBoost step whose number of trees
+        is found by early stopping before the refit
+        :param budget_params: parameters like numbers of estimators which
+        grow with the rows of the round, the full value is used on all rows
+        """
+        self.estimator = estimator
+        self.param_distributions = param_distributions
+        self.n_candidates = n_candidates
+        self.factor = factor
+        self.cv = cv
+        self.min_samples = min_samples
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.history_key = history_key
+        self.early_stopping = early_stopping
+        self.budget_params = budget_params
+
+    def candidates(self):
+        keys = set(self.param_distributions)
+        warm = []
+        if self.history_key is not None:
+            warm = [r["params"] for r in load_history(self.history_key)
+                    if set(r["params"]) == keys][:WARM_START]
+        sampled = ParameterSampler(self.param_distributions,
+                                   self.n_candidates - len(warm),
+                                   random_state=self.random_state)
+        return warm + list(sampled), len(warm)
+
+    def fit(self, X, y):
+        start = time.perf_counter()
+        candidates, n_warm = self.candidates()
+        self.n_candidates_ = len(candidates)
+        # the last round starts with at most factor candidates
+        n_rounds = max(1, int(math.ceil(
+            math.log(len(candidates), self.factor) - 1e-9)))
+
+        self.n_fits_ = 0
+        results = []
+        for i in reversed(range(n_rounds)):
+            # the last round always uses all rows
+            n_samples = min(max(len(X) // self.factor ** i,
+                                self.min_samples), len(X))
+            fraction = n_samples / len(X)
+            scores = Parallel(n_jobs=self.n_jobs)(
+                delayed(evaluate)(self.estimator,
+                                  scale_budget(params, self.budget_params,
+                                               fraction),
+                                  X[:n_samples], y[:n_samples], self.cv)
+                for params in candidates)
+            self.n_fits_ += len(candidates) * self.cv
+            results.extend({"params": params, "score": mean, "std": std,
+                            "n_samples": n_samples}
+                           for params, (mean, std) in zip(candidates, scores))
+            if len(candidates) == 1 or n_samples == len(X):
+                break
+            keep = max(1, len(candidates) // self.factor)
+            best = np.argsort([-s[0] for s in scores], kind="mergesort")
+            candidates = [candidates[j] for j in best[:keep]]
+
+        last = [r for r in results if r["n_samples"] == n_samples]
+        winner = max(last, key=lambda r: r["score"])
+        self.best_params_ = dict(winner["params"])
+        self.best_score_ = winner["score"]
+        self.n_warm_ = n_warm
+
+        self.best_estimator_ = clone(self.estimator).set_params(
+            **self.best_params_)
+        if self.early_stopping is not None:
+            name = "{}__n_estimators".format(self.early_stopping)
+            self.best_params_[name] = early_stopping(self.best_estimator_,
+                                                     self.early_stopping,
+                                                     X, y)
+            self.best_estimator_.set_params(**{name: self.best_params_[
+                name]})
+        self.best_estimator_.fit(X, y)
+
+        ranked = sorted(results, key=lambda r: (-r["n_samples"], -r["score"]))
+        self.cv_results_ = {
+            "params": [r["params"] for r in ranked],
+            "n_samples": np.array([r["n_samples"] for r in ranked]),
+            "mean_test_score": np.array([r["score"] for r in ranked]),
+            "std_test_score": np.array([r["std"] for r in ranked]),
+            "rank_test_score": np.arange(1, len(ranked) + 1)}
+        if self.history_key is not None:
+            # the deepest round of each candidate is kept
+            save_history(self.history_key, ranked)
+        self.search_time_ = time.perf_counter() - start
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def score(self, X, y):
+        return self.best_estimator_.score(X, y)
@@ -0,0 +1,114 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+from sklearn.ensemble import AdaBoostRegressor, RandomForestRegressor
+from sklearn.feature_selection import RFE, mutual_info_regression
+from sklearn.tree import DecisionTreeRegressor
+
+DATA_DIR = Path("data/data")
+SELECTION_CACHE_DIR = DATA_DIR / "SELECTION_CACHE"
+
+SELECTORS = ["importance", "mutual_info", "rfe"]
+# selector used by do_regression, the RFE of the former code whose ranking
+# is cached per data snapshot, so forecasts stay the same
+SELECTION = "rfe"
+N_FEATURES = 5
+RFE_ESTIMATORS = 3000
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def rank_importance(X, y, n_jobs=1):
+    """
+    Ranks the features by the impurity importance of one fitted forest
+    :return: importance per feature, higher is better
+    """
+    forest = RandomForestRegressor(n_estimators=100, max_depth=8,
+                                   random_state=42, n_jobs=n_jobs)
+    forest.fit(X, y)
+    return forest.feature_importances_
+
+
+def rank_mutual_info(X, y):
+    """
+    Ranks the features by their estimated mutual information with the label
+    :return: mutual information per feature, higher is better
+    """
+    return mutual_info_regression(X, y, random_state=42)
+
+
+def rfe_key(X, y, n_features):
+    h = hashlib.sha1()
+    h.update("rfe|{}|{}|{}".format(n_features, RFE_ESTIMATORS,
+                                   X.shape).encode())
+    h.update(np.ascontiguousarray(X).tobytes())
+    h.update(np.ascontiguousarray(y).tobytes())
+    return h.hexdigest()
+
+
+def rank_rfe(X, y, n_features=N_FEATURES, use_cache=True):
+    """
+    Recursive feature elimination around the AdaBoost of the ensemble. The
+    ranking is cached on disk keyed by the content of X and y, so it is only
+    computed once per data snapshot.
+    :return: RFE ranking per feature negated, higher is better
+    """
+    path = SELECTION_CACHE_DIR / "{}.npy".format(rfe_key(X, y, n_features))
+    if use_cache and path.exists():
+        print("Loaded RFE ranking from cache")
+        return -np.load(str(path))
+
+    regr = AdaBoostRegressor(DecisionTreeRegressor(max_depth=4),
+                             n_estimators=RFE_ESTIMATORS)
+    selector = RFE(estimator=regr, n_features_to_select=n_features)
+    selector.fit(X, y)
+    if not SELECTION_CACHE_DIR.exists():
+        os.makedirs(path_to_string(SELECTION_CACHE_DIR))
+    tmp_path = str(path) + ".tmp-{}.npy".format(os.getpid())
+    np.save(tmp_path, selector.ranking_)
+    os.replace(tmp_path, str(path))
+    return -selector.ranking_
+
+
+def select_features(X, y, method=None, n_features=N_FEATURES, n_jobs=1):
+    """
+    Selects the columns used for the prediction
+    :param X: scaled features
+    :param y: labels
+    :param method: one of SELECTORS, SELECTION if None
+    :param n_features: number of features to keep
+    :param n_jobs: parallel jobs of the importance forest
+    :return: sorted list with the indices of the selected features
+    """
+    if method is None:
+        method = SELECTION
+    if method == "importance":
+        scores = rank_importance(X, y, n_jobs)
+    elif method == "mutual_info":
+        scores = rank_mutual_info(X, y)
+    elif method == "rfe":
+        scores = rank_rfe(X, y, n_features)
+    else:
+        raise ValueError("Unknown feature selection {}, use one of {}".format(
+            method, SELECTORS))
+    # stable sort keeps the column order between equal scores
+    best = np.argsort(-np.asarray(scores), kind="mergesort")[:n_features]
+    return sorted(int(i) for i in best)
+
+
+def clear():
+    """
+    Removes all cached RFE rankings
+    :return: number of removed rankings
+    """
+    if not SELECTION_CACHE_DIR.exists():
+        return 0
+    removed = 0
+    for path in SELECTION_CACHE_DIR.iterdir():
+        path.unlink()
+        removed += 1
+    return removed
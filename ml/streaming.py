@@ -0,0 +1,390 @@
+"""
+Out-of-core processing of the panel. The "Adj Close" panel is streamed from
+the columnar store by blocks of dates, every block is read with the row
+before it and the look ahead after it, so its returns and labels equal
+those of compute_panel over the whole panel. The features of
+ml.features are computed for every ticker from its own rows: each block
+with the SEGMENT aligned rows before it and the filter states carried
+over from the block before, so they equal those of compute_features over
+the whole history. Memory depends on the block size and the number of
+tickers, not on the length of the history.
+"""
+import argparse
+import os
+import pickle
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.df_loader as dl
+import data.utils.profiling as profiling
+import data.utils.store as store
+import data.utils.universe as uv
+from ml import features as ft
+from ml.labels import HM_DAYS, REQUIREMENT, label_matrix
+from ml.portfolio import daily_returns
+
+DATA_DIR = Path("data/data")
+STREAM_DIR = DATA_DIR / "STREAM_DIR"
+
+# dates per block
+BLOCK_SIZE = 5000
+# days the label of the features is shifted into the future
+FORECAST = 120
+# panel output -> dtype of its raw file, the features are FEATURE_DTYPE
+OUTPUTS = {"returns": np.float64, "labels": np.int8}
+FEATURES = "features"
+DATES_FILE = "Date.i8"
+META_FILE = "meta.pkl"
+# rows scanned at once for the next valid price
+SCAN_ROWS = 4096
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def compute_panel(values, hm_days=HM_DAYS, requirement=REQUIREMENT):
+    """
+    Returns and buy/sell/hold labels of all tickers like get_cls_data:
+    missing prices count as 0
+    :param values: "Adj Close" array (days x tickers)
+    :return: dict output -> array (days x tickers)
+    """
+    prices = np.where(np.isnan(values), 0, values)
+    return {"returns": daily_returns(prices),
+            "labels": label_matrix(prices, hm_days, requirement)}
+
+
+def align_features(frames, dates, tickers):
+    """
+    Puts the feature frames of compute_features on the dates of the panel
+    :param frames: dict ticker -> DataFrame with features
+    :param dates: sorted dates of the panel
+    :return: array (dates x tickers x features), NaN where a ticker has no
+    row
+    """
+    columns = ft.feature_columns()
+    out = np.full((len(dates), len(tickers), len(columns)), np.nan,
+                  dtype=ft.FEATURE_DTYPE)
+    for j, ticker in enumerate(tickers):
+        df = frames[ticker]
+        rows = np.searchsorted(dates, df.index.values)
+        out[rows, j] = df[columns].values
+    return out
+
+
+def available_tickers(tickers):
+    """
+    Tickers with data in the columnar store, tickers which only have a .csv
+    are migrated like get_com_as_df does
+    """
+    available = []
+    for ticker in tickers:
+        ticker = ticker.rstrip()
+        if not store.has_com(ticker):
+            try:
+                store.write_com(store.read_csv(ticker), ticker)
+            except IOError:
+                print("No data found for {}".format(ticker))
+                continue
+        available.append(ticker)
+    return available
+
+
+def load_index(ticker):
+    return np.load(str(store.com_dir(ticker) / store.INDEX_FILE),
+                   mmap_mode="r")
+
+
+def load_column(ticker, column):
+    return np.load(str(store.com_dir(ticker) / store.column_file(column)),
+                   mmap_mode="r")
+
+
+def last_valid(values, end):
+    """
+    :return: position of the last finite value before end, -1 if none
+    """
+    while end > 0:
+        start = max(end - SCAN_ROWS, 0)
+        found = np.flatnonzero(np.isfinite(values[start:end]))
+        if len(found):
+            return start + int(found[-1])
+        end = start
+    return -1
+
+
+def next_valid(values, start):
+    """
+    :return: position of the first finite value from start on, len(values)
+    if none
+    """
+    while start < len(values):
+        found = np.flatnonzero(np.isfinite(values[start:start + SCAN_ROWS]))
+        if len(found):
+            return start + int(found[0])
+        start += SCAN_ROWS
+    return len(values)
+
+
+class FeatureStream:
+    """
+    Computes the features of one ticker block by block from the columnar
+    store. The indicators of a block are computed from the rows of the
+    block and the rows back to a multiple of SEGMENT at least SEGMENT rows
+    before it, the recursive ones continue from the filter states kept
+    from the block before. Missing labels are interpolated from the rows
+    up to the valid labels around them.
+    """
+
+    def __init__(self, ticker, forecast_out=FORECAST):
+        self.ticker = ticker
+        self.forecast_out = forecast_out
+        self.columns = ft.feature_columns()
+        # next row, first row of the next window and filter states there
+        self.row = 0
+        self.start = 0
+        self.state = {}
+
+    def next_block(self, last_date):
+        """
+        Features of the rows up to last_date
+        :return: dates of the rows, array (rows x features)
+        """
+        index = load_index(self.ticker)
+        lo = self.row
+        hi = int(np.searchsorted(index, last_date, side="right"))
+        dates = np.array(index[lo:hi])
+        self.row = hi
+        if hi == lo:
+            return dates, np.empty((0, len(self.columns)), ft.FEATURE_DTYPE)
+
+        values = np.empty((hi - self.start, len(ft.FIELDS)))
+        for k, field in enumerate(ft.FIELDS):
+            values[:, k] = load_column(self.ticker, field)[self.start:hi]
+        next_start = max((hi // ft.SEGMENT - 1) * ft.SEGMENT, 0)
+        ctx = ft.FeatureContext(values[np.newaxis], ft.FIELDS,
+                                [len(values)], self.forecast_out, self.state,
+                                next_start - self.start)
+        out = np.empty((hi - lo, len(self.columns)), dtype=ft.FEATURE_DTYPE)
+        for k, column in enumerate(self.columns):
+            if column == "label":
+                out[:, k] = self.labels(lo, hi)
+            else:
+                out[:, k] = ctx[column][0, lo - self.start:]
+        out[np.isinf(out)] = np.nan
+        self.start, self.state = next_start, ctx.next_state
+        return dates, out
+
+    def labels(self, lo, hi):
+        """
+        Labels of the rows lo to hi - 1 like the label feature, computed
+        from the rows between the valid labels before and after them
+        """
+        prices = load_column(self.ticker, "Adj Close")
+        f = self.forecast_out
+        # the label of a row is valid where the price f rows later is
+        before = last_valid(prices[f:], lo)
+        first = lo if before < 0 else before
+        after = next_valid(prices, hi + f)
+        last = after - f + 1 if after < len(prices) else hi
+        label = np.full(last - first, np.nan)
+        shifted = np.array(prices[first + f:last + f], dtype=np.float64)
+        label[:len(shifted)] = shifted
+        label = ft.interpolate(np.round(label, 3)[np.newaxis],
+                               [last - first], limit=ft.LABEL_LIMIT)
+        return label[0, lo - first:hi - first]
+
+
+def iter_dates(tickers, block_size):
+    """
+    Yields the union of the Date indexes in blocks without building it. The
+    next block_size dates of the union are among the next block_size dates
+    of every index. The memory maps are opened for every block, keeping
+    thousands of them open would use up the file descriptors.
+    :param tickers: list with ticker symbols in the store
+    :return: generator of datetime64 arrays with block_size dates, the last
+    one shorter
+    """
+    cursors = [0] * len(tickers)
+    while True:
+        heads = [load_index(t)[c:c + block_size]
+                 for t, c in zip(tickers, cursors)]
+        heads = [h for h in heads if len(h)]
+        if not heads:
+            return
+        block = np.unique(np.concatenate(heads))[:block_size]
+        yield block
+        cursors = [int(np.searchsorted(load_index(t), block[-1],
+                                       side="right")) for t in tickers]
+
+
+def read_block(tickers, dates, column="Adj Close", dtype=None):
+    """
+    Panel of the given dates, only the rows of the memory mapped columns
+    between the first and the last date are read
+    :param dates: sorted dates, all dates of the tickers in their range
+    :return: array (dates x tickers)
+    """
+    if dtype is None:
+        dtype = dl.PANEL_DTYPE
+    values = np.full((len(dates), len(tickers)), np.nan, dtype=dtype)
+    for j, ticker in enumerate(tickers):
+        index = load_index(ticker)
+        lo = int(np.searchsorted(index, dates[0], side="left"))
+        hi = int(np.searchsorted(index, dates[-1], side="right"))
+        if lo == hi:
+            continue
+        column_values = np.load(str(store.com_dir(ticker) /
+                                    store.column_file(column)),
+                                mmap_mode="r")[lo:hi]
+        rows = np.searchsorted(dates, index[lo:hi])
+        values[rows, j] = column_values.astype(dtype)
+    return values
+
+
+def iter_blocks(tickers, block_size=BLOCK_SIZE, back=1,
+                ahead=HM_DAYS, column="Adj Close", dtype=None):
+    """
+    Streams the panel of the tickers by blocks of dates. Every block
+    carries the back dates before and the ahead dates after it.
+    :param tickers: list with ticker symbols in the store
+    :param block_size: dates per block, at least back and ahead
+    :return: generator of (dates of the block, array (back + block + ahead
+    dates x tickers), first row of the block in the array)
+    """
+    if block_size < max(back, ahead, 1):
+        raise ValueError("block_size {} is smaller than the overlap".format(
+            block_size))
+    previous = np.array([], dtype="datetime64[ns]")
+    blocks = iter_dates(tickers, block_size)
+    current = next(blocks, None)
+    while current is not None:
+        following = next(blocks, None)
+        before = previous[max(len(previous) - back, 0):]
+        after = following[:ahead] if following is not None else current[:0]
+        dates = np.concatenate([before, current, after])
+        yield current, read_block(tickers, dates, column, dtype), len(before)
+        previous, current = current, following
+
+
+def stream_dir(name):
+    return STREAM_DIR / name
+
+
+def write_stream(name, tickers=None, block_size=BLOCK_SIZE, hm_days=HM_DAYS,
+                 requirement=REQUIREMENT, forecast_out=FORECAST, dtype=None):
+    """
+    Computes returns, labels and features block by block and appends each
+    block to raw files. The files are written to a temporary directory
+    which replaces the old one at the end.
+
+    :param name: name of the output directory in STREAM_DIR
+    :param tickers: list with ticker symbols, all DAX companies if None
+    :param block_size: dates per block
+    :param forecast_out: days the label of the features is shifted
+    :return: number of rows written
+    """
+    if tickers is None:
+        tickers = uv.load_universe().tickers()
+    tickers = available_tickers(tickers)
+    path = stream_dir(name)
+    tmp_path = STREAM_DIR / "{}.tmp-{}".format(name, os.getpid())
+    if tmp_path.exists():
+        shutil.rmtree(str(tmp_path))
+    os.makedirs(str(tmp_path))
+
+    streams = [FeatureStream(ticker, forecast_out) for ticker in tickers]
+    columns = ft.feature_columns()
+    files = {output: open(str(tmp_path / "{}.raw".format(output)), "wb")
+             for output in list(OUTPUTS) + [FEATURES]}
+    files["Date"] = open(str(tmp_path / DATES_FILE), "wb")
+    rows = 0
+    try:
+        for dates, values, first in iter_blocks(tickers, block_size, 1,
+                                                hm_days, dtype=dtype):
+            results = compute_panel(values, hm_days, requirement)
+            for output, dtype_out in OUTPUTS.items():
+                block = results[output][first:first + len(dates)]
+                files[output].write(np.ascontiguousarray(
+                    block, dtype=dtype_out).tobytes())
+            block = np.full((len(dates), len(tickers), len(columns)), np.nan,
+                            dtype=ft.FEATURE_DTYPE)
+            for j, stream in enumerate(streams):
+                ticker_dates, ticker_values = stream.next_block(dates[-1])
+                block[np.searchsorted(dates, ticker_dates), j] = ticker_values
+            files[FEATURES].write(block.tobytes())
+            files["Date"].write(dates.astype("datetime64[ns]")
+                                .astype(np.int64).tobytes())
+            rows += len(dates)
+    finally:
+        for f in files.values():
+            f.close()
+
+    with open(str(tmp_path / META_FILE), "wb") as f:
+        pickle.dump({"tickers": tickers, "rows": rows, "hm_days": hm_days,
+                     "requirement": requirement,
+                     "forecast_out": forecast_out, "columns": columns,
+                     "block_size": block_size}, f)
+    old_path = STREAM_DIR / "{}.old-{}".format(name, os.getpid())
+    if path.exists():
+        os.rename(str(path), str(old_path))
+    os.rename(str(tmp_path), str(path))
+    if old_path.exists():
+        shutil.rmtree(str(old_path))
+    return rows
+
+
+def load_stream(name):
+    """
+    Memory maps the outputs of write_stream
+    :return: DatetimeIndex, dict output -> read-only array (dates x
+    tickers), "features" (dates x tickers x features), metadata
+    """
+    path = stream_dir(name)
+    if not (path / META_FILE).exists():
+        raise IOError("No stream {}, run write_stream first".format(name))
+    with open(str(path / META_FILE), "rb") as f:
+        meta = pickle.load(f)
+    shape = (meta["rows"], len(meta["tickers"]))
+    dates = pd.DatetimeIndex(np.fromfile(str(path / DATES_FILE),
+                                         dtype=np.int64).view("datetime64[ns]"),
+                             name="Date")
+    outputs = {}
+    dtypes = dict(OUTPUTS, **{FEATURES: ft.FEATURE_DTYPE})
+    for output, dtype in dtypes.items():
+        output_shape = shape
+        if output == FEATURES:
+            output_shape = shape + (len(meta["columns"]),)
+        if meta["rows"] == 0:
+            outputs[output] = np.empty(output_shape, dtype=dtype)
+            continue
+        outputs[output] = np.memmap(str(path / "{}.raw".format(output)),
+                                    dtype=dtype, mode="r", shape=output_shape)
+    return dates, outputs, meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streams the panel by "
+                                                 "blocks of dates")
+    parser.add_argument("--universe", default=uv.DEFAULT_UNIVERSE)
+    parser.add_argument("--name", help="output name, the universe if not "
+                                       "given")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    args = parser.parse_args()
+    profiling.from_env()
+
+    start = time.perf_counter()
+    name = args.name or args.universe
+    rows = write_stream(name, uv.load_universe(args.universe).tickers(),
+                        args.block_size)
+    print("Wrote {} rows to {} in {:.1f}s".format(
+        rows, path_to_string(stream_dir(name)), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,9 @@ from mpl_finance import candlestick_ohlc
 from pandas.plotting import register_matplotlib_converters
 
 import data.utils.df_loader as dl
+import data.utils.intraday as intraday
+import data.utils.profiling as profiling
+from ml import correlation as corr
 
 register_matplotlib_converters()
 
@@ -18,6 +21,8 @@ DATA_DIR = Path("data/data")
 COM_DATA_DIR = DATA_DIR / "DAX30"
 
 PLOT_DIR = Path("plots")
+# resolution of the interactive plots
+DPI = 300
 
 YEARS = mdates.YearLocator()  # every year
 MONTHS = mdates.MonthLocator()  # every month
@@ -32,126 +37,152 @@ def path_to_string(path):
 
 
 def set_as_index(df, value="Date"):
-    df.reset_index(inplace=True)
-    df.set_index(value, inplace=True)
-    return df
+    return df.reset_index().set_index(value)
 
 
-def plot_100avg(ticker, name):
-    df = dl.get_com_as_df(ticker)
-    df.index = pd.to_datetime(df.index)
-    df["100ma"] = df["Adj Close"].rolling(window=100, min_periods=0).mean()
+def chart_path(ticker, suffix, resolution=None):
+    if resolution is not None:
+        suffix = "{}_{}".format(suffix, resolution)
+    return "{}/{}_{}.png".format(path_to_string(PLOT_DIR), ticker[:-3], suffix)
+
 
+def format_dates(ax, dates=None):
+    """
+    Yearly ticks, automatic ticks for less than two years of intraday bars
+    """
+    if dates is not None and len(dates) and \
+            dates[-1] - dates[0] < pd.Timedelta(days=730):
+        locator = mdates.AutoDateLocator()
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(mdates.AutoDateFormatter(locator))
+    else:
+        ax.xaxis.set_major_locator(YEARS)
+        ax.xaxis.set_major_formatter(YEARS_FMT)
+        ax.xaxis.set_minor_locator(MONTHS)
+    ax.format_xdata = mdates.DateFormatter("%Y-%m-%d %H:%M")
+    ax.format_ydata = lambda x: "$%1.2f" % x  # format the price.
+    ax.grid(True)
+
+
+def draw_100avg(fig, df, ticker, name):
     """
         Creates Plot with 2 subfigures:
             - a: > 100 day avg[rolling Window]
                  > Adj Close
             - b: > Volume
+        :param fig: figure to draw on
+        :param df: dataframe with Adj Close and Volume
     """
-    ax1 = plt.subplot2grid((8, 1), (0, 0), colspan=1, rowspan=5)
-    ax2 = plt.subplot2grid((8, 1), (5, 0), colspan=1, rowspan=3, sharex=ax1)
+    df = df[["Adj Close", "Volume"]].copy()
+    df.index = pd.to_datetime(df.index)
+    df["100ma"] = df["Adj Close"].rolling(window=100, min_periods=0).mean()
+
+    grid = fig.add_gridspec(8, 1)
+    ax1 = fig.add_subplot(grid[0:5, 0])
+    ax2 = fig.add_subplot(grid[5:8, 0], sharex=ax1)
 
     ax1.plot(df.index, df["Adj Close"], label=ticker)
-    ax1.plot(df.index, df["100ma"], label="100d mvg avg")
+    ax1.plot(df.index, df["100ma"], label="100 bar mvg avg")
     ax1.set_ylabel("Adj Close")
     ax1.set_title("{}".format(name))
-    ax1.xaxis.set_major_locator(YEARS)
-    ax1.xaxis.set_major_formatter(YEARS_FMT)
-    ax1.xaxis.set_minor_locator(MONTHS)
-    ax1.format_xdata = mdates.DateFormatter("%Y-%m-%d")
-    ax1.format_ydata = lambda x: "$%1.2f" % x  # format the price.
-    ax1.grid(True)
+    format_dates(ax1, df.index)
+    ax1.legend()
 
-    ax2.bar(df.index, df["Volume"])
+    # one line per day, thousands of bar patches take seconds to draw
+    ax2.vlines(df.index, 0, df["Volume"], color="C0")
     ax2.set_ylabel("Volume")
     ax2.set_xlabel("Date")
     ax2.axis("auto")
 
-    path = "{}/{}_100avg.png".format(path_to_string(PLOT_DIR), ticker[:-3])
-    plt.savefig(path, dpi=300)
-    ax1.legend()
-    plt.show()
 
-
-def plot_exp_return(ticker, name):
-    df = dl.get_com_as_df(ticker)
-    df.index = pd.to_datetime(df.index)
+def draw_exp_return(fig, df, ticker, name):
+    """
+    Draws the daily returns
+    :param fig: figure to draw on
+    :param df: dataframe with Adj Close
+    """
+    dates = pd.to_datetime(df.index)
     returns = (df["Adj Close"] / df["Adj Close"].shift(1)) - 1
-    fig1, ax1 = plt.subplots()
-    ax1.plot(df.index, returns, label="return")
-    ax1.xaxis.set_major_locator(YEARS)
-    ax1.xaxis.set_major_formatter(YEARS_FMT)
-    ax1.xaxis.set_minor_locator(MONTHS)
-
+    ax1 = fig.add_subplot(1, 1, 1)
+    ax1.plot(dates, returns.values, label="return")
     ax1.set_ylabel("Expected return")
     ax1.set_title("{}".format(name))
     ax1.legend()
-
-    # format the coords message box
-    ax1.format_xdata = mdates.DateFormatter("%Y-%m-%d")
-    ax1.format_ydata = lambda x: "$%1.2f" % x  # format the price.
-    ax1.grid(True)
-
-    path = "{}/{}_exp_return.png".format(path_to_string(PLOT_DIR), ticker[:-3])
-    plt.savefig(path, dpi=300)
-
-    fig1.autofmt_xdate()
-    plt.show()
+    format_dates(ax1, dates)
+    fig.autofmt_xdate()
 
 
-def plot_ohlc(ticker, name):
-    df = dl.get_com_as_df(ticker)
-    df = set_as_index(df)
+def draw_ohlc(fig, df, ticker, name, rule="10D"):
+    """
+    Draws candles of the Adj Close with the volume below
+    :param fig: figure to draw on
+    :param df: dataframe with Adj Close and Volume
+    :param rule: resolution of the candles
+    """
+    df = set_as_index(df[["Adj Close", "Volume"]])
     df.index = pd.to_datetime(df.index)
-    df_ohlc = df["Adj Close"].resample("10D").ohlc()
-    df_volume = df["Volume"].resample("10D").sum()
-    df_ohlc.reset_index(inplace=True)
-    df_ohlc["Date"] = df_ohlc["Date"].map(mdates.date2num)
+    bars = intraday.resample(df, rule, price="Adj Close")
+    dates = bars.index.map(mdates.date2num)
+    width = 0.2 * pd.to_timedelta(rule) / pd.Timedelta(days=1)
 
-    ax1 = plt.subplot2grid((6, 1), (0, 0), rowspan=5, colspan=1)
-    ax2 = plt.subplot2grid((6, 1), (5, 0), rowspan=1, colspan=1, sharex=ax1)
+    grid = fig.add_gridspec(6, 1)
+    ax1 = fig.add_subplot(grid[0:5, 0])
+    ax2 = fig.add_subplot(grid[5:6, 0], sharex=ax1)
     ax1.xaxis_date()
     ax1.set_title("{}".format(name))
-    candlestick_ohlc(ax1, df_ohlc.values, width=2, colorup="g")
-    ax2.fill_between(df_volume.index.map(mdates.date2num), df_volume.values, 0)
-    path = "{}/{}_OHLC.png".format(path_to_string(PLOT_DIR), ticker[:-3])
-    plt.savefig(path, dpi=300)
-    plt.show()
-
+    candlestick_ohlc(ax1, np.column_stack(
+        [dates, bars[["Open", "High", "Low", "Close"]].values]),
+        width=width, colorup="g")
+    ax2.fill_between(dates, bars["Volume"].values, 0)
 
-def plot_dax():
-    """ Plots correlation table of all DAX companies"""
-    df = dl.get_dax__as_df()
-    columns_to_drop = df.columns[:2]
-    df = df.drop(columns_to_drop, axis=1)
-    df.columns = df.columns.values
-
-    df_corr = df.corr()
 
+def draw_corr(fig, df_corr, title=None):
+    """
+    Draws a correlation matrix as heatmap
+    :param fig: figure to draw on
+    :param df_corr: square dataframe with correlations
+    :param title: title above the heatmap
+    """
     data1 = df_corr.values
-
-    fig1, ax1 = plt.subplots()
-    heatmap1 = ax1.pcolor(data1, cmap=plt.cm.RdYlGn)
-    fig1.colorbar(heatmap1)
-    ax1.set_xticks(np.arange(data1.shape[1]) + 0.5, minor=False)
-    ax1.set_yticks(np.arange(data1.shape[0]) + 0.5, minor=False)
-    ax1.invert_yaxis()
+    ax1 = fig.add_subplot(1, 1, 1)
+    heatmap1 = ax1.imshow(data1, cmap=plt.cm.RdYlGn, vmin=-1, vmax=1,
+                          interpolation="nearest", aspect="auto")
+    fig.colorbar(heatmap1)
+    ax1.set_xticks(np.arange(data1.shape[1]), minor=False)
+    ax1.set_yticks(np.arange(data1.shape[0]), minor=False)
     ax1.xaxis.tick_top()
-    column_labels = df_corr.columns
-    row_labels = df_corr.index
-    ax1.set_xticklabels(column_labels)
-    ax1.set_yticklabels(row_labels)
+    ax1.set_xticklabels(df_corr.columns, rotation=90)
+    ax1.set_yticklabels(df_corr.index)
     ax1.tick_params(axis="both", which="major", pad=10, colors="black")
-    plt.xticks(rotation=90)
-    heatmap1.set_clim(-1, 1)
-    plt.tight_layout()
-    path = "{}/DAX30_cor.png".format(path_to_string(PLOT_DIR))
-    plt.savefig(path, dpi=300)
-    plt.show()
+    ax1.grid(False)
+    if title is not None:
+        ax1.set_xlabel(title)
+    fig.tight_layout()
 
 
-def plot_forecast(df, ticker, name):
-    fig, ax1 = plt.subplots()
+def draw_corr_series(fig, series_list):
+    """
+    Draws rolling correlations of a ticker pair over time
+    :param fig: figure to draw on
+    :param series_list: list with (label, series indexed by date)
+    """
+    ax1 = fig.add_subplot(1, 1, 1)
+    for label, series in series_list:
+        ax1.plot(series.index, series.values, label=label)
+    ax1.set_ylim(-1, 1)
+    ax1.set_ylabel("Correlation")
+    ax1.set_title(series_list[0][1].name)
+    ax1.legend()
+    format_dates(ax1)
+
+
+def draw_forecast(fig, df, ticker, name):
+    """
+    Draws the forecast next to the EOD prices
+    :param fig: figure to draw on
+    :param df: dataframe with EOD and Forecast
+    """
+    ax1 = fig.add_subplot(1, 1, 1)
     dates = pd.to_datetime(df.index)
     ax1.plot(dates, df["EOD"], label="Adj Close")
     ax1.plot(dates, df["Forecast"], label="Forecast")
@@ -166,6 +197,97 @@ def plot_forecast(df, ticker, name):
     ax1.format_ydata = lambda x: "$%1.2f" % x  # format the price.
     ax1.grid(True)
     fig.autofmt_xdate()
-    path = "{}/{}_forecast.png".format(path_to_string(PLOT_DIR), ticker[:-3])
-    plt.savefig(path, dpi=300)
+
+
+def show(fig, path):
+    with profiling.stage("savefig", estimator="dpi={}".format(DPI)):
+        fig.savefig(path, dpi=DPI)
+    plt.show()
+    plt.close(fig)
+
+
+@profiling.profiled("plot_100avg")
+def plot_100avg(ticker, name, resolution=None):
+    fig = plt.figure()
+    draw_100avg(fig, dl.get_bars_as_df(ticker, resolution,
+                                       ["Adj Close", "Volume"]),
+                ticker, name)
+    show(fig, chart_path(ticker, "100avg", resolution))
+
+
+@profiling.profiled("plot_exp_return")
+def plot_exp_return(ticker, name, resolution=None):
+    fig = plt.figure()
+    draw_exp_return(fig, dl.get_bars_as_df(ticker, resolution,
+                                           ["Adj Close"]),
+                    ticker, name)
+    show(fig, chart_path(ticker, "exp_return", resolution))
+
+
+@profiling.profiled("plot_ohlc")
+def plot_ohlc(ticker, name, resolution=None, rule="10D"):
+    """
+    Plots candles of rule resampled from daily bars or from intraday bars
+    of a resolution
+    """
+    fig = plt.figure()
+    draw_ohlc(fig, dl.get_bars_as_df(ticker, resolution,
+                                     ["Adj Close", "Volume"]),
+              ticker, name, rule)
+    show(fig, chart_path(ticker, "OHLC", resolution))
+
+
+def dax_corr():
+    df = dl.get_dax__as_df()
+    df = df.drop(["index"], axis=1, errors="ignore")
+    return pd.DataFrame(corr.full_corr(corr.panel_values(df)),
+                        index=df.columns.values, columns=df.columns.values)
+
+
+@profiling.profiled("plot_dax")
+def plot_dax():
+    """ Plots correlation table of all DAX companies"""
+    fig = plt.figure()
+    draw_corr(fig, dax_corr())
+    show(fig, "{}/DAX30_cor.png".format(path_to_string(PLOT_DIR)))
+
+
+def plot_dax_rolling(window=250, date=None, kind="prices"):
+    """
+    Plots the rolling correlation table of one day from the stored cube
+    :param window: days per window
+    :param date: day, the last day if None
+    """
+    corr.update_cube(window, kind)
+    df_corr = corr.corr_at(window, date, kind)
+    fig = plt.figure()
+    draw_corr(fig, df_corr, "{} day correlation of {}".format(
+        window, "the last day" if date is None else date))
+    show(fig, "{}/DAX30_cor_{}.png".format(path_to_string(PLOT_DIR), window))
+
+
+def plot_corr_pair(a, b, windows=None, kind="prices"):
+    """
+    Plots the rolling correlations of two tickers from the stored cubes
+    :param a: ticker symbol
+    :param b: ticker symbol
+    :param windows: list with days per window, corr.WINDOWS if None
+    """
+    series_list = []
+    for window in windows or corr.WINDOWS:
+        corr.update_cube(window, kind)
+        series_list.append(("{} days".format(window),
+                            corr.pair_series(window, a, b, kind)))
+    fig = plt.figure()
+    draw_corr_series(fig, series_list)
+    show(fig, "{}/{}_{}_cor.png".format(path_to_string(PLOT_DIR), a[:-3],
+                                        b[:-3]))
+
+
+@profiling.profiled("plot_forecast")
+def plot_forecast(df, ticker, name):
+    fig = plt.figure()
+    draw_forecast(fig, df, ticker, name)
+    with profiling.stage("savefig", ticker, "dpi={}".format(DPI)):
+        fig.savefig(chart_path(ticker, "forecast"), dpi=DPI)
     fig.show()
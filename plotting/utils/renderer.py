@@ -0,0 +1,208 @@
+"""
+Headless batch rendering of the plotter charts. Figures are created without
+pyplot and drawn with the Agg canvas, every ticker is rendered in a worker
+process from one load of its data. Charts whose data did not change since
+the last rendering are skipped. The charts are written to RENDER_DIR, so
+the charts of the interactive plots in PLOT_DIR are not overwritten.
+
+Render all charts of all DAX30 companies:
+    python3 -m plotting.utils.renderer
+"""
+import argparse
+import hashlib
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import data.utils.df_loader as dl
+import data.utils.profiling as profiling
+import data.utils.web_scrappers as ws
+from ml import correlation as corr
+from ml.feature_cache import data_hash
+from plotting.utils import plotter
+
+# resolution of the batch rendered charts
+DPI = 100
+# bump whenever a draw function changes its output
+RENDER_VERSION = 3
+RENDER_DIR = plotter.PLOT_DIR / "rendered"
+HASH_DIR = RENDER_DIR / ".hashes"
+
+# chart -> draw function, columns of the ticker data
+CHARTS = {"100avg": (plotter.draw_100avg, ["Adj Close", "Volume"]),
+          "exp_return": (plotter.draw_exp_return, ["Adj Close"]),
+          "OHLC": (plotter.draw_ohlc, ["Adj Close", "Volume"])}
+COLUMNS = ["Adj Close", "Volume"]
+
+
+def chart_path(name, chart):
+    return "{}/{}_{}.png".format(plotter.path_to_string(RENDER_DIR), name,
+                                 chart)
+
+
+def hash_path(key):
+    return HASH_DIR / "{}.pkl".format(key)
+
+
+def load_hashes(key):
+    path = hash_path(key)
+    if not path.exists():
+        return {}
+    with open(str(path), "rb") as f:
+        return pickle.load(f)
+
+
+def save_hashes(key, hashes):
+    if not HASH_DIR.exists():
+        os.makedirs(plotter.path_to_string(HASH_DIR))
+    path = hash_path(key)
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(hashes, f)
+    os.replace(tmp_path, str(path))
+
+
+def chart_hash(source, chart, dpi):
+    raw = "{}|{}|{}|{}".format(source, chart, dpi, RENDER_VERSION)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def save_figure(draw, path, dpi, *args):
+    """
+    Draws on a new figure which is not known to pyplot and saves it
+    """
+    with profiling.stage(draw.__name__):
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        draw(fig, *args)
+    with profiling.stage("savefig", estimator="dpi={}".format(dpi)):
+        fig.savefig(path, dpi=dpi)
+
+
+@profiling.profiled("render")
+def render_ticker(ticker, name, charts=None, dpi=DPI, force=False):
+    """
+    Renders the charts of one ticker from one load of its data
+    :param ticker: ticker symbol
+    :param name: company name
+    :param charts: list with chart names, all CHARTS if None
+    :param dpi: resolution
+    :param force: render unchanged charts too
+    :return: ticker, rendered charts, skipped charts, seconds
+    """
+    start = time.perf_counter()
+    df = dl.get_com_as_df(ticker, columns=COLUMNS)
+    source = data_hash(df)
+    hashes = load_hashes(ticker)
+    rendered, skipped = [], []
+    for chart in charts or list(CHARTS):
+        draw, columns = CHARTS[chart]
+        path = chart_path(ticker[:-3], chart)
+        digest = chart_hash(source, chart, dpi)
+        if not force and hashes.get(chart) == digest and os.path.exists(path):
+            skipped.append(chart)
+            continue
+        save_figure(draw, path, dpi, df[columns], ticker, name)
+        hashes[chart] = digest
+        rendered.append(chart)
+    save_hashes(ticker, hashes)
+    return ticker, rendered, skipped, time.perf_counter() - start
+
+
+@profiling.profiled("render", "DAX30")
+def render_dax(dpi=DPI, force=False):
+    """
+    Renders the correlation table of all DAX companies and the rolling
+    correlation tables of the last day from the correlation cubes
+    :return: "DAX30", rendered charts, skipped charts, seconds
+    """
+    start = time.perf_counter()
+    df = dl.get_dax__as_df()
+    source = data_hash(df)
+    hashes = load_hashes("DAX30")
+    rendered, skipped = [], []
+    for window in [None] + corr.WINDOWS:
+        chart = "cor" if window is None else "cor_{}".format(window)
+        path = chart_path("DAX30", chart)
+        digest = chart_hash(source, chart, dpi)
+        if not force and hashes.get(chart) == digest and os.path.exists(path):
+            skipped.append(chart)
+            continue
+        if window is None:
+            save_figure(plotter.draw_corr, path, dpi, plotter.dax_corr())
+        else:
+            corr.update_cube(window, df=df)
+            save_figure(plotter.draw_corr, path, dpi, corr.corr_at(window),
+                        "{} day correlation of the last day".format(window))
+        hashes[chart] = digest
+        rendered.append(chart)
+    save_hashes("DAX30", hashes)
+    return "DAX30", rendered, skipped, time.perf_counter() - start
+
+
+def render_all(tickers=None, charts=None, dpi=DPI, force=False, workers=None,
+               dax=True):
+    """
+    Renders the charts of all tickers on a process pool
+    :param tickers: list with ticker symbols, all DAX companies if None
+    :param charts: list with chart names, all CHARTS if None
+    :param dpi: resolution
+    :param force: render unchanged charts too
+    :param workers: number of processes, all cores if None
+    :param dax: render the DAX correlation table too
+    :return: list with (ticker, rendered, skipped, seconds)
+    """
+    if tickers is None:
+        tickers = list(ws.get_tickers())
+    names = [ws.ticker_to_name(ticker) for ticker in tickers]
+    if not RENDER_DIR.exists():
+        os.makedirs(plotter.path_to_string(RENDER_DIR))
+
+    start = time.perf_counter()
+    results = []
+    mode = profiling.settings()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(profiling.call, mode, render_ticker, ticker,
+                                   name, charts, dpi, force)
+                   for ticker, name in zip(tickers, names)]
+        if dax:
+            futures.append(executor.submit(profiling.call, mode, render_dax,
+                                           dpi, force))
+        for future in futures:
+            result = profiling.unwrap(future.result())
+            results.append(result)
+            print("{:<10}rendered {:<30} skipped {:<30}{:>6.2f}s".format(
+                result[0], ",".join(result[1]) or "-",
+                ",".join(result[2]) or "-", result[3]))
+
+    rendered = sum(len(r[1]) for r in results)
+    skipped = sum(len(r[2]) for r in results)
+    print("Rendered {} charts, skipped {} unchanged in {:.1f}s".format(
+        rendered, skipped, time.perf_counter() - start))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Renders the charts of all "
+                                                 "tickers without display")
+    parser.add_argument("tickers", nargs="*",
+                        help="ticker symbols, all DAX companies if none")
+    parser.add_argument("--charts", nargs="+", choices=list(CHARTS))
+    parser.add_argument("--dpi", type=int, default=DPI)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--force", action="store_true",
+                        help="render unchanged charts too")
+    parser.add_argument("--no-dax", action="store_true",
+                        help="skip the DAX correlation table")
+    args = parser.parse_args()
+    profiling.from_env()
+    render_all(args.tickers or None, args.charts, args.dpi, args.force,
+               args.workers, not args.no_dax)
+
+
+if __name__ == "__main__":
+    main()
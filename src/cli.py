@@ -0,0 +1,382 @@
+"""
+Non-interactive command line of the pipeline. Every subcommand imports the
+modules it needs when it runs, so quick commands like listing the tickers
+do not load pandas, sklearn, xgboost or matplotlib.
+
+    python3 -m src.cli tickers
+    python3 -m src.cli refresh all
+    python3 -m src.cli features ADS.DE BMW.DE --forecast 60
+    python3 -m src.cli train all --search halving
+    python3 -m src.cli forecast ADS.DE --output forecasts
+    python3 -m src.cli plot ADS.DE --charts OHLC 100avg
+    python3 -m src.cli backtest ADS.DE --kind cls
+    python3 -m src.cli serve all --port 8080
+    python3 -m src.cli run jobs.json
+    python3 -m src.cli --profile memory train ADS.DE
+
+A job spec runs several subcommands in one process, the loaded data and
+models are reused between the jobs:
+
+    {"defaults": {"forecast": 60},
+     "jobs": [{"command": "refresh", "tickers": ["all"]},
+              {"command": "forecast", "tickers": ["ADS.DE", "SAP.DE"]},
+              {"command": "plot", "tickers": ["ADS.DE"], "force": true}]}
+"""
+import argparse
+import csv
+import json
+import pickle
+import sys
+import time
+from pathlib import Path
+
+import data.utils.profiling as profiling
+
+DATA_DIR = Path("data/data")
+PKL_DIR = DATA_DIR / "PKL_DIR"
+UNIVERSE_DIR = DATA_DIR / "UNIVERSES"
+COM_NAMES_PKL = PKL_DIR / "DAX30.names.pkl"
+COM_TICKERS_PKL = PKL_DIR / "DAX30.tickers.pkl"
+
+DEFAULT_UNIVERSE = "DAX30"
+FORECAST = 120
+
+
+def path_to_string(path):
+    return "/".join(path.parts)
+
+
+def read_universe(name):
+    """
+    Tickers and names of a universe read without pandas
+    :return: list with (ticker, name)
+    """
+    path = UNIVERSE_DIR / "{}.csv".format(name)
+    if path.exists():
+        with open(str(path), newline="") as f:
+            return [(row["ticker"], row.get("name") or row["ticker"])
+                    for row in csv.DictReader(f)]
+    if name != DEFAULT_UNIVERSE:
+        raise IOError("No universe {} in {}".format(
+            name, path_to_string(UNIVERSE_DIR)))
+    with open(path_to_string(COM_TICKERS_PKL), "rb") as f:
+        tickers = pickle.load(f)
+    with open(path_to_string(COM_NAMES_PKL), "rb") as f:
+        names = pickle.load(f)
+    return list(zip(tickers, names))
+
+
+def resolve_tickers(args):
+    """
+    Expands "all" to the tickers of the universe
+    :return: list with ticker symbols
+    """
+    if not args.tickers or "all" in args.tickers:
+        return [ticker for ticker, _ in read_universe(args.universe)]
+    return [ticker.upper() for ticker in args.tickers]
+
+
+def cmd_tickers(args):
+    fmt = "{:<8}{:<10}{}"
+    print(fmt.format("", "TICKER", "COMPANY"))
+    for i, (ticker, name) in enumerate(read_universe(args.universe)):
+        print(fmt.format(i + 1, ticker, name))
+
+
+def cmd_refresh(args):
+    import data.utils.df_loader as dl
+    import data.utils.web_scrappers as ws
+    from ml.online import update_online_features
+
+    incremental = not args.full
+    if not args.tickers or "all" in args.tickers:
+        if args.universe == DEFAULT_UNIVERSE:
+            return dl.refresh_dax_data(incremental=incremental)
+        return ws.get_com_data(incremental=incremental,
+                               universe=args.universe)
+    for ticker in resolve_tickers(args):
+        dl.refresh_com_data(ticker, incremental=incremental)
+        update_online_features(ticker)
+
+
+def cmd_features(args):
+    from ml.preprocessing import get_reg_data
+
+    for ticker in resolve_tickers(args):
+        X, y, df, X_data, _ = get_reg_data(ticker, args.forecast,
+                                           resolution=args.resolution)
+        print("{:<10}X {}  y {}  forecast rows {}  {} - {}".format(
+            ticker, X.shape, y.shape, len(X_data), df.index[0],
+            df.index[-1]))
+
+
+def run_regression(args, retrain):
+    import data.utils.web_scrappers as ws
+    from ml import learn
+
+    results = {}
+    for ticker in resolve_tickers(args):
+        data, meta = learn.do_regression(
+            ticker, ws.ticker_to_name(ticker, args.universe), args.forecast,
+            retrain=retrain, plot=args.plot, selection=args.selection,
+            search=args.search)
+        results[ticker] = data
+        print("{:<10}version {:<4}R2 {:.3f}".format(ticker, meta["version"],
+                                                    meta["test_score"]))
+        if args.output:
+            output = Path(args.output)
+            if not output.exists():
+                output.mkdir(parents=True)
+            path = output / "{}_forecast_{}.csv".format(ticker, args.forecast)
+            data.to_csv(str(path))
+            print("Saved forecast to {}".format(path))
+    return results
+
+
+def cmd_train(args):
+    if args.workers is not None:
+        from ml.scheduler import train_all
+        return train_all(resolve_tickers(args), args.forecast, retrain=True,
+                         classify=args.classify, n_cores=args.workers,
+                         run_id=args.run_id, universe=args.universe)
+    results = run_regression(args, retrain=True)
+    if args.classify:
+        from ml import learn
+        from ml.preprocessing import has_cls_data
+        for ticker in results:
+            if has_cls_data(ticker):
+                learn.do_classification(ticker)
+            else:
+                print("No classification of {}, not in the DAX "
+                      "panel".format(ticker))
+    return results
+
+
+def cmd_forecast(args):
+    return run_regression(args, retrain=False)
+
+
+def cmd_plot(args):
+    from plotting.utils import renderer
+
+    tickers = [] if args.dax_only else resolve_tickers(args)
+    return renderer.render_all(tickers, args.charts, args.dpi, args.force,
+                               args.workers, dax=args.dax or args.dax_only)
+
+
+def cmd_backtest(args):
+    from ml import backtest
+
+    tickers = resolve_tickers(args)
+    results = backtest.backtest_all(tickers, n_jobs=args.jobs, kind=args.kind,
+                                    forecast=args.forecast,
+                                    min_train=args.min_train, step=args.step,
+                                    window=args.window,
+                                    warm_start=not args.cold)
+    for ticker in tickers:
+        backtest.print_backtest(ticker, *results[ticker])
+        print()
+    return results
+
+
+def cmd_serve(args):
+    import asyncio
+    from src import server
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(server.serve(resolve_tickers(args), args.host,
+                                             args.port, args.forecast))
+    except KeyboardInterrupt:
+        pass
+
+
+def job_to_argv(job):
+    """
+    Turns a job of a spec into the arguments of its subcommand, so jobs get
+    the same defaults and checks as the command line
+    :param job: dict with command, tickers and options
+    :return: list with arguments
+    """
+    job = dict(job)
+    argv = [job.pop("command")]
+    argv += [str(t) for t in job.pop("tickers", [])]
+    for key, value in job.items():
+        option = "--" + key.replace("_", "-")
+        if value is True:
+            argv.append(option)
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            argv += [option] + [str(v) for v in value]
+        else:
+            argv += [option, str(value)]
+    return argv
+
+
+def parse_job(parser, job, defaults):
+    """
+    Parses a job, the defaults of the spec only set options which the
+    subcommand has and the job does not set itself
+    :return: argparse namespace
+    """
+    argv = job_to_argv(job)
+    if argv[0] == "run":
+        raise ValueError("A job can not run another spec")
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        raise ValueError("Invalid job: {}".format(" ".join(argv)))
+    for key, value in defaults.items():
+        if key not in job and hasattr(args, key):
+            setattr(args, key, value)
+    return args
+
+
+def cmd_run(args):
+    """
+    Runs the jobs of a spec one after the other in this process
+    """
+    with open(args.spec) as f:
+        spec = json.load(f)
+    parser = make_parser()
+    defaults = spec.get("defaults", {})
+    timings = []
+    for i, job in enumerate(spec["jobs"]):
+        name = " ".join(job_to_argv(job))
+        print("Job {}/{}: {}".format(i + 1, len(spec["jobs"]), name))
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            job_args = parse_job(parser, job, defaults)
+            with profiling.stage("job", estimator=name):
+                job_args.func(job_args)
+        except Exception as e:
+            status = "failed: {}: {}".format(type(e).__name__, e)
+            if not args.keep_going:
+                raise
+        timings.append((name, status, time.perf_counter() - start))
+    print("{:<50}{:>10}  {}".format("JOB", "TIME [s]", "STATUS"))
+    for name, status, elapsed in timings:
+        print("{:<50}{:>10.1f}  {}".format(name[:49], elapsed, status))
+
+
+def add_tickers(parser):
+    parser.add_argument("tickers", nargs="*",
+                        help="ticker symbols or all, all if none")
+    parser.add_argument("--universe", default=DEFAULT_UNIVERSE)
+
+
+def add_model_options(parser):
+    parser.add_argument("--forecast", type=int, default=FORECAST)
+    parser.add_argument("--selection",
+                        choices=["importance", "mutual_info", "rfe"])
+    parser.add_argument("--search", choices=["halving", "random"])
+    parser.add_argument("--plot", action="store_true",
+                        help="plot the forecast")
+    parser.add_argument("--output", help="directory for forecast .csv files")
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="Stock price prediction")
+    parser.add_argument("--profile", choices=profiling.MODES,
+                        help="time the stages and write a report")
+    parser.add_argument("--profile-dir",
+                        help="directory of the report, {} if not given".format(
+                            path_to_string(profiling.PROFILE_DIR)))
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("tickers", help="list the tickers of a universe")
+    p.add_argument("--universe", default=DEFAULT_UNIVERSE)
+    p.set_defaults(func=cmd_tickers)
+
+    p = sub.add_parser("refresh", help="fetch new stock data")
+    add_tickers(p)
+    p.add_argument("--full", action="store_true",
+                   help="fetch the whole history")
+    p.set_defaults(func=cmd_refresh)
+
+    p = sub.add_parser("features", help="build the regression features")
+    add_tickers(p)
+    p.add_argument("--forecast", type=int, default=FORECAST)
+    p.add_argument("--resolution", help="resolution of intraday bars")
+    p.set_defaults(func=cmd_features)
+
+    p = sub.add_parser("train", help="train new models")
+    add_tickers(p)
+    add_model_options(p)
+    p.add_argument("--classify", action="store_true",
+                   help="also train the buy/sell/hold classifier")
+    p.add_argument("--workers", type=int,
+                   help="train on a process pool with this many cores")
+    p.add_argument("--run-id",
+                   help="name of the pool run to resume, made from the "
+                        "tickers, data and options if not given")
+    p.set_defaults(func=cmd_train)
+
+    p = sub.add_parser("forecast", help="forecast with the stored models")
+    add_tickers(p)
+    add_model_options(p)
+    p.set_defaults(func=cmd_forecast)
+
+    p = sub.add_parser("plot", help="render charts without display")
+    add_tickers(p)
+    p.add_argument("--charts", nargs="+",
+                   choices=["100avg", "exp_return", "OHLC"])
+    p.add_argument("--dpi", type=int, default=100)
+    p.add_argument("--workers", type=int)
+    p.add_argument("--force", action="store_true",
+                   help="render unchanged charts too")
+    p.add_argument("--dax", action="store_true",
+                   help="also render the DAX correlation tables")
+    p.add_argument("--dax-only", action="store_true",
+                   help="only render the DAX correlation tables")
+    p.set_defaults(func=cmd_plot)
+
+    p = sub.add_parser("backtest", help="walk forward backtest")
+    add_tickers(p)
+    p.add_argument("--kind", choices=["reg", "cls"], default="reg")
+    p.add_argument("--forecast", type=int, default=FORECAST)
+    p.add_argument("--min-train", type=int, default=500)
+    p.add_argument("--step", type=int, default=60)
+    p.add_argument("--window", type=int)
+    p.add_argument("--cold", action="store_true",
+                   help="fit every fold from scratch")
+    p.add_argument("--jobs", type=int, default=-1)
+    p.set_defaults(func=cmd_backtest)
+
+    p = sub.add_parser("serve", help="serve forecasts of the stored models "
+                                     "over HTTP")
+    add_tickers(p)
+    p.add_argument("--forecast", type=int, default=FORECAST)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("run", help="run the jobs of a JSON spec")
+    p.add_argument("spec")
+    p.add_argument("--keep-going", action="store_true",
+                   help="continue with the next job after a failure")
+    p.set_defaults(func=cmd_run)
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    if args.profile:
+        profiling.enable(args.profile)
+    else:
+        profiling.from_env()
+    try:
+        args.func(args)
+    finally:
+        profiling.finish(args.profile_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,27 @@
+import data.utils.profiling as profiling
 from data.utils.df_loader import refresh_com_data, refresh_dax_data
 from data.utils.web_scrappers import get_tickers, get_names, ticker_to_name
 from ml.learn import do_regression
+from ml.online import update_online_features
+from ml.scheduler import train_all
 from plotting.utils import plotter as plt
 
 
 def main():
+    profiling.from_env()
     opening = "Hello and welcome to JIYANs \"Stock Analysis\"\n"
 
     print("{:*^30}".format(opening))
 
-    mes = "There are two possibilites to use this programm:\n " \
-          "    - Perform regression on a dax company (1)\n     - Perform analyse over all DAX30 (2)\n"
+    mes = "There are three possibilites to use this programm:\n " \
+          "    - Perform regression on a dax company (1)\n     - Perform analyse over all DAX30 (2)\n" \
+          "     - Train and forecast all DAX30 companies (3)\n"
     print(mes)
 
-    choice = int(input("Please enter 1 or 2 for your choice: "))
+    choice = int(input("Please enter 1, 2 or 3 for your choice: "))
 
-    while choice != 1 and choice != 2:
-        choice = int(input("Please enter 1 or 2 for your choice: "))
+    while choice not in (1, 2, 3):
+        choice = int(input("Please enter 1, 2 or 3 for your choice: "))
 
     refresh = str(input("Do you want to refresh the data? [y|N]: "))
     while refresh != "y" and refresh != "N":
@@ -41,19 +46,33 @@ def main():
         if com is not None:
 
             if refresh == "y":
-                refresh_com_data(com)
+                refresh_com_data(com, incremental=True)
+                # do_regression builds the features from these rows
+                rows = update_online_features(com)
+                print("Updated online features of {} with {} new "
+                      "bars".format(com, len(rows)))
+
+            retrain = str(input("Do you want to retrain the model? [y|N]: "))
+            while retrain != "y" and retrain != "N":
+                retrain = str(input("Do you want to retrain the model? [y|N]: "))
 
             name = ticker_to_name(com)
-            do_regression(ticker=com, name=name, forecast=120)
+            do_regression(ticker=com, name=name, forecast=120,
+                          retrain=retrain == "y")
             plt.plot_100avg(com, name)
             plt.plot_exp_return(com, name)
             plt.plot_ohlc(com, name)
 
-    else:
+    elif choice == 2:
         if refresh == "y":
-            refresh_dax_data()
+            refresh_dax_data(incremental=True)
         plt.plot_dax()
 
+    else:
+        if refresh == "y":
+            refresh_dax_data(incremental=True)
+        train_all(forecast=120)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,356 @@
+"""
+Local HTTP forecast service. The newest model of every ticker and the
+feature rows of its forecast window are loaded once, so a request only
+costs a predict call. Concurrent requests of a ticker are collected for a
+few milliseconds and answered by one predict call. Models and features are
+reloaded in the background when a new model version is saved or the stored
+data of a ticker changes.
+
+    python3 -m src.server --port 8080
+    curl "http://127.0.0.1:8080/forecast?ticker=ADS.DE&days=30"
+    curl "http://127.0.0.1:8080/metrics"
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import data.utils.cache as cache
+import data.utils.profiling as profiling
+import data.utils.store as store
+import data.utils.universe as uv
+from ml import registry
+from ml.preprocessing import FEATURE_VERSION, feature_values, get_reg_data
+
+HOST = "127.0.0.1"
+PORT = 8080
+FORECAST = 120
+# time requests of a ticker are collected before one predict call
+BATCH_WAIT = 0.002
+# seconds between two checks for new models and data
+RELOAD_INTERVAL = 5.0
+# latencies kept for the percentiles
+LATENCY_WINDOW = 10000
+# seconds of the throughput
+THROUGHPUT_WINDOW = 60.0
+# longest accepted request head
+MAX_HEADER_BYTES = 16384
+
+
+def data_signature(ticker):
+    """ Changes whenever the stored data of the ticker is rewritten """
+    path = store.com_dir(ticker) / store.COLUMNS_FILE
+    if not path.exists():
+        return None
+    return cache.file_signature(path)
+
+
+@profiling.profiled("serve_load")
+def load_entry(ticker, forecast_out=FORECAST):
+    """
+    Loads the newest model of a ticker with the selected and scaled
+    feature rows of its forecast window, like do_regression predicts them
+    :return: dict with ticker, version, model, X, as_of and signature or
+    None if no model is stored
+    """
+    meta = registry.find_latest(ticker, forecast_out=forecast_out,
+                                feature_version=FEATURE_VERSION)
+    if meta is None:
+        return None
+    signature = data_signature(ticker)
+    model, _ = registry.load_model(ticker, meta["version"])
+    _, _, _, _, data = get_reg_data(ticker, forecast_out)
+    raw_forecast = feature_values(data)
+    X = meta["scaler"].transform(raw_forecast)[:, meta["indicies"]]
+    return {"ticker": ticker, "version": meta["version"], "model": model,
+            "X": np.ascontiguousarray(X), "as_of": str(data.index[-1]),
+            "signature": signature}
+
+
+class Metrics:
+    """
+    Request latencies, throughput and batch sizes of the service
+    """
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.finished = deque()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.predict_time = 0.0
+        self.reloads = 0
+        self.started = time.time()
+
+    def record(self, latency, ok=True):
+        now = time.perf_counter()
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.latencies.append(latency)
+        self.finished.append(now)
+        while self.finished and self.finished[0] < now - THROUGHPUT_WINDOW:
+            self.finished.popleft()
+
+    def record_batch(self, size, elapsed):
+        self.batches += 1
+        self.batched_requests += size
+        self.predict_time += elapsed
+
+    def snapshot(self):
+        latencies = np.array(self.latencies) * 1000
+        window = min(THROUGHPUT_WINDOW, time.time() - self.started)
+        return {"requests": self.requests,
+                "errors": self.errors,
+                "p50_ms": float(np.percentile(latencies, 50))
+                if len(latencies) else None,
+                "p99_ms": float(np.percentile(latencies, 99))
+                if len(latencies) else None,
+                "throughput_rps": len(self.finished) / max(window, 1e-9),
+                "predict_calls": self.batches,
+                "mean_batch_size": self.batched_requests / self.batches
+                if self.batches else None,
+                "predict_ms": 1000 * self.predict_time / self.batches
+                if self.batches else None,
+                "reloads": self.reloads}
+
+
+class ForecastServer:
+    """
+    asyncio HTTP server answering forecast requests from preloaded models
+    """
+
+    def __init__(self, tickers, forecast_out=FORECAST, batch_wait=BATCH_WAIT,
+                 reload_interval=RELOAD_INTERVAL):
+        self.tickers = list(tickers)
+        self.forecast_out = forecast_out
+        self.batch_wait = batch_wait
+        self.reload_interval = reload_interval
+        self.entries = {}
+        self.pending = {}
+        self.metrics = Metrics()
+        self.server = None
+        self.reloader = None
+
+    def load_all(self):
+        for ticker in self.tickers:
+            entry = load_entry(ticker, self.forecast_out)
+            if entry is None:
+                print("No model of {} with forecast {}".format(
+                    ticker, self.forecast_out))
+                continue
+            self.entries[ticker] = entry
+        print("Loaded {} of {} models".format(len(self.entries),
+                                             len(self.tickers)))
+
+    async def start(self, host=HOST, port=PORT):
+        """
+        Loads the models and starts listening
+        :return: port the server listens on
+        """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.load_all)
+        self.server = await asyncio.start_server(self.handle, host, port,
+                                                 limit=MAX_HEADER_BYTES)
+        self.reloader = asyncio.ensure_future(self.reload_loop())
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.reloader is not None:
+            self.reloader.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def reload_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            for ticker in self.tickers:
+                try:
+                    await self.reload(ticker, loop)
+                except Exception as e:
+                    print("Reload of {} failed: {}: {}".format(
+                        ticker, type(e).__name__, e))
+
+    async def reload(self, ticker, loop):
+        """
+        Swaps in the newest model and features of a ticker if the model
+        version or the stored data changed
+        :return: True if the ticker was reloaded
+        """
+        entry = self.entries.get(ticker)
+        meta = registry.find_latest(ticker, forecast_out=self.forecast_out,
+                                    feature_version=FEATURE_VERSION)
+        if meta is None or (entry is not None and
+                            meta["version"] == entry["version"] and
+                            data_signature(ticker) == entry["signature"]):
+            return False
+        new = await loop.run_in_executor(None, load_entry, ticker,
+                                         self.forecast_out)
+        if new is None:
+            return False
+        self.entries[ticker] = new
+        self.metrics.reloads += 1
+        print("Reloaded {} version {} as of {}".format(ticker, new["version"],
+                                                       new["as_of"]))
+        return True
+
+    async def forecast(self, ticker, days):
+        """
+        Queues a request and waits for the predict call of its batch
+        :return: dict with the forecast
+        """
+        if ticker not in self.entries:
+            raise KeyError("No model of {}".format(ticker))
+        future = asyncio.get_event_loop().create_future()
+        batch = self.pending.setdefault(ticker, [])
+        batch.append((days, future))
+        if len(batch) == 1:
+            asyncio.ensure_future(self.flush(ticker))
+        return await future
+
+    async def flush(self, ticker):
+        """
+        Answers all queued requests of a ticker with one predict call over
+        the rows of the longest requested forecast
+        """
+        await asyncio.sleep(self.batch_wait)
+        batch = self.pending.pop(ticker, [])
+        entry = self.entries[ticker]
+        rows = max(days for days, _ in batch)
+        start = time.perf_counter()
+        try:
+            prediction = await asyncio.get_event_loop().run_in_executor(
+                None, entry["model"].predict, entry["X"][:rows])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.metrics.record_batch(len(batch), time.perf_counter() - start)
+        for days, future in batch:
+            if not future.done():
+                future.set_result({"ticker": ticker,
+                                   "version": entry["version"],
+                                   "as_of": entry["as_of"],
+                                   "days": days,
+                                   "forecast": prediction[:days].tolist()})
+
+    async def route(self, method, target):
+        """
+        :return: HTTP status, JSON body
+        """
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if method != "GET":
+            return 405, {"error": "only GET is supported"}
+        if url.path == "/forecast":
+            ticker = query.get("ticker", "").upper()
+            try:
+                days = int(query.get("days", self.forecast_out))
+            except ValueError:
+                return 400, {"error": "days has to be an integer"}
+            if not 1 <= days <= self.forecast_out:
+                return 400, {"error": "days has to be between 1 and {}".format(
+                    self.forecast_out)}
+            if ticker not in self.entries:
+                return 404, {"error": "no model of {}".format(ticker)}
+            return 200, await self.forecast(ticker, days)
+        if url.path == "/metrics":
+            return 200, self.metrics.snapshot()
+        if url.path == "/tickers":
+            return 200, {t: {"version": e["version"], "as_of": e["as_of"]}
+                         for t, e in self.entries.items()}
+        if url.path == "/health":
+            return 200, {"status": "ok", "models": len(self.entries)}
+        return 404, {"error": "unknown path {}".format(url.path)}
+
+    async def handle(self, reader, writer):
+        """
+        Serves the requests of one keep-alive connection
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    break
+                start = time.perf_counter()
+                lines = head.decode("latin-1").split("\r\n")
+                parts = lines[0].split()
+                headers = dict(line.split(":", 1) for line in lines[1:]
+                               if ":" in line)
+                headers = {k.strip().lower(): v.strip()
+                           for k, v in headers.items()}
+                if len(parts) != 3:
+                    status, body = 400, {"error": "bad request line"}
+                else:
+                    try:
+                        status, body = await self.route(parts[0], parts[1])
+                    except Exception as e:
+                        status, body = 500, {"error": "{}: {}".format(
+                            type(e).__name__, e)}
+                close = headers.get("connection", "").lower() == "close"
+                writer.write(response(status, body, close))
+                await writer.drain()
+                self.metrics.record(time.perf_counter() - start, status < 400)
+                if close:
+                    break
+        finally:
+            writer.close()
+
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def response(status, body, close=False):
+    payload = json.dumps(body).encode()
+    head = "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n" \
+           "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+               status, REASONS[status], len(payload),
+               "close" if close else "keep-alive")
+    return head.encode() + payload
+
+
+async def serve(tickers, host=HOST, port=PORT, forecast_out=FORECAST):
+    server = ForecastServer(tickers, forecast_out)
+    port = await server.start(host, port)
+    print("Serving forecasts on http://{}:{}".format(host, port))
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local forecast service")
+    parser.add_argument("tickers", nargs="*",
+                        help="ticker symbols, all of the universe if none")
+    parser.add_argument("--universe", default=uv.DEFAULT_UNIVERSE)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--forecast", type=int, default=FORECAST)
+    args = parser.parse_args()
+    profiling.from_env()
+
+    tickers = args.tickers or uv.load_universe(args.universe).tickers()
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(serve(tickers, args.host, args.port,
+                                      args.forecast))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Read-only entries of the in-process cache data.utils.cache: every hit
+shares the frozen values of the entry and no caller can change them.
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.cache as cache
+import data.utils.store as store
+
+
+def frames():
+    index = pd.bdate_range("2015-01-01", periods=50, name="Date")
+    rng = np.random.RandomState(0)
+    floats = pd.DataFrame(rng.normal(size=(50, 3)).astype(np.float32),
+                          index=index, columns=["a", "b", "c"])
+    mixed = pd.DataFrame({"Close": rng.normal(size=50),
+                          "Volume": rng.randint(0, 100, 50),
+                          "Flag": rng.uniform(size=50) > 0.5},
+                         index=index, columns=["Close", "Volume", "Flag"])
+    return {"floats": floats, "mixed": mixed}
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp(prefix="test_cache-"))
+        self.cache = cache.LRUCache()
+
+    def tearDown(self):
+        shutil.rmtree(str(self.directory))
+
+    def hit(self, name, value):
+        path = self.directory / name
+        if not path.exists():
+            path.write_bytes(b"0")
+        return self.cache.get(path, lambda: value.copy())
+
+    def assertUnchanged(self, name, expected):
+        pd.testing.assert_frame_equal(self.hit(name, None), expected)
+
+    def test_hits_share_read_only_values(self):
+        for name, df in frames().items():
+            first, second = self.hit(name, df), self.hit(name, df)
+            pd.testing.assert_frame_equal(first, df)
+            self.assertTrue(cache.is_frozen(first), name)
+            for column in df.columns:
+                values = first[column].values
+                self.assertFalse(values.flags.writeable, column)
+                self.assertTrue(np.shares_memory(
+                    values, second[column].values), column)
+
+    def test_callers_can_not_change_the_entry(self):
+        for name, df in frames().items():
+            hit = self.hit(name, df)
+            try:
+                hit.iloc[0, 0] = 99
+            except ValueError:
+                pass
+            hit["new"] = 1
+            hit.index = range(len(hit))
+            self.assertUnchanged(name, df)
+            with self.assertRaises(ValueError):
+                hit["Close" if name == "mixed" else "a"].values[0] = 99
+            self.assertUnchanged(name, df)
+
+    def test_extension_dtypes_are_copied(self):
+        df = pd.DataFrame({"ticker": pd.Categorical(["A", "B"] * 25),
+                           "close": np.arange(50.0)})
+        hit = self.hit("categorical", df)
+        self.assertFalse(cache.is_frozen(hit))
+        hit.iloc[0, 1] = 99
+        self.assertUnchanged("categorical", df)
+
+    def test_size_accounting(self):
+        sizes = 0
+        for name, df in frames().items():
+            self.hit(name, df)
+            sizes += int(df.memory_usage(index=True).sum())
+        self.assertEqual(self.cache.stats()["bytes"], sizes)
+        self.cache.invalidate(self.directory / "floats")
+        self.assertEqual(self.cache.stats()["entries"], 1)
+
+    def test_update_counts_bytes(self):
+        parent = cache.LRUCache()
+        for name, df in frames().items():
+            path = self.directory / name
+            path.write_bytes(b"0")
+            parent.get(path, lambda: df)
+        self.cache.update(parent.entries)
+        self.assertEqual(self.cache.stats()["bytes"],
+                         parent.stats()["bytes"])
+        self.cache.update(parent.entries)
+        self.assertEqual(self.cache.stats(), dict(
+            parent.stats(), hits=0, misses=0))
+        pd.testing.assert_frame_equal(self.hit("floats", None),
+                                      frames()["floats"])
+        self.cache.invalidate(self.directory / "floats")
+        self.cache.invalidate(self.directory / "mixed")
+        self.assertEqual(self.cache.stats()["bytes"], 0)
+
+    def test_stored_columns_are_str(self):
+        npy_dir = store.NPY_DIR
+        store.NPY_DIR = self.directory
+        try:
+            store.write_com(frames()["mixed"], "T.DE")
+            columns = store.get_columns("T.DE")
+        finally:
+            store.NPY_DIR = npy_dir
+        self.assertEqual(columns, ["Close", "Volume", "Flag"])
+        self.assertEqual({type(c) for c in columns}, {str})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Parity of the batch feature engine ml.features with the original pandas
+indicators of add_new_features on synthetic OHLCV frames.
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ml import features as ft
+
+FORECAST = 20
+ROWS = [700, 450, 30]
+RTOL = 1e-7
+ATOL = 1e-9
+
+
+def synthetic_frame(rows, rng):
+    """ Random walk OHLCV bars with a few missing bars and zero volumes """
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, rows)))
+    spread = close * rng.uniform(0, 0.03, rows)
+    df = pd.DataFrame({"Open": close + rng.normal(0, 1, rows) * spread,
+                       "High": close + spread,
+                       "Low": close - spread,
+                       "Close": close,
+                       "Volume": rng.randint(0, 10000, rows).astype(float),
+                       "Adj Close": close * 0.9},
+                      index=pd.bdate_range("2015-01-01", periods=rows,
+                                           name="Date"))
+    for start in rng.randint(0, rows - 5, 3):
+        df.iloc[start:start + rng.randint(1, 5)] = np.nan
+    return df
+
+
+def pandas_features(df_org, forecast_out):
+    """ The indicators of add_new_features with the original pandas code """
+    df = df_org.loc[:, ["Adj Close", "Volume"]]
+    df["high_low_pct"] = (df_org["High"] - df_org["Low"]) / df_org[
+        "Close"] * 100.0
+    df["change"] = np.log(df_org["Adj Close"]) - np.log(
+        df_org["Adj Close"].shift(1))
+    df["pct_change"] = (df_org["Close"] - df_org["Open"]) / df_org[
+        "Open"] * 100.0
+    df["daily_return"] = (df_org["Close"] / df_org["Open"]) - 1
+    df["Volume"] = np.log(df_org["Volume"])
+    df["5d_mean_log"] = df_org["Volume"].rolling(5).mean().apply(np.log)
+    df["volume_mov_avg"] = (df_org["Volume"] / df_org["Volume"].rolling(
+        200).mean()) - 1
+    df["close_vs_moving"] = (df_org["Close"] / df_org["Close"].ewm(
+        span=50).mean()) - 1
+    df["z_score"] = (df_org["Close"] - df_org["Close"].rolling(
+        window=200, min_periods=20).mean()) / df_org["Close"].rolling(
+        window=200, min_periods=20).std()
+    df["signing"] = df["pct_change"].apply(np.sign)
+    df["plus_minus"] = df["signing"].rolling(20).sum()
+    df["label"] = df["Adj Close"].shift(-forecast_out).round(3)
+    df["label"] = df["label"].interpolate(limit=3, limit_direction="both")
+    return df.replace([np.inf, -np.inf], np.nan)
+
+
+class FeatureParityTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.frames = {"T{}".format(i): synthetic_frame(rows, rng)
+                       for i, rows in enumerate(ROWS)}
+
+    def assertClose(self, actual, expected):
+        self.assertEqual(list(actual.columns), list(expected.columns))
+        for column in expected.columns:
+            np.testing.assert_allclose(actual[column].values,
+                                       expected[column].values, rtol=RTOL,
+                                       atol=ATOL, err_msg=column)
+
+    def test_raw_indicators(self):
+        out = ft.compute_features(self.frames, FORECAST, fill=False,
+                                  dtype=np.float64)
+        for ticker, df in self.frames.items():
+            expected = pandas_features(df, FORECAST)
+            self.assertTrue(out[ticker].index.equals(df.index))
+            self.assertClose(out[ticker], expected)
+
+    def test_filled_with_means(self):
+        out = ft.compute_features(self.frames, FORECAST, dtype=np.float64)
+        for ticker, df in self.frames.items():
+            expected = pandas_features(df, FORECAST)
+            expected = expected.fillna(expected.mean())
+            self.assertClose(out[ticker], expected)
+
+    def test_float32_storage(self):
+        out = ft.compute_features(self.frames, FORECAST)
+        expected = ft.compute_features(self.frames, FORECAST,
+                                       dtype=np.float64)
+        for ticker in self.frames:
+            self.assertEqual(set(out[ticker].dtypes), {np.dtype(np.float32)})
+            np.testing.assert_allclose(out[ticker].values,
+                                       expected[ticker].values, rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
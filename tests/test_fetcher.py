@@ -0,0 +1,152 @@
+"""
+Tests of the concurrent fetcher and HttpCsvReader against a fake HTTP
+server on localhost, which answers with scripted 429/5xx responses and
+delays.
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+import threading
+import time
+import unittest
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pandas as pd
+
+import data.utils.fetcher as fetcher
+import data.utils.web_scrappers as ws
+
+CSV = ("Date,Open,High,Low,Close,Adj Close,Volume\n"
+       "2019-01-02,1.0,2.0,0.5,1.5,1.5,100\n"
+       "2019-01-03,1.5,2.5,1.0,2.0,2.0,200\n")
+START = pd.Timestamp("2019-01-01")
+END = pd.Timestamp("2019-01-04")
+# fast backoff for the tests
+BASE = 0.001
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeYahoo(BaseHTTPRequestHandler):
+    """
+    Serves CSV for /<ticker>. The script of a ticker lists the answers of
+    its requests in order: an HTTP status code or a delay in seconds,
+    afterwards every request gets the CSV.
+    """
+    protocol_version = "HTTP/1.1"
+    scripts = {}
+    requests = defaultdict(list)
+    lock = threading.Lock()
+
+    def do_GET(self):
+        ticker = self.path.split("?")[0].strip("/")
+        with self.lock:
+            self.requests[ticker].append(time.monotonic())
+            script = self.scripts.get(ticker, [])
+            answer = script.pop(0) if script else 200
+        if isinstance(answer, float):
+            time.sleep(answer)
+            answer = 200
+        body = CSV.encode() if answer == 200 else b"error"
+        self.send_response(answer)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetcherTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingServer(("127.0.0.1", 0), FakeYahoo)
+        cls.thread = threading.Thread(target=cls.server.serve_forever,
+                                      daemon=True)
+        cls.thread.start()
+        cls.url = "http://127.0.0.1:{}/".format(cls.server.server_port) + "{}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeYahoo.scripts = {}
+        FakeYahoo.requests.clear()
+
+    def fetch(self, tickers, scripts, timeout=fetcher.TIMEOUT,
+              rate=None, retries=fetcher.RETRIES):
+        FakeYahoo.scripts = {t: list(s) for t, s in scripts.items()}
+        reader = ws.HttpCsvReader(fetcher.make_session(timeout=timeout),
+                                  self.url)
+        return fetcher.fetch_all(
+            tickers, lambda ticker: reader(ticker, "yahoo", START, END),
+            workers=4, retries=retries, rate=rate, base=BASE)
+
+    def test_reader_parses_csv_and_sends_range(self):
+        report = self.fetch(["A"], {})
+        df = report.succeeded["A"]
+        self.assertEqual(list(df.columns),
+                         ["Open", "High", "Low", "Close", "Adj Close",
+                          "Volume"])
+        self.assertEqual(len(df), 2)
+        self.assertIsInstance(df.index, pd.DatetimeIndex)
+
+    def test_retries_after_429_and_5xx(self):
+        report = self.fetch(["A", "B"], {"A": [429, 503, 500]})
+        self.assertEqual(sorted(report.succeeded), ["A", "B"])
+        self.assertEqual(report.attempts, {"A": 4, "B": 1})
+        self.assertEqual(len(FakeYahoo.requests["A"]), 4)
+        self.assertEqual(report.failed, {})
+
+    def test_gives_up_after_retries(self):
+        report = self.fetch(["A", "B"], {"B": [503] * 10}, retries=2)
+        self.assertEqual(list(report.succeeded), ["A"])
+        self.assertIn("B", report.failed)
+        self.assertIn("HTTPError", report.failed["B"])
+        self.assertEqual(report.attempts["B"], 3)
+        self.assertEqual(len(FakeYahoo.requests["B"]), 3)
+        self.assertIn("Fetched 1 of 2 tickers", str(report))
+        self.assertIn("failed B after 3 attempts", str(report))
+
+    def test_timeout_is_retried(self):
+        report = self.fetch(["A"], {"A": [1.0]}, timeout=0.2)
+        self.assertIn("A", report.succeeded)
+        self.assertEqual(report.attempts["A"], 2)
+
+    def test_rate_limit_spaces_requests(self):
+        rate = 20.0
+        tickers = ["T{}".format(i) for i in range(6)]
+        report = self.fetch(tickers, {}, rate=rate)
+        self.assertEqual(len(report.succeeded), len(tickers))
+        times = sorted(t for ticker in tickers
+                       for t in FakeYahoo.requests[ticker])
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        # requests leave the limiter 1 / rate apart, the server sees them
+        # with some jitter of the threads
+        self.assertGreater(min(gaps), 0.5 / rate)
+        self.assertGreater(times[-1] - times[0],
+                           0.9 * (len(tickers) - 1) / rate)
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_delay_grows_and_is_capped(self):
+        for attempt in range(10):
+            limit = min(fetcher.BACKOFF_CAP,
+                        fetcher.BACKOFF_BASE * 2 ** attempt)
+            for _ in range(20):
+                delay = fetcher.backoff_delay(attempt)
+                self.assertGreaterEqual(delay, 0)
+                self.assertLessEqual(delay, limit)
+
+
+if __name__ == "__main__":
+    unittest.main()
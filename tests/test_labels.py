@@ -0,0 +1,113 @@
+"""
+Equivalence of the vectorized buy/sell/hold labels of ml.labels with
+buy_sell_hold mapped over the columns of process_data_for_labels on a
+seeded synthetic panel.
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+import unittest
+from collections import Counter
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import data.utils.df_loader as dl
+from ml import labels
+from ml import preprocessing as pp
+
+TICKERS = ["A.DE", "B.DE", "C.DE", "D.DE", "E.DE"]
+DAYS = 400
+
+
+def synthetic_panel(seed=0):
+    """
+    Random walk prices with missing prices, zero prices and tickers which
+    start late, stored as PANEL_DTYPE like the pickled panel
+    """
+    rng = np.random.RandomState(seed)
+    prices = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (DAYS, len(TICKERS))),
+                                   axis=0))
+    prices[rng.uniform(size=prices.shape) < 0.03] = np.nan
+    prices[rng.uniform(size=prices.shape) < 0.01] = 0
+    prices[:60, 1] = np.nan
+    prices[:250, 4] = np.nan
+    return pd.DataFrame(prices.astype(dl.PANEL_DTYPE),
+                        index=pd.bdate_range("2015-01-01", periods=DAYS,
+                                             name="Date"),
+                        columns=TICKERS)
+
+
+def loop_labels(ticker, hm_days=labels.HM_DAYS,
+                requirement=labels.REQUIREMENT):
+    """ buy_sell_hold mapped over the columns of process_data_for_labels """
+    df = pp.process_data_for_labels(ticker, hm_days)
+    return np.array(list(map(
+        lambda *args: pp.buy_sell_hold(*args, requirement=requirement),
+        *[df["{}_{}d".format(ticker, i)] for i in range(1, hm_days + 1)])))
+
+
+def loop_cls_data(ticker):
+    """ Former get_cls_data: buy_sell_hold mapped over seven columns """
+    df = pp.process_data_for_labels(ticker)
+    df["{}_target".format(ticker)] = loop_labels(ticker)
+    vals = df["{}_target".format(ticker)].values.tolist()
+    print("Dataspread:", Counter([str(i) for i in vals]))
+    df = df.fillna(0)
+    df = df.replace([np.inf, -np.inf], np.nan)
+    df = df.dropna()
+    df_vals = df[TICKERS].pct_change()
+    df_vals = df_vals.replace([np.inf, -np.inf], 0)
+    df_vals = df_vals.fillna(0)
+    return df_vals.values, df["{}_target".format(ticker)].values, df
+
+
+class LabelEquivalenceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.panel = synthetic_panel()
+        patches = [mock.patch.object(dl, "get_dax__as_df",
+                                     lambda: self.panel.copy()),
+                   mock.patch.object(pp.ws, "get_tickers",
+                                     lambda: tuple(TICKERS))]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_label_matrix_equals_loop(self):
+        matrix = labels.label_panel(self.panel)
+        for ticker in TICKERS:
+            np.testing.assert_array_equal(matrix[ticker].values,
+                                          loop_labels(ticker), ticker)
+
+    def test_horizon_and_threshold(self):
+        for hm_days, requirement in [(1, 0.02), (3, 0.0), (10, 0.05)]:
+            matrix = labels.label_matrix(self.panel.values, hm_days,
+                                         requirement)
+            for j, ticker in enumerate(TICKERS):
+                np.testing.assert_array_equal(
+                    matrix[:, j], loop_labels(ticker, hm_days, requirement),
+                    "{} {} {}".format(ticker, hm_days, requirement))
+
+    def test_label_grid_equals_label_matrix(self):
+        hm_days, requirements = [7, 2, 5], [0.05, 0.0, 0.02]
+        grid = labels.label_grid(self.panel.values, hm_days, requirements)
+        for i, hm in enumerate(hm_days):
+            for k, requirement in enumerate(requirements):
+                np.testing.assert_array_equal(
+                    grid[i, k], labels.label_matrix(self.panel.values, hm,
+                                                    requirement))
+
+    def test_get_cls_data_equals_loop(self):
+        for ticker in TICKERS:
+            X_old, y_old, df_old = loop_cls_data(ticker)
+            X_new, y_new, df_new = pp.get_cls_data(ticker)
+            self.assertTrue(df_old.index.equals(df_new.index), ticker)
+            np.testing.assert_array_equal(y_new, y_old, ticker)
+            np.testing.assert_allclose(X_new, X_old, rtol=1e-6, atol=1e-6,
+                                       err_msg=ticker)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Persistence of the online features of ml.online: updates append only the
+rows of the new bars and the stored history equals the batch indicators.
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.cache as cache
+import data.utils.store as store
+from ml import online
+
+from tests.test_features import synthetic_frame
+
+ROWS = 600
+UPDATES = [400, 401, 450, 600]
+
+
+class OnlineFeaturesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp(prefix="test_online-"))
+        self.npy_dir = store.NPY_DIR
+        store.NPY_DIR = self.directory
+        cache.clear()
+        self.df = synthetic_frame(ROWS, np.random.RandomState(0))
+        self.ticker = "T.DE"
+
+    def tearDown(self):
+        store.NPY_DIR = self.npy_dir
+        cache.clear()
+        shutil.rmtree(str(self.directory))
+
+    def update(self, rows):
+        store.write_com(self.df.iloc[:rows], self.ticker)
+        return online.update_online_features(self.ticker)
+
+    def test_updates_append_new_rows(self):
+        column = online.feature_file(self.ticker, "z_score")
+        stored = 0
+        for rows in UPDATES:
+            head = column.read_bytes() if column.exists() else b""
+            new_rows = self.update(rows)
+            self.assertEqual(len(new_rows), rows - stored)
+            self.assertEqual(online.stored_rows(self.ticker), rows)
+            # the stored rows are kept as they are
+            self.assertEqual(column.read_bytes()[:len(head)], head)
+            stored = rows
+
+        history = online.load_features(self.ticker)
+        self.assertTrue(history.index.equals(self.df.index))
+        self.assertEqual(online.verify_online_features(self.df, history), [])
+
+    def test_unfinished_update_is_dropped(self):
+        self.update(400)
+        state = online.load_state(self.ticker)
+        extra = online.OnlineFeatures()
+        rows = [extra.update(date, *values) for date, values in zip(
+            self.df.index[:50], self.df[online.FIELDS].values.tolist())]
+        # rows appended without saving the state, like an update which died
+        online.save_features(self.ticker, pd.DataFrame(
+            rows, index=self.df.index[:50], columns=online.ONLINE_COLUMNS),
+            state.rows)
+        self.assertEqual(len(online.load_features(self.ticker)), 400)
+
+        self.update(ROWS)
+        self.assertEqual(online.stored_rows(self.ticker), ROWS)
+        history = online.load_features(self.ticker)
+        self.assertTrue(history.index.equals(self.df.index))
+        self.assertEqual(online.verify_online_features(self.df, history), [])
+
+    def test_rewritten_history_starts_over(self):
+        self.update(450)
+        self.df.iloc[:, :] = self.df.values * 1.1
+        self.assertEqual(len(self.update(ROWS)), ROWS)
+        history = online.load_features(self.ticker)
+        self.assertEqual(online.stored_rows(self.ticker), ROWS)
+        self.assertEqual(online.verify_online_features(self.df, history), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+Run ids of ml.scheduler: a run started again with the same tickers, data
+and options resumes from its checkpoints.
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+import data.utils.cache as cache
+import data.utils.store as store
+from ml import scheduler
+
+from tests.test_features import synthetic_frame
+
+TICKERS = ["A.DE", "B.DE"]
+
+
+class RunIdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp(prefix="test_scheduler-"))
+        self.npy_dir = store.NPY_DIR
+        store.NPY_DIR = self.directory
+        rng = np.random.RandomState(0)
+        self.frames = {ticker: synthetic_frame(100, rng)
+                       for ticker in TICKERS}
+        for ticker, df in self.frames.items():
+            store.write_com(df, ticker)
+
+    def tearDown(self):
+        store.NPY_DIR = self.npy_dir
+        cache.clear()
+        shutil.rmtree(str(self.directory))
+
+    def run_id(self, tickers=TICKERS, forecast=120, retrain=True):
+        return scheduler.make_run_id(tickers, forecast, retrain, False, "dax")
+
+    def test_same_run_same_id(self):
+        run_id = self.run_id()
+        self.assertEqual(self.run_id(), run_id)
+        self.assertEqual(self.run_id(list(reversed(TICKERS))), run_id)
+        self.assertTrue(run_id.startswith("120-"))
+
+    def test_new_run_new_id(self):
+        run_id = self.run_id()
+        self.assertNotEqual(self.run_id(TICKERS[:1]), run_id)
+        self.assertNotEqual(self.run_id(forecast=60), run_id)
+        self.assertNotEqual(self.run_id(retrain=False), run_id)
+        with mock.patch.object(scheduler, "FEATURE_VERSION", -1):
+            self.assertNotEqual(self.run_id(), run_id)
+        store.append_com(self.frames["A.DE"].iloc[-1:] * 1.1, "A.DE")
+        self.assertNotEqual(self.run_id(), run_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Exactness of the streamed panel processing: the returns, labels and
+features written block by block have to equal compute_panel and
+compute_features over the whole history, for any block size.
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import data.utils.cache as cache
+import data.utils.df_loader as dl
+import data.utils.store as store
+from ml import features as ft
+from ml import streaming
+
+ROWS = 1500
+FORECAST = 30
+BLOCK_SIZES = [10, 97, 300, 5000]
+
+
+def synthetic_bars(dates, rng):
+    """
+    Random walk OHLCV bars with gaps of missing prices and volumes, which
+    the rolling windows skip and the label interpolates
+    """
+    n = len(dates)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    spread = close * rng.uniform(0, 0.02, n)
+    df = pd.DataFrame({"Open": close + rng.normal(0, 1, n) * spread,
+                       "High": close + spread,
+                       "Low": close - spread,
+                       "Close": close,
+                       "Volume": rng.randint(100, 10000, n).astype(float),
+                       "Adj Close": close},
+                      index=pd.DatetimeIndex(dates, name="Date"))
+    for length in [1, 2, 5, 12, 40]:
+        start = rng.randint(0, n - length)
+        df.iloc[start:start + length] = np.nan
+    df.iloc[-3:, df.columns.get_loc("Adj Close")] = np.nan
+    return df
+
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp(prefix="test_streaming-"))
+        self.paths = store.NPY_DIR, streaming.STREAM_DIR
+        store.NPY_DIR = self.directory / "NPY_DIR"
+        streaming.STREAM_DIR = self.directory / "STREAM_DIR"
+        cache.clear()
+
+        rng = np.random.RandomState(0)
+        dates = pd.bdate_range("2010-01-01", periods=ROWS)
+        self.tickers = ["S{}.XX".format(i) for i in range(3)]
+        for i, ticker in enumerate(self.tickers):
+            keep = rng.uniform(size=ROWS) > 0.05
+            # later first days, the last ticker starts after a few segments
+            keep[:i * 300] = False
+            store.write_com(synthetic_bars(dates[keep], rng), ticker)
+
+    def tearDown(self):
+        store.NPY_DIR, streaming.STREAM_DIR = self.paths
+        cache.clear()
+        shutil.rmtree(str(self.directory))
+
+    def in_memory(self):
+        df = dl.build_panel(self.tickers, cached=False)
+        outputs = streaming.compute_panel(df.values)
+        frames = {ticker: store.read_com(ticker, ft.FIELDS, mmap=False)
+                  for ticker in self.tickers}
+        features = ft.compute_features(frames, FORECAST, fill=False)
+        outputs[streaming.FEATURES] = streaming.align_features(
+            features, df.index.values, self.tickers)
+        return df.index, outputs
+
+    def assertSame(self, actual, expected, msg):
+        self.assertEqual(actual.dtype, expected.dtype, msg)
+        np.testing.assert_array_equal(actual, expected, err_msg=msg)
+
+    def test_stream_equals_whole_history(self):
+        dates, expected = self.in_memory()
+        self.assertTrue(np.isfinite(
+            expected[streaming.FEATURES][:, :, -1]).any())
+        for block_size in BLOCK_SIZES:
+            rows = streaming.write_stream("test", self.tickers, block_size,
+                                          forecast_out=FORECAST)
+            stream_dates, outputs, meta = streaming.load_stream("test")
+            self.assertEqual(rows, len(dates))
+            self.assertTrue(stream_dates.equals(dates))
+            self.assertEqual(meta["columns"], ft.feature_columns())
+            for output, values in expected.items():
+                self.assertSame(np.asarray(outputs[output]), values,
+                                "{} of blocks of {}".format(output,
+                                                            block_size))
+            del outputs
+
+    def test_windows_only_depend_on_their_segments(self):
+        rng = np.random.RandomState(1)
+        x = 50 + np.cumsum(rng.normal(0, 1, (2, 1000)), axis=1)
+        x[:, 300:310] = np.nan
+        x[0, 700:] = np.nan
+        start, end = 2 * ft.SEGMENT, 900
+        for func in (ft.rolling_std, ft.rolling_mean, ft.rolling_sum):
+            whole = func(x, 200, min_periods=20)
+            part = func(x[:, start:end], 200, min_periods=20)
+            np.testing.assert_array_equal(
+                part[:, ft.SEGMENT:], whole[:, start + ft.SEGMENT:end],
+                err_msg=func.__name__)
+
+    def test_label_interpolation_across_blocks(self):
+        # blocks of 7 rows cut through the gaps of missing prices
+        stream = streaming.FeatureStream(self.tickers[0], FORECAST)
+        index = streaming.load_index(self.tickers[0])
+        labels = np.concatenate([
+            stream.next_block(index[last])[1][:, -1]
+            for last in range(5, len(index), 7)] + [
+            stream.next_block(index[-1])[1][:, -1]])
+        frames = {self.tickers[0]: store.read_com(self.tickers[0], ft.FIELDS,
+                                                  mmap=False)}
+        expected = ft.compute_features(frames, FORECAST, fill=False)[
+            self.tickers[0]]["label"].values
+        np.testing.assert_array_equal(labels, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Offline tests of the incremental refresh with a LocalDataReader over .csv
+files in a temporary directory.
+
+Run from the repository root:
+    python3 -m pytest tests
+"""
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+import data.utils.cache as cache
+import data.utils.df_loader as dl
+import data.utils.store as store
+import data.utils.web_scrappers as ws
+
+TICKER = "ADS.DE"
+
+
+class RecordingReader:
+    """
+    LocalDataReader which records the requested date ranges
+    """
+
+    def __init__(self, directory):
+        self.reader = ws.LocalDataReader(directory)
+        self.calls = []
+
+    def __call__(self, ticker, data_source, start, end):
+        self.calls.append((pd.Timestamp(start), pd.Timestamp(end)))
+        return self.reader(ticker, data_source, start, end)
+
+
+class UpdateComDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = store.read_csv(TICKER)
+        self.directory = Path(tempfile.mkdtemp(prefix="test_refresh-"))
+        self.paths = store.NPY_DIR, store.COM_DATA_DIR
+        store.NPY_DIR = self.directory / "NPY_DIR"
+        store.COM_DATA_DIR = self.directory / "DAX30"
+        self.source = self.directory / "source"
+        self.source.mkdir()
+        self.write_source(self.history)
+        self.reader = RecordingReader(self.source)
+        cache.clear()
+
+    def tearDown(self):
+        store.NPY_DIR, store.COM_DATA_DIR = self.paths
+        cache.clear()
+        shutil.rmtree(str(self.directory))
+
+    def write_source(self, df):
+        df.to_csv(str(self.source / "{}.csv".format(TICKER)),
+                  date_format="%Y-%m-%d")
+
+    def update(self, end):
+        return ws.update_com_data(TICKER, end=pd.Timestamp(end),
+                                  reader=self.reader)
+
+    def stored(self):
+        return dl.get_com_as_df(TICKER)
+
+    def test_full_then_append(self):
+        split = self.history.index[-100]
+        self.assertEqual(self.update(split), "full")
+        self.assertEqual(self.stored().index[-1], split)
+
+        self.assertEqual(self.update(self.history.index[-1]), "append")
+        # the overlap is fetched again to detect drift
+        start, _ = self.reader.calls[-1]
+        self.assertEqual(start, split - pd.Timedelta(days=ws.OVERLAP_DAYS))
+        stored = self.stored()
+        self.assertTrue(stored.index.equals(self.history.index))
+        self.assertTrue(stored.index.is_unique)
+        # the store keeps the index in nanoseconds, newer pandas parses
+        # the .csv dates in microseconds
+        expected = self.history.copy()
+        expected.index = expected.index.astype("datetime64[ns]")
+        pd.testing.assert_frame_equal(stored[self.history.columns],
+                                      expected, check_names=False)
+
+    def test_unchanged(self):
+        end = self.history.index[-1]
+        self.update(end)
+        self.assertEqual(self.update(end), "unchanged")
+        self.assertEqual(len(self.stored()), len(self.history))
+
+    def test_drift_within_tolerance_appends(self):
+        split = self.history.index[-100]
+        self.update(split)
+        drifted = self.history.copy()
+        drifted["Adj Close"] *= 1 + ws.DRIFT_TOLERANCE / 10
+        self.write_source(drifted)
+        self.assertEqual(self.update(self.history.index[-1]), "append")
+        stored = self.stored()
+        self.assertEqual(len(stored), len(self.history))
+        # the stored history before the overlap is kept
+        first = self.history.index[0]
+        self.assertEqual(stored.loc[first, "Adj Close"],
+                         self.history.loc[first, "Adj Close"])
+
+    def test_drift_rewrites_history(self):
+        split = self.history.index[-100]
+        self.update(split)
+        drifted = self.history.copy()
+        drifted["Adj Close"] *= 1 + ws.DRIFT_TOLERANCE * 10
+        self.write_source(drifted)
+        self.assertEqual(self.update(self.history.index[-1]), "rewrite")
+        stored = self.stored()
+        self.assertEqual(len(stored), len(self.history))
+        self.assertAlmostEqual(stored["Adj Close"].iloc[0],
+                               drifted["Adj Close"].iloc[0])
+
+    def test_rewrite_keeps_ticker_readable(self):
+        self.update(self.history.index[-1])
+        path = store.com_dir(TICKER)
+        store.write_com(self.history, TICKER)
+        self.assertTrue(path.is_symlink())
+        # only the current version is left
+        versions = [p for p in store.NPY_DIR.iterdir()
+                    if p.name.startswith(TICKER + ".")]
+        self.assertEqual(versions, [path.resolve()])
+        self.assertEqual(len(store.read_com(TICKER)), len(self.history))
+
+
+if __name__ == "__main__":
+    unittest.main()